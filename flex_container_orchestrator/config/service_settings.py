@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, Field
 
 from flex_container_orchestrator.config.base_settings import \
     BaseServiceSettings
@@ -14,15 +16,224 @@ class TimeSettings(BaseModel):
     tfreq_f: int
     # Frequency of IFS runs in hours
     tfreq: int
+    # Last disseminated step per IFS run hour (e.g. shorter scda runs at 06/18),
+    # runs without an entry are assumed to cover any lead time
+    cycle_horizons: dict[int, int] = {}
+
+class ProductSettings(BaseModel):
+    # Identifier of the product, tagged on its Flexpart configurations
+    name: str = Field(pattern=r"^[A-Za-z0-9-]+$")
+    time_settings: TimeSettings
 
 class DBTableSettings(BaseModel):
     path: str
     name: str
 
+class ContainerLogSettings(BaseModel):
+    # Directory receiving one log file per container run
+    path: str
+    # Size in bytes after which a run log file is rotated
+    max_bytes: int = 10_000_000
+    # Number of rotated files kept per run
+    backup_count: int = 3
+    # Number of trailing output lines kept in memory for error reports
+    tail_lines: int = 200
+
+class LocalStoreSettings(BaseModel):
+    # Directory of the orchestrator's own SQLite database (run history, checkpoints...)
+    path: str
+    name: str = "orchestrator-db"
+
+class StageSettings(BaseModel):
+    # Maximum runtime of a single attempt in seconds, None to wait indefinitely
+    timeout: float | None = None
+    # Number of attempts before giving up on the stage
+    max_attempts: int = 1
+    # Delay before the first retry in seconds, doubled with every further attempt
+    backoff_base: float = 10
+    # Upper bound of the delay between two attempts in seconds
+    backoff_max: float = 300
+    # Kill an attempt running longer than this factor times the median historical duration
+    straggler_factor: float | None = None
+    # Number of successful runs required before straggler detection kicks in
+    straggler_min_history: int = 5
+
+class S3BucketSettings(BaseModel):
+    input: str = "flexpart-input"
+    flexprep_output: str = "flexprep-output"
+    flexpart_output: str = "flexpart-output"
+    pyflexplot_output: str = "pyflexplot-output"
+
+class S3Settings(BaseModel):
+    endpoint_url: str
+    buckets: S3BucketSettings = S3BucketSettings()
+
+class PyflexplotSettings(BaseModel):
+    # "single": one container renders all presets of a release site,
+    # "parallel": one container per preset, sharing a local copy of the Flexpart output
+    mode: Literal["single", "parallel"] = "single"
+    # Host directory holding the per-run local copies of the Flexpart output
+    scratch_path: str
+    # Pyflexplot presets to render, per release site
+    presets: dict[str, list[str]] = {"BEZ": ["opr/ifs-hres-eu/all_pdf"]}
+
+class MetricsSettings(BaseModel):
+    # Serve health and Prometheus metrics from the watch process
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9108
+
+class ProfilingSettings(BaseModel):
+    # Directory receiving one sub-directory of profiling results per profiled run
+    path: str
+
+class FlexprepShardSettings(BaseModel):
+    # Split the input objects of a step into shards pre-processed by parallel flexprep containers
+    enabled: bool = False
+    # Input bytes per shard, the number of shards grows with the size of the step up to max_shards
+    shard_bytes: int = 1_000_000_000
+    max_shards: int = 4
+    # Environment variables passing the object keys of a shard (comma-separated) and the shard
+    # ("index/count") to flexprep, which then leaves marking the step as processed to the orchestrator
+    keys_variable: str = "FLEXPREP_INPUT_KEYS"
+    shard_variable: str = "FLEXPREP_SHARD"
+    # Environment variable passing the object key in the flexprep output bucket a shard writes its part
+    # of the step's met file to, the orchestrator concatenates the parts into the met file
+    output_key_variable: str = "FLEXPREP_OUTPUT_KEY"
+
+class PreflightSettings(BaseModel):
+    # Skip the flexprep container of steps already marked as processed in the flexprep database
+    enabled: bool = True
+    # Also require the pre-processed met file in the flexprep output bucket, see MetCacheSettings.key_template
+    check_output: bool = False
+
+class DeduplicationSettings(BaseModel):
+    # Suppress redelivered notifications of events already handled
+    enabled: bool = True
+    # Hours during which a handled event suppresses duplicates
+    ttl_hours: float = 72
+    # Minutes after which the unfinished claim of a crashed run may be taken over
+    lease_minutes: float = 360
+
+class ConcurrencySettings(BaseModel):
+    # Bounds and starting point of the number of concurrently running containers of a service
+    min_limit: int = 1
+    max_limit: int = 4
+    initial_limit: int = 1
+    # Limit added when the host has headroom and all slots are busy
+    increase_step: int = 1
+    # Factor applied to the limit under pressure
+    decrease_factor: float = 0.5
+    # Pressure thresholds: 1-minute load average per CPU, available memory fraction and
+    # recent median run duration relative to the historical median
+    max_load_per_cpu: float = 1.5
+    min_available_memory: float = 0.1
+    max_duration_inflation: float = 1.5
+    # Minimum number of seconds between two adjustments of the limit
+    adjust_interval: float = 60
+    # Seconds between two attempts to acquire a slot
+    poll_interval: float = 5
+
+class SupersessionSettings(BaseModel):
+    # Drop queued and stop running Flexpart windows whose inputs were superseded by a newer IFS run
+    enabled: bool = False
+    # Also drop windows whose newest input run lags the newest processed IFS run by more than
+    # this many hours, None to only drop windows with superseded inputs
+    max_lag_hours: float | None = None
+    # Seconds between two checks of a running Flexpart window
+    check_interval: float = 300
+
+class MetCacheSettings(BaseModel):
+    # Keep the pre-processed met files on local disk, shared read-only by all Flexpart containers
+    enabled: bool = False
+    # Host directory of the cache
+    path: str
+    # Byte budget of the cache, the least recently used files are evicted beyond it
+    max_bytes: int = 100_000_000_000
+    # Number of met files of a Flexpart window downloaded concurrently
+    fill_workers: int = 4
+    # Object key of a pre-processed met file in the flexprep output bucket, formatted with
+    # reference_time and valid_time (datetime) and step (int)
+    key_template: str = "{reference_time:%Y%m%d%H%M}/dispf{valid_time:%Y%m%d%H}"
+    # Mount point of the cache in Flexpart containers, passed in the given environment variable
+    container_path: str = "/scratch/nwp_cache"
+    input_dir_variable: str = "NWP_INPUT_DIR"
+
+class HandoffSettings(BaseModel):
+    # Hand the Flexpart output to Pyflexplot through a local scratch directory per window and
+    # upload it to the Flexpart output bucket while Pyflexplot runs
+    enabled: bool = False
+    # Host directory holding one output directory per Flexpart window
+    path: str
+    # Mount point of the window's output directory in Flexpart containers, passed in the given
+    # environment variable
+    container_path: str = "/scratch/flexpart_output"
+    output_dir_variable: str = "FLEXPART_OUTPUT_DIR"
+
+class WatchSettings(BaseModel):
+    # Seconds between two checks of the flexprep database for committed changes
+    poll_interval: float = 5
+    # Steps of IFS runs older than this many hours are ignored, also bounds the catch-up on start
+    lookback_hours: float = 48
+
+class ProgressiveSettings(BaseModel):
+    # Launch Flexpart once the first ready_hours plus margin_hours of a window are processed
+    # instead of all of them, the later inputs are announced in the window's input manifest
+    enabled: bool = False
+    ready_hours: int = 12
+    margin_hours: int = 6
+
+class ManifestSettings(BaseModel):
+    # Host directory of the input manifests of progressively started Flexpart windows
+    path: str
+    # Mount point of the directory in Flexpart containers, the window's manifest is passed in
+    # the given environment variable
+    container_path: str = "/scratch/manifests"
+    manifest_variable: str = "INPUT_MANIFEST"
+
+class RetentionSettings(BaseModel):
+    # Move the rows of the flexprep `uploaded` table older than the retention to an archive table
+    enabled: bool = False
+    # Hours of reference times kept in the table, must cover the inputs of any window still to run
+    retention_hours: float = 96
+    # Database attached to receive the archive table, None to keep it in the flexprep database
+    archive_path: str | None = None
+    # Rows moved per transaction and seconds between two transactions, so that flexprep writers
+    # are never blocked for long
+    batch_size: int = 500
+    batch_pause: float = 0.1
+    # Hours between two maintenance runs of `main.py watch`
+    interval_hours: float = 24
+
 class AppSettings(BaseModel):
     app_name: str
     time_settings: TimeSettings
+    # Flexpart products planned from the same pre-processed data, defaults to a single
+    # "default" product with the time settings above
+    products: list[ProductSettings] = []
     db: DBTableSettings
+    container_logs: ContainerLogSettings
+    local_store: LocalStoreSettings
+    s3: S3Settings
+    pyflexplot: PyflexplotSettings
+    metrics: MetricsSettings = MetricsSettings()
+    profiling: ProfilingSettings
+    deduplication: DeduplicationSettings = DeduplicationSettings()
+    preflight: PreflightSettings = PreflightSettings()
+    flexprep_shards: FlexprepShardSettings = FlexprepShardSettings()
+    met_cache: MetCacheSettings
+    handoff: HandoffSettings
+    manifests: ManifestSettings
+    watch: WatchSettings = WatchSettings()
+    retention: RetentionSettings = RetentionSettings()
+    # Timeout and retry policy per docker compose service
+    stages: dict[str, StageSettings] = {}
+    # Adaptive concurrency limit per docker compose service, services without entry are not limited
+    concurrency: dict[str, ConcurrencySettings] = {}
+    # Supersession policy per product, see the PRODUCT of a Flexpart configuration ("default" if unset)
+    supersession: dict[str, SupersessionSettings] = {}
+    # Progressive start policy per product, products without entry wait for complete windows
+    progressive: dict[str, ProgressiveSettings] = {}
 
 class ServiceSettings(BaseServiceSettings):
     logging: LoggingSettings
@@ -4,11 +4,26 @@ import logging
 import os
 import sqlite3
 import sys
+import time
+from typing import Callable
 
 from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import ProductSettings, TimeSettings
 
 logger = logging.getLogger(__name__)
 
+# Product planned with the top-level time settings when no products are configured
+DEFAULT_PRODUCT = "default"
+
+# Receives the duration in seconds of a query of the flexprep database, e.g. to export it as metric
+QueryObserver = Callable[[float], None]
+
+# Returns True for a Flexpart run configuration which must not be planned, e.g. because it failed before
+WindowFilter = Callable[[dict], bool]
+
+# Marks the configuration of a Flexpart run started before all its inputs are processed
+PROGRESSIVE = "PROGRESSIVE"
+
 def connect_db(db_path: str) -> sqlite3.Connection:
     """
     Establish a connection to the SQLite database.
@@ -64,7 +79,9 @@ def generate_flexpart_start_times(
     return list_start_times
 
 
-def generate_forecast_label(lead_time: datetime.datetime, tfreq: int) -> str:
+def generate_forecast_label(
+    lead_time: datetime.datetime, tfreq: int, cycle_horizons: dict[int, int] | None = None
+) -> str | None:
     """
     Returns a string in the format "{reference_time}{step}" based on
     the given lead_time (i.e. forecast reference time + step).
@@ -73,13 +90,18 @@ def generate_forecast_label(lead_time: datetime.datetime, tfreq: int) -> str:
     If the lead_time aligns with the start of an IFS simulation, it uses the previous forecast
     run with the appropriate lead time instead of the forecast at step 0.
 
+    If the horizon of that run (its last disseminated step, see `cycle_horizons`) does not
+    reach the lead time, the latest earlier run covering the lead time is used instead.
+
     Args:
         lead_time (datetime.datetime): Forecasts leadtime
         tfreq (int): Frequency of IFS forecast times in hours.
+        cycle_horizons (dict[int, int] | None): Last disseminated step per IFS run hour,
+            runs without an entry are assumed to cover any lead time.
 
     Returns:
-        str: Forecast reference time (YYYYMMDDHH) followed by the lead time (HH)
-        in the format "{reference_time}{step}"
+        str | None: Forecast reference time (YYYYMMDDHH) followed by the lead time (HH)
+        in the format "{reference_time}{step}", None if no IFS run covers the lead time.
     """
     if lead_time.hour % tfreq != 0:
         frt_st = lead_time - datetime.timedelta(hours=lead_time.hour % tfreq)
@@ -87,48 +109,97 @@ def generate_forecast_label(lead_time: datetime.datetime, tfreq: int) -> str:
     else:
         frt_st = lead_time - datetime.timedelta(hours=tfreq)
         lt = tfreq
+
+    if cycle_horizons:
+        max_horizon = max(cycle_horizons.values())
+        while cycle_horizons.get(frt_st.hour, lt) < lt:
+            frt_st -= datetime.timedelta(hours=tfreq)
+            lt += tfreq
+            if lt > max_horizon:
+                return None
     return frt_st.strftime("%Y%m%d%H%M") + f"{lt:02}"
 
 
 def fetch_processed_forecasts(
-    conn: sqlite3.Connection, frt_s: set[datetime.datetime]
+    conn: sqlite3.Connection, frt_s: set[datetime.datetime], observe_query: QueryObserver | None = None
 ) -> set[str]:
     """
-    Fetch all processed forecasts from the database for a specific reference time.
+    Fetch all processed forecasts from the database for a set of reference times, in a single query.
 
     Args:
         conn (sqlite3.Connection): SQLite connection object.
         frt_s (set of str): Set of forecast reference times (stripped of last two characters).
+        observe_query (QueryObserver | None): Receives the duration of the query.
 
     Returns:
         set of str: Set of processed item identifiers.
+
+    Raises:
+        sqlite3.Error: If the query failed.
     """
-    processed_items = set()
-    try:
-        cursor = conn.cursor()
-        for frt in frt_s:
-            cursor.execute(
-                """
-                SELECT processed, step FROM uploaded
-                WHERE forecast_ref_time = ?
-            """,
-                (frt,),
-            )
-            items_f = cursor.fetchall()
-            for processed, step in items_f:
-                if processed:
-                    frt_str = (
-                        frt.strftime("%Y%m%d%H%M")
-                        if isinstance(frt, datetime.datetime)
-                        else str(frt)
-                    )
-                    processed_items.add(frt_str + f"{int(step):02}")
-    except sqlite3.Error as e:
-        logger.error("SQLite query error while fetching processed items: %s", e)
-        sys.exit(1)
+    start = time.monotonic()
+    processed_items = _query_processed(conn, frt_s)
+    if observe_query is not None:
+        observe_query(time.monotonic() - start)
     return processed_items
 
 
+def fetch_processed_labels(conn: sqlite3.Connection, labels: set[str]) -> set[str]:
+    """
+    Fetch which of the given forecast labels are processed, in a single query.
+
+    Args:
+        conn (sqlite3.Connection): SQLite connection object.
+        labels (set[str]): Forecast labels in the format "{reference_time}{step}".
+
+    Returns:
+        set[str]: The processed labels.
+
+    Raises:
+        sqlite3.Error: If the query failed.
+    """
+    frts = {datetime.datetime.strptime(label[:-2], "%Y%m%d%H%M") for label in labels}
+    return _query_processed(conn, frts) & labels
+
+
+def _query_processed(conn: sqlite3.Connection, frt_s: set[datetime.datetime]) -> set[str]:
+    # Reference times are stored in the format of the sqlite3 default datetime adapter, used by flexprep
+    prefixes = {
+        (frt.isoformat(" ") if isinstance(frt, datetime.datetime) else str(frt)): (
+            frt.strftime("%Y%m%d%H%M") if isinstance(frt, datetime.datetime) else str(frt)
+        )
+        for frt in frt_s
+    }
+    if not prefixes:
+        return set()
+    placeholders = ", ".join("?" * len(prefixes))
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT forecast_ref_time, processed, step FROM uploaded
+        WHERE forecast_ref_time IN ({placeholders})
+    """,
+        tuple(prefixes),
+    )
+    return {
+        prefixes[str(frt)] + f"{int(step):02}"
+        for frt, processed, step in cursor.fetchall()
+        if processed and str(frt) in prefixes
+    }
+
+
+def fetch_latest_processed_cycle(conn: sqlite3.Connection) -> datetime.datetime | None:
+    """
+    Returns:
+        datetime.datetime | None: Reference time of the newest IFS run with processed steps, if any.
+
+    Raises:
+        sqlite3.Error: If the query failed.
+    """
+    (latest,) = conn.execute("SELECT MAX(forecast_ref_time) FROM uploaded WHERE processed").fetchone()
+    return datetime.datetime.fromisoformat(str(latest)) if latest is not None else None
+
+
 def define_config(start_time: datetime.datetime, end_time: datetime.datetime) -> dict:
     """
     Define input configuration for Flexpart based on provided start and end times.
@@ -170,13 +241,17 @@ def parse_forecast_datetime(date_str: str, time_str: str) -> datetime.datetime:
 
 
 def generate_forecast_times(
-    start_times: list[datetime.datetime]
+    start_times: list[datetime.datetime], time_settings: TimeSettings | None = None
 ) -> tuple[list[list[str]], list[list[datetime.datetime]], set[datetime.datetime]]:
     """
     Generates a list of all required forecasts for Flexpart simulations.
 
+    Runs for which some lead time is covered by no IFS run (see `TimeSettings.cycle_horizons`)
+    can never become ready and are left out.
+
     Args:
         start_times (list[datetime]): List of Flexpart run start reference times.
+        time_settings (TimeSettings | None): Time settings to plan with, defaults to the configured ones.
 
     Returns:
         tuple[list[list[str]], list[list[datetime]], set[datetime]]:
@@ -187,9 +262,10 @@ def generate_forecast_times(
             - all_input_forecasts_set: A set of unique forecasts reference datetime objects
               required for Flexpart simulations.
     """
-    time_delta = CONFIG.main.time_settings.tdelta
-    time_increment = CONFIG.main.time_settings.tincr
-    run_frequency = CONFIG.main.time_settings.tfreq
+    time_settings = time_settings or CONFIG.main.time_settings
+    time_delta = time_settings.tdelta
+    time_increment = time_settings.tincr
+    run_frequency = time_settings.tfreq
 
     all_input_forecasts = []
     all_flexpart_leadtimes = []
@@ -197,7 +273,11 @@ def generate_forecast_times(
 
     for start_time in start_times:
         lead_times = [start_time + datetime.timedelta(hours=i) for i in range(0, time_delta, time_increment)]
-        input_forecasts = [generate_forecast_label(lt, run_frequency) for lt in lead_times]
+        labels = [generate_forecast_label(lt, run_frequency, time_settings.cycle_horizons) for lt in lead_times]
+        input_forecasts = [label for label in labels if label is not None]
+        if len(input_forecasts) < len(labels):
+            logger.debug("Skipping Flexpart run starting at %s, not all lead times are disseminated.", start_time)
+            continue
 
         all_input_forecasts.append(input_forecasts)
         all_flexpart_leadtimes.append(lead_times)
@@ -208,6 +288,47 @@ def generate_forecast_times(
     return all_input_forecasts, all_flexpart_leadtimes, all_input_forecasts_set
 
 
+def plan_flexpart_windows(
+    forecast_reftime: datetime.datetime, step: int, time_settings: TimeSettings | None = None
+) -> tuple[list[list[str]], list[list[datetime.datetime]], set[datetime.datetime]]:
+    """
+    Plans the Flexpart runs which may have become ready with a newly processed forecast step.
+
+    Only runs actually consuming the new step as input are kept: any other run was already
+    ready (or not) before and re-querying its inputs would be wasted.
+
+    Args:
+        forecast_reftime (datetime.datetime): Forecast reference time of the processed step.
+        step (int): The processed lead time in hours.
+        time_settings (TimeSettings | None): Time settings to plan with, defaults to the configured ones.
+
+    Returns:
+        tuple[list[list[str]], list[list[datetime]], set[datetime]]: As `generate_forecast_times`.
+    """
+    time_settings = time_settings or CONFIG.main.time_settings
+    start_times = generate_flexpart_start_times(
+        forecast_reftime, step, time_settings.tdelta, time_settings.tfreq_f
+    )
+    input_forecasts, flexpart_leadtimes, _ = generate_forecast_times(start_times, time_settings)
+
+    label = forecast_reftime.strftime("%Y%m%d%H%M") + f"{step:02}"
+    windows = [
+        (forecasts, leadtimes)
+        for forecasts, leadtimes in zip(input_forecasts, flexpart_leadtimes)
+        if label in forecasts
+    ]
+    if len(windows) < len(input_forecasts):
+        logger.info(
+            "Step %s is input to %d of %d candidate Flexpart runs, skipping the others.",
+            label, len(windows), len(input_forecasts)
+        )
+
+    input_forecasts_set = {
+        datetime.datetime.strptime(f[:-2], "%Y%m%d%H%M") for forecasts, _ in windows for f in forecasts
+    }
+    return [f for f, _ in windows], [lt for _, lt in windows], input_forecasts_set
+
+
 def create_flexpart_configs(
     all_flexpart_leadtimes: list[list[datetime.datetime]],
     all_input_forecasts: list[list[str]],
@@ -236,14 +357,230 @@ def create_flexpart_configs(
     return configs
 
 
-def run_aggregator(date: str, time: str, step: int) -> list[dict]:
+def ready_lead_hours(input_forecasts: list[str], processed_forecasts: set[str], tincr: int) -> int:
+    """
+    Returns:
+        int: Hours of a Flexpart run covered by its leading processed inputs, up to the first
+            input which is not processed yet.
+    """
+    ready = 0
+    for forecast in input_forecasts:
+        if forecast not in processed_forecasts:
+            break
+        ready += 1
+    return ready * tincr
+
+
+def create_progressive_configs(
+    all_flexpart_leadtimes: list[list[datetime.datetime]],
+    all_input_forecasts: list[list[str]],
+    processed_forecasts: set[str],
+    min_ready_hours: int,
+    tincr: int,
+    exclude: WindowFilter | None = None,
+) -> list[dict]:
+    """
+    Create Flexpart input configurations of the runs which can start before all their inputs are processed.
+
+    Runs whose inputs are all processed are left to `create_flexpart_configs`.
+
+    Args:
+        all_flexpart_leadtimes, all_input_forecasts, processed_forecasts: As `create_flexpart_configs`.
+        min_ready_hours (int): Leading hours of a run which must be processed to start it.
+        tincr (int): Hours between the inputs of a run.
+        exclude (WindowFilter | None): Excludes runs which must not start progressively, e.g.
+            because a progressive start failed already. They run once all inputs are processed.
+
+    Returns:
+        list of dict: Flexpart configuration dictionaries marked as progressive.
+    """
+    configs = []
+    for leadtimes, input_forecasts in zip(all_flexpart_leadtimes, all_input_forecasts):
+        if all(forecast in processed_forecasts for forecast in input_forecasts):
+            continue
+        if ready_lead_hours(input_forecasts, processed_forecasts, tincr) < min_ready_hours:
+            continue
+        config = {**define_config(leadtimes[0], leadtimes[-1]), PROGRESSIVE: "1"}
+        if exclude is None or not exclude(config):
+            configs.append(config)
+    return configs
+
+
+def configured_products() -> list[ProductSettings]:
+    """
+    Returns:
+        list[ProductSettings]: The configured products, or the default product with the top-level time settings.
+    """
+    return CONFIG.main.products or [ProductSettings(name=DEFAULT_PRODUCT, time_settings=CONFIG.main.time_settings)]
+
+
+def product_time_settings(product: str | None) -> TimeSettings:
+    """
+    Returns:
+        TimeSettings: Time settings of a product, the top-level ones for unknown products.
+    """
+    name = product or DEFAULT_PRODUCT
+    return next((p.time_settings for p in configured_products() if p.name == name), CONFIG.main.time_settings)
+
+
+def tag_config(config: dict, product: ProductSettings) -> dict:
+    """
+    Returns:
+        dict: The Flexpart configuration tagged with its product and the product's time settings.
+    """
+    return {
+        **config,
+        "PRODUCT": product.name,
+        "TDELTA": str(product.time_settings.tdelta),
+        "TFREQ_F": str(product.time_settings.tfreq_f),
+        "TFREQ": str(product.time_settings.tfreq),
+    }
+
+
+def window_input_forecasts(config: dict, time_settings: TimeSettings | None = None) -> list[str]:
+    """
+    Returns:
+        list[str]: Input forecast labels of the Flexpart run described by a configuration,
+            empty if the run cannot be planned with the given time settings.
+    """
+    start_time = datetime.datetime.strptime(config["FORECAST_DATETIME"], "%Y%m%d%H%M")
+    input_forecasts, _, _ = generate_forecast_times([start_time], time_settings)
+    return input_forecasts[0] if input_forecasts else []
+
+
+def newer_forecast_labels(label: str, tfreq: int) -> list[str]:
+    """
+    Returns:
+        list[str]: Labels of the IFS runs newer than the one of `label` which cover the
+            same lead time, newest first.
+    """
+    frt = datetime.datetime.strptime(label[:-2], "%Y%m%d%H%M")
+    lead_time = frt + datetime.timedelta(hours=int(label[-2:]))
+    labels = []
+    candidate = frt + datetime.timedelta(hours=tfreq)
+    while candidate < lead_time:
+        step = int((lead_time - candidate).total_seconds()) // 3600
+        labels.append(candidate.strftime("%Y%m%d%H%M") + f"{step:02}")
+        candidate += datetime.timedelta(hours=tfreq)
+    return labels[::-1]
+
+
+def supersession_reason(
+    input_forecasts: list[str], processed_forecasts: set[str], latest_cycle: datetime.datetime | None,
+    tfreq: int, max_lag_hours: float | None = None
+) -> str | None:
+    """
+    Check whether a Flexpart run is made obsolete by newer IFS runs.
+
+    A run is superseded if a newer IFS run covering one of its input lead times has
+    been processed, or if its newest input run lags the newest processed IFS run by
+    more than `max_lag_hours`.
+
+    Args:
+        input_forecasts (list[str]): Input forecast labels of the run.
+        processed_forecasts (set[str]): Processed labels, at least those of the newer runs.
+        latest_cycle (datetime.datetime | None): Newest IFS run with processed steps, if any.
+        tfreq (int): Frequency of IFS forecast times in hours.
+        max_lag_hours (float | None): Maximum lag of the run's inputs, None to disable.
+
+    Returns:
+        str | None: Why the run is superseded, None if it is current.
+    """
+    for label in input_forecasts:
+        newer = next((n for n in newer_forecast_labels(label, tfreq) if n in processed_forecasts), None)
+        if newer is not None:
+            return f"input {label} superseded by {newer}"
+
+    if max_lag_hours is not None and latest_cycle is not None and input_forecasts:
+        newest_input = max(datetime.datetime.strptime(label[:-2], "%Y%m%d%H%M") for label in input_forecasts)
+        lag = (latest_cycle - newest_input).total_seconds() / 3600
+        if lag > max_lag_hours:
+            return f"inputs lag IFS run {latest_cycle:%Y%m%d%H} by {lag:g}h"
+    return None
+
+
+def plan_ready_windows(
+    conn: sqlite3.Connection,
+    steps: list[tuple[datetime.datetime, int]],
+    observe_query: QueryObserver | None = None,
+    exclude_progressive: WindowFilter | None = None,
+) -> list[dict]:
+    """
+    Plans the Flexpart runs of all configured products made ready by newly processed forecast steps.
+
+    The processed forecasts needed by any of the candidate runs are fetched with a single
+    query. Each configuration is tagged with its product, see `tag_config`. If progressive
+    start is enabled for a product, runs whose leading inputs are processed are planned as
+    well, see `create_progressive_configs`.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the flexprep database.
+        steps (list[tuple[datetime.datetime, int]]): Forecast reference times and lead times
+            of the newly processed steps.
+        observe_query (QueryObserver | None): Receives the duration of the readiness query.
+        exclude_progressive (WindowFilter | None): Excludes runs from a progressive start, it
+            receives their tagged configuration.
+
+    Returns:
+        list[dict]: Configurations of the ready Flexpart runs, each run listed once.
+
+    Raises:
+        sqlite3.Error: If the flexprep database could not be queried.
+    """
+    products = configured_products()
+    plans = [
+        (product, plan_flexpart_windows(forecast_reftime, step, product.time_settings))
+        for forecast_reftime, step in steps
+        for product in products
+    ]
+    input_forecasts_set = set().union(*(plan[2] for _, plan in plans))
+    if not input_forecasts_set:
+        logger.info("No Flexpart run takes these forecast steps as input.")
+        return []
+
+    # Retrieve processed forecasts of all products from the database at once
+    processed_forecasts = fetch_processed_forecasts(conn, input_forecasts_set, observe_query)
+
+    # Create input configurations if processed forecasts are ready, a run made ready by
+    # several of the steps is planned once
+    configs: dict[tuple[str, str], dict] = {}
+    for product, (input_forecasts, flexpart_leadtimes, _) in plans:
+        product_configs = create_flexpart_configs(flexpart_leadtimes, input_forecasts, processed_forecasts)
+        progressive = CONFIG.main.progressive.get(product.name)
+        if progressive is not None and progressive.enabled:
+            exclude = None if exclude_progressive is None else (
+                lambda config, product=product: exclude_progressive(tag_config(config, product))
+            )
+            product_configs += create_progressive_configs(
+                flexpart_leadtimes, input_forecasts, processed_forecasts,
+                progressive.ready_hours + progressive.margin_hours, product.time_settings.tincr, exclude
+            )
+        for config in product_configs:
+            configs.setdefault((product.name, config["FORECAST_DATETIME"]), tag_config(config, product))
+
+    if not configs:
+        logger.info("Not enough pre-processed forecasts to run Flexpart.")
+    return list(configs.values())
+
+
+def run_aggregator(
+    date: str,
+    time: str,
+    step: int,
+    observe_query: QueryObserver | None = None,
+    exclude_progressive: WindowFilter | None = None,
+) -> list[dict]:
     """
     Checks if Flexpart can be launched with the processed new lead time and prepares input configurations.
 
+    All configured products are planned, see `plan_ready_windows`.
+
     Args:
         date (str): The forecast reference date in YYYYMMDD format.
         time (str): The forecast reference time in HH format.
         step (int): The lead time in hours.
+        observe_query (QueryObserver | None): Receives the duration of the readiness query.
+        exclude_progressive (WindowFilter | None): Excludes runs from a progressive start.
 
     Returns:
         list[dict]: List of configuration dictionaries for Flexpart.
@@ -252,30 +589,17 @@ def run_aggregator(date: str, time: str, step: int) -> list[dict]:
     db_path = os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)
     with connect_db(db_path) as conn:
         try:
-            forecast_reftime = parse_forecast_datetime(date, time)
-            start_times = generate_flexpart_start_times(
-                forecast_reftime,
-                step,
-                CONFIG.main.time_settings.tdelta,
-                CONFIG.main.time_settings.tfreq_f
+            configs = plan_ready_windows(
+                conn, [(parse_forecast_datetime(date, time), step)], observe_query, exclude_progressive
             )
-
-            input_forecasts, flexpart_leadtimes, input_forecasts_set = generate_forecast_times(start_times)
-
-            # Retrieve processed forecasts from the database
-            processed_forecasts = fetch_processed_forecasts(conn, input_forecasts_set)
-
-            # Create input configurations if processed forecasts are ready
-            configs = create_flexpart_configs(
-                flexpart_leadtimes, input_forecasts, processed_forecasts
-            )
-
             if not configs:
-                logger.info("Not enough pre-processed forecasts to run Flexpart.")
                 sys.exit(0)
 
             return configs
 
+        except sqlite3.Error as e:
+            logger.error("SQLite query error while fetching processed items: %s", e)
+            sys.exit(1)
         except Exception as e:
             logger.error("An error occurred while running the aggregator: %s", e)
             raise
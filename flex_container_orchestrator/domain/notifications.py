@@ -0,0 +1,88 @@
+import datetime
+import json
+import logging
+import re
+from typing import Iterable
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+_TIMESTAMP_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?)")
+
+
+class Notification(BaseModel):
+    """A dissemination event, i.e. the arguments the orchestrator is triggered with."""
+
+    date: str
+    time: str
+    step: str
+    location: str
+    # When the event was received, if known from the log it was parsed from
+    received_at: datetime.datetime | None = None
+
+    def arguments(self) -> list[str]:
+        """
+        Returns:
+            list[str]: Command line arguments of the orchestrator entry point.
+        """
+        return ["--step", self.step, "--date", self.date, "--time", self.time, "--location", self.location]
+
+
+def parse_aviso_log_line(line: str) -> Notification | None:
+    """
+    Parse a line written by the Aviso `log` trigger.
+
+    The line is expected to contain the notification as a JSON object, with the request
+    keys `date`, `time` and `step`, and the `location` of the disseminated data. A leading
+    timestamp, if present, is used as the receive time.
+
+    Args:
+        line (str): A line of the Aviso notification log.
+
+    Returns:
+        Notification | None: The parsed notification, None if the line holds no dissemination event.
+    """
+    start = line.find("{")
+    if start < 0:
+        return None
+    try:
+        event = json.loads(line[start:])
+    except json.JSONDecodeError:
+        logger.debug("Skipping unparsable Aviso log line: %s", line.strip())
+        return None
+
+    request = event.get("request", {})
+    location = event.get("location") or request.get("location")
+    if not location or not all(key in request for key in ("date", "time", "step")):
+        return None
+
+    # Aviso reports the time either as HH or as HHMM
+    hour = int(request["time"])
+    hour = hour // 100 if hour >= 100 else hour
+
+    received_at = None
+    match = _TIMESTAMP_PATTERN.match(line[:start].strip())
+    if match:
+        received_at = datetime.datetime.fromisoformat(match.group(1).replace(",", "."))
+
+    return Notification(
+        date=str(request["date"]),
+        time=f"{hour:02d}",
+        step=f"{int(request['step']):02d}",
+        location=location,
+        received_at=received_at,
+    )
+
+
+def parse_aviso_log(lines: Iterable[str]) -> list[Notification]:
+    """
+    Returns:
+        list[Notification]: The dissemination events of an Aviso notification log, in log order.
+    """
+    notifications = []
+    for line in lines:
+        notification = parse_aviso_log_line(line)
+        if notification is not None:
+            notifications.append(notification)
+    return notifications
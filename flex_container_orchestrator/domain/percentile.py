@@ -0,0 +1,18 @@
+import math
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Linearly interpolated percentile of a list of values.
+
+    Args:
+        values (list[float]): Non-empty list of values.
+        q (float): Percentile between 0 and 100.
+
+    Returns:
+        float: The q-th percentile.
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
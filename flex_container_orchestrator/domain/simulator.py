@@ -0,0 +1,274 @@
+"""
+Discrete-event simulation of the orchestrator pipeline on a virtual clock.
+
+Step notifications are replayed through the real aggregator logic
+(`plan_flexpart_windows` and `create_flexpart_configs`), while the
+flexprep, Flexpart and Pyflexplot containers are modelled as worker pools with
+configurable duration distributions. The simulation predicts queue depths,
+worker utilisation and dissemination-to-plot latencies of a configuration.
+"""
+
+import collections
+import datetime
+import heapq
+import itertools
+import logging
+import random
+from typing import Literal
+
+from pydantic import BaseModel
+
+from flex_container_orchestrator.config.service_settings import TimeSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import (
+    create_flexpart_configs, parse_forecast_datetime, plan_flexpart_windows)
+from flex_container_orchestrator.domain.notifications import Notification
+from flex_container_orchestrator.domain.percentile import percentile
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("flexprep", "flexpart", "pyflexplot")
+
+
+class DurationDistribution(BaseModel):
+    """
+    Duration of a container run in seconds.
+
+    - fixed: always `mean`
+    - uniform: uniformly distributed in [mean - spread, mean + spread]
+    - lognormal: lognormally distributed with median `mean` and shape parameter `spread`
+    """
+
+    kind: Literal["fixed", "uniform", "lognormal"] = "fixed"
+    mean: float
+    spread: float = 0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            return max(0.0, rng.uniform(self.mean - self.spread, self.mean + self.spread))
+        if self.kind == "lognormal":
+            return self.mean * rng.lognormvariate(0, self.spread)
+        return self.mean
+
+
+class SimulationSettings(BaseModel):
+    time_settings: TimeSettings
+    # Number of containers of each stage allowed to run concurrently
+    workers: dict[str, int] = {"flexprep": 4, "flexpart": 2, "pyflexplot": 2}
+    durations: dict[str, DurationDistribution] = {
+        "flexprep": DurationDistribution(mean=120),
+        "flexpart": DurationDistribution(mean=1800),
+        "pyflexplot": DurationDistribution(mean=300),
+    }
+    # Queue discipline of the stages: "fifo", or "newest_first" to favour the latest windows
+    policy: Literal["fifo", "newest_first"] = "fifo"
+    seed: int = 0
+
+
+class StageStatistics(BaseModel):
+    jobs: int
+    max_queue_depth: int
+    mean_queue_depth: float
+    utilisation: float
+
+
+class SimulationResult(BaseModel):
+    # Virtual time in seconds from the first notification to the last finished container
+    makespan: float
+    stages: dict[str, StageStatistics]
+    # Dissemination-to-plot latency of each Flexpart window in seconds
+    latencies: dict[str, float]
+
+    def latency_percentiles(self, percentiles: tuple[int, ...] = (50, 95, 99)) -> dict[int, float]:
+        values = list(self.latencies.values())
+        return {q: percentile(values, q) for q in percentiles} if values else {}
+
+
+def synthetic_arrivals(
+    cycles: list[datetime.datetime], last_step: int, first_delay: float, step_interval: float
+) -> list[tuple[float, Notification]]:
+    """
+    Generate the step arrival schedule of the given IFS cycles.
+
+    Step `s` of a cycle is assumed to be disseminated `first_delay + s * step_interval`
+    seconds after the cycle's reference time.
+
+    Args:
+        cycles (list[datetime.datetime]): Forecast reference times of the cycles.
+        last_step (int): Last step disseminated for each cycle.
+        first_delay (float): Delay in seconds between reference time and dissemination of step 0.
+        step_interval (float): Delay in seconds between the dissemination of two consecutive steps.
+
+    Returns:
+        list[tuple[float, Notification]]: Arrivals as (seconds since the first cycle, notification).
+    """
+    origin = min(cycles)
+    arrivals = []
+    for cycle in cycles:
+        for step in range(last_step + 1):
+            at = (cycle - origin).total_seconds() + first_delay + step * step_interval
+            notification = Notification(
+                date=cycle.strftime("%Y%m%d"), time=cycle.strftime("%H"), step=f"{step:02d}", location="simulated"
+            )
+            arrivals.append((at, notification))
+    return sorted(arrivals, key=lambda arrival: arrival[0])
+
+
+def arrivals_from_notifications(notifications: list[Notification]) -> list[tuple[float, Notification]]:
+    """
+    Returns:
+        list[tuple[float, Notification]]: Arrivals relative to the first received notification.
+            Notifications without receive time are dropped.
+    """
+    timed = [n for n in notifications if n.received_at is not None]
+    if not timed:
+        return []
+    origin = min(n.received_at for n in timed if n.received_at)
+    return sorted(
+        (((n.received_at - origin).total_seconds(), n) for n in timed if n.received_at),
+        key=lambda arrival: arrival[0],
+    )
+
+
+class _Job(BaseModel):
+    stage: str
+    key: str
+    # Ordering key of the "newest_first" policy
+    priority: str
+    # Virtual time at which the notification that made the job possible was received
+    origin: float
+
+
+class Simulation:
+    """Event loop of a single simulation run."""
+
+    def __init__(self, settings: SimulationSettings):
+        self.settings = settings
+        self.rng = random.Random(settings.seed)
+        self.now = 0.0
+        self._events: list[tuple[float, int, str, object]] = []
+        self._sequence = itertools.count()
+        self._queues: dict[str, collections.deque[_Job]] = {s: collections.deque() for s in STAGES}
+        self._busy = {s: 0 for s in STAGES}
+        self._busy_time = {s: 0.0 for s in STAGES}
+        self._queue_area = {s: 0.0 for s in STAGES}
+        self._max_queue = {s: 0 for s in STAGES}
+        self._jobs = {s: 0 for s in STAGES}
+        self._last_change = 0.0
+        self._processed: set[str] = set()
+        self._launched: set[str] = set()
+        self.latencies: dict[str, float] = {}
+
+    def run(self, arrivals: list[tuple[float, Notification]]) -> SimulationResult:
+        for at, notification in arrivals:
+            self._schedule(at, "arrival", notification)
+
+        while self._events:
+            at, _, kind, payload = heapq.heappop(self._events)
+            self._advance(at)
+            if kind == "arrival":
+                assert isinstance(payload, Notification)
+                self._on_arrival(payload)
+            else:
+                assert isinstance(payload, _Job)
+                self._on_done(payload)
+
+        makespan = self.now or 1.0
+        stages = {
+            s: StageStatistics(
+                jobs=self._jobs[s],
+                max_queue_depth=self._max_queue[s],
+                mean_queue_depth=self._queue_area[s] / makespan,
+                utilisation=self._busy_time[s] / (makespan * self.settings.workers.get(s, 1)),
+            )
+            for s in STAGES
+        }
+        return SimulationResult(makespan=self.now, stages=stages, latencies=self.latencies)
+
+    def _schedule(self, at: float, kind: str, payload: object) -> None:
+        heapq.heappush(self._events, (at, next(self._sequence), kind, payload))
+
+    def _advance(self, at: float) -> None:
+        elapsed = at - self._last_change
+        for s in STAGES:
+            self._queue_area[s] += elapsed * len(self._queues[s])
+            self._busy_time[s] += elapsed * self._busy[s]
+        self._last_change = self.now = at
+
+    def _on_arrival(self, notification: Notification) -> None:
+        label = parse_forecast_datetime(notification.date, notification.time).strftime(
+            "%Y%m%d%H%M"
+        ) + f"{int(notification.step):02}"
+        self._submit(_Job(stage="flexprep", key=label, priority=label, origin=self.now))
+
+    def _on_done(self, job: _Job) -> None:
+        self._busy[job.stage] -= 1
+        if job.stage == "flexprep":
+            self._processed.add(job.key)
+            self._plan(job.key, job.origin)
+        elif job.stage == "flexpart":
+            self._submit(job.model_copy(update={"stage": "pyflexplot"}))
+        else:
+            self.latencies[job.key] = self.now - job.origin
+        self._dispatch(job.stage)
+
+    def _plan(self, label: str, origin: float) -> None:
+        time_settings = self.settings.time_settings
+        frt = datetime.datetime.strptime(label[:-2], "%Y%m%d%H%M")
+        input_forecasts, leadtimes, _ = plan_flexpart_windows(frt, int(label[-2:]), time_settings)
+        for config in create_flexpart_configs(leadtimes, input_forecasts, self._processed):
+            window = config["FORECAST_DATETIME"]
+            if window not in self._launched:
+                self._launched.add(window)
+                self._submit(_Job(stage="flexpart", key=window, priority=window, origin=origin))
+
+    def _submit(self, job: _Job) -> None:
+        self._jobs[job.stage] += 1
+        self._queues[job.stage].append(job)
+        self._dispatch(job.stage)
+        # Jobs started right away never wait in the queue
+        self._max_queue[job.stage] = max(self._max_queue[job.stage], len(self._queues[job.stage]))
+
+    def _dispatch(self, stage: str) -> None:
+        queue = self._queues[stage]
+        while queue and self._busy[stage] < self.settings.workers.get(stage, 1):
+            if self.settings.policy == "newest_first":
+                job = max(queue, key=lambda j: j.priority)
+                queue.remove(job)
+            else:
+                job = queue.popleft()
+            self._busy[stage] += 1
+            duration = self.settings.durations[stage].sample(self.rng)
+            self._schedule(self.now + duration, "done", job)
+
+
+def simulate(settings: SimulationSettings, arrivals: list[tuple[float, Notification]]) -> SimulationResult:
+    """
+    Replay an arrival schedule through the pipeline model.
+
+    Args:
+        settings (SimulationSettings): Planner time settings, worker counts, durations and policy.
+        arrivals (list[tuple[float, Notification]]): Notifications with their arrival time in seconds.
+
+    Returns:
+        SimulationResult: Predicted queue depths, utilisation and latencies.
+    """
+    return Simulation(settings).run(arrivals)
+
+
+def format_result(result: SimulationResult) -> str:
+    lines = [
+        f"Makespan: {result.makespan / 3600:.2f} h, Flexpart windows plotted: {len(result.latencies)}",
+        "",
+        f"{'stage':<12}{'jobs':>6}{'max queue':>11}{'mean queue':>12}{'utilisation':>13}",
+    ]
+    for stage, stats in result.stages.items():
+        lines.append(
+            f"{stage:<12}{stats.jobs:>6}{stats.max_queue_depth:>11}"
+            f"{stats.mean_queue_depth:>12.2f}{stats.utilisation:>12.0%}"
+        )
+    percentiles = result.latency_percentiles()
+    if percentiles:
+        lines += ["", "Dissemination-to-plot latency: " + ", ".join(
+            f"p{q} {value / 60:.1f} min" for q, value in percentiles.items()
+        )]
+    return "\n".join(lines)
@@ -1,12 +1,34 @@
 import argparse
+import datetime
 import logging
+import os
+import sys
+from http.server import ThreadingHTTPServer
+from typing import Callable
 
+import yaml
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.domain import simulator
+from flex_container_orchestrator.domain.notifications import parse_aviso_log
 from flex_container_orchestrator.services import flexpart_service
+from flex_container_orchestrator.services.checkpoints import DONE, FLEXPREP, CheckpointStore, cycle_key, format_status
+from flex_container_orchestrator.services.concurrency import ConcurrencyLimiter
+from flex_container_orchestrator.services.deduplication import SeenEventStore
+from flex_container_orchestrator.services.latency import NOTIFIED, LatencyStore, format_report, window_latencies
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.met_cache import MetCache
+from flex_container_orchestrator.services.metrics import REGISTRY, start_metrics_server
+from flex_container_orchestrator.services.preflight import ALREADY_PROCESSED
+from flex_container_orchestrator.services.profiling import PROFILE_ENV, profiling, profiling_requested
+from flex_container_orchestrator.services.retention import format_maintenance, maintain
+from flex_container_orchestrator.services.replay import format_replay, parse_speed, replay
+from flex_container_orchestrator.services.watcher import watch
 
 logger = logging.getLogger(__name__)
 
 
-def main() -> None:
+def run(argv: list[str]) -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--date",
@@ -35,9 +57,238 @@ def main() -> None:
         required=True,
         help="Step parameter"
     )
-    args = parser.parse_args()
 
-    flexpart_service.main(args.date, args.location, args.time, args.step)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Process the notification even if the same event was already handled"
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Write cProfile, tracemalloc and per-stage timings (also enabled by {PROFILE_ENV}=1)"
+    )
+    args = parser.parse_args(argv)
+
+    run_name = f"{args.date}_{int(args.time):02d}_{args.step}"
+    with profiling(profiling_requested(args.profile), run_name):
+        flexpart_service.main(args.date, args.location, args.time, args.step, force=args.force)
+
+
+def status(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py status", description="Show the pipeline progress of the most recent cycles."
+    )
+    parser.add_argument("--date", type=str, help="Restrict to the cycle of this date (YYYYMMDD)")
+    parser.add_argument("--time", type=str, default="00", help="Time of the cycle in format HH")
+    parser.add_argument("--limit", type=int, default=10, help="Number of most recent cycles to show")
+    args = parser.parse_args(argv)
+
+    cycle = cycle_key(args.date, args.time) if args.date else None
+    with connect_local_store() as conn:
+        print(format_status(CheckpointStore(conn).cycles(cycle, args.limit)))
+
+
+def report(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py report",
+        description="Print dissemination-to-plot latency percentiles per stage and cycle.",
+    )
+    parser.add_argument("--cycle", type=str, help="Restrict to windows gated by this cycle (YYYYMMDDHH)")
+    args = parser.parse_args(argv)
+
+    with connect_local_store() as conn:
+        latencies = window_latencies(LatencyStore(conn))
+    if args.cycle:
+        latencies = [entry for entry in latencies if entry["cycle"] == args.cycle]
+    print(format_report(latencies))
+
+
+def simulate(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py simulate",
+        description="Predict queue depths, utilisation and latency of a configuration on a virtual clock.",
+    )
+    parser.add_argument(
+        "--settings", type=str,
+        help="YAML file with simulation settings (workers, durations, policy, time_settings)"
+    )
+    parser.add_argument("--aviso-log", type=str, help="Replay the arrivals of an Aviso notification log")
+    parser.add_argument("--start", type=str, default="2025010100", help="First synthetic cycle (YYYYMMDDHH)")
+    parser.add_argument("--cycles", type=int, default=4, help="Number of synthetic cycles")
+    parser.add_argument("--last-step", type=int, help="Last synthetic step per cycle, defaults to tfreq")
+    parser.add_argument(
+        "--first-delay", type=float, default=5.5 * 3600,
+        help="Seconds from reference time to dissemination of step 0"
+    )
+    parser.add_argument("--step-interval", type=float, default=60, help="Seconds between two synthetic steps")
+    args = parser.parse_args(argv)
+
+    values = {"time_settings": CONFIG.main.time_settings}
+    if args.settings:
+        with open(args.settings, encoding="utf-8") as file:
+            values.update(yaml.safe_load(file) or {})
+    settings = simulator.SimulationSettings.model_validate(values)
+
+    if args.aviso_log:
+        with open(args.aviso_log, encoding="utf-8") as file:
+            arrivals = simulator.arrivals_from_notifications(parse_aviso_log(file))
+    else:
+        tfreq = settings.time_settings.tfreq
+        start = datetime.datetime.strptime(args.start, "%Y%m%d%H")
+        cycles = [start + datetime.timedelta(hours=tfreq * i) for i in range(args.cycles)]
+        last_step = tfreq if args.last_step is None else args.last_step
+        arrivals = simulator.synthetic_arrivals(cycles, last_step, args.first_delay, args.step_interval)
+
+    print(simulator.format_result(simulator.simulate(settings, arrivals)))
+
+
+def replay_log(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py replay",
+        description="Fire the events of an Aviso notification log into a test instance with fake containers.",
+    )
+    parser.add_argument("aviso_log", type=str, help="Aviso notification log to replay")
+    parser.add_argument(
+        "--speed", type=parse_speed, default=1.0,
+        help="Speed-up of the logged receive times (e.g. 1, 10x) or max to fire all events at once"
+    )
+    parser.add_argument(
+        "--workdir", type=str, default="replay",
+        help="Directory of the test instance (fake executables, databases, logs)"
+    )
+    parser.add_argument("--container-seconds", type=float, default=1.0, help="Runtime of every fake container")
+    args = parser.parse_args(argv)
+
+    with open(args.aviso_log, encoding="utf-8") as file:
+        notifications = parse_aviso_log(file)
+    print(format_replay(replay(notifications, args.speed, args.workdir, args.container_seconds)))
+
+
+def start_metrics_endpoint() -> ThreadingHTTPServer:
+    """
+    Start the health and metrics endpoint of the watch process.
+
+    The in-process metrics cover the windows run by the watch. The steps notified to, the
+    flexprep runs skipped by and the stages running in any orchestrator process, the shared
+    concurrency limits and the met cache hit ratio are read from the local store when the
+    endpoint is scraped.
+    """
+    def in_flight_stages() -> dict[tuple[str, ...], float]:
+        with connect_local_store() as conn:
+            return {(stage,): count for stage, count in CheckpointStore(conn).in_flight().items()}
+
+    def local_store_available() -> bool:
+        with connect_local_store() as conn:
+            conn.execute("SELECT 1")
+        return True
+
+    def concurrency_limits() -> dict[tuple[str, ...], float]:
+        with connect_local_store() as conn:
+            return {(service,): limit for service, (limit, _) in ConcurrencyLimiter(conn).state().items()}
+
+    def concurrency_slots_busy() -> dict[tuple[str, ...], float]:
+        with connect_local_store() as conn:
+            return {(service,): busy for service, (_, busy) in ConcurrencyLimiter(conn).state().items()}
+
+    def met_cache_hit_ratio() -> dict[tuple[str, ...], float]:
+        with connect_local_store() as conn:
+            _, ratio = MetCache(conn, CONFIG.main.met_cache).stats()
+        return {(): ratio} if ratio is not None else {}
+
+    def notified_steps() -> dict[tuple[str, ...], float]:
+        with connect_local_store() as conn:
+            return {(): LatencyStore(conn).count(NOTIFIED)}
+
+    def skipped_flexprep_runs() -> dict[tuple[str, ...], float]:
+        with connect_local_store() as conn:
+            return {(): CheckpointStore(conn).count(FLEXPREP, DONE, ALREADY_PROCESSED)}
+
+    def suppressed_duplicates() -> dict[tuple[str, ...], float]:
+        with connect_local_store() as conn:
+            return {(): SeenEventStore(conn).suppressed()}
+
+    REGISTRY.gauge(
+        "orchestrator_stages_running", "Stage items running in any orchestrator process.", ("stage",)
+    ).set_function(in_flight_stages)
+    REGISTRY.gauge(
+        "orchestrator_steps_notified", "Steps notified to any orchestrator process, from the local store."
+    ).set_function(notified_steps)
+    REGISTRY.gauge(
+        "orchestrator_flexprep_skips", "Flexprep runs skipped by any orchestrator process for already processed steps."
+    ).set_function(skipped_flexprep_runs)
+    REGISTRY.gauge(
+        "orchestrator_duplicates_suppressed", "Duplicates suppressed by any orchestrator process, within the TTL."
+    ).set_function(suppressed_duplicates)
+    REGISTRY.gauge(
+        "orchestrator_concurrency_limit", "Adaptive limit of concurrently running containers.", ("service",)
+    ).set_function(concurrency_limits)
+    REGISTRY.gauge(
+        "orchestrator_concurrency_slots_busy", "Container slots held by any orchestrator process.", ("service",)
+    ).set_function(concurrency_slots_busy)
+    REGISTRY.gauge(
+        "orchestrator_met_cache_hit_ratio", "Share of Flexpart input steps served from the local met cache."
+    ).set_function(met_cache_hit_ratio)
+
+    readiness_checks = {
+        "flexprep_db": lambda: os.path.exists(os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)),
+        "local_store": local_store_available,
+    }
+    return start_metrics_server(CONFIG.main.metrics.host, CONFIG.main.metrics.port, readiness_checks)
+
+
+def watch_database(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py watch",
+        description="Plan and run Flexpart windows as soon as flexprep marks their steps processed.",
+    )
+    parser.add_argument("--poll-interval", type=float, help="Seconds between two database checks")
+    args = parser.parse_args(argv)
+    if args.poll_interval is not None:
+        CONFIG.main.watch.poll_interval = args.poll_interval
+
+    server = start_metrics_endpoint() if CONFIG.main.metrics.enabled else None
+    try:
+        watch()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+def maintain_database(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py maintain",
+        description="Archive old rows of the flexprep uploaded table and report its size and query latency.",
+    )
+    parser.add_argument("--retention-hours", type=float, help="Hours of reference times to keep, overrides the setting")
+    args = parser.parse_args(argv)
+    settings = CONFIG.main.retention
+    if args.retention_hours is not None:
+        settings = settings.model_copy(update={"retention_hours": args.retention_hours})
+
+    print(format_maintenance(maintain(os.path.join(CONFIG.main.db.path, CONFIG.main.db.name), settings)))
+
+
+# Sub-commands; without one of them, the arguments describe a notification to process
+COMMANDS: dict[str, Callable[[list[str]], None]] = {
+    "status": status,
+    "report": report,
+    "simulate": simulate,
+    "replay": replay_log,
+    "watch": watch_database,
+    "maintain": maintain_database,
+}
+
+
+def main(argv: list[str] | None = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+    else:
+        run(argv)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+from typing import Any
+
+from flex_container_orchestrator.domain.lead_time_aggregator import DEFAULT_PRODUCT
+from flex_container_orchestrator.services.local_store import immediate_transaction, process_exists
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages, in execution order
+FLEXPREP = "flexprep"
+AGGREGATOR = "aggregator"
+FLEXPART = "flexpart"
+PYFLEXPLOT = "pyflexplot"
+STAGES = (FLEXPREP, AGGREGATOR, FLEXPART, PYFLEXPLOT)
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# The unit of work was dropped because newer inputs made it obsolete
+SUPERSEDED = "superseded"
+
+
+def cycle_key(date: str, time: str) -> str:
+    """
+    Returns:
+        str: Identifier of an IFS forecast cycle in the format YYYYMMDDHH.
+    """
+    return f"{date}{int(time):02d}"
+
+
+def window_key(config: dict) -> str:
+    """
+    Returns:
+        str: Identifier of a Flexpart window, i.e. its release site, product (unless it is
+            the default product) and start time.
+    """
+    product = config.get("PRODUCT", DEFAULT_PRODUCT)
+    if product == DEFAULT_PRODUCT:
+        return f"{config['RELEASE_SITE_NAME']}_{config['FORECAST_DATETIME']}"
+    return f"{config['RELEASE_SITE_NAME']}_{product}_{config['FORECAST_DATETIME']}"
+
+
+def window_product(key: str) -> str:
+    """
+    Returns:
+        str: The product of a Flexpart window identifier, see `window_key`.
+    """
+    parts = key.split("_")
+    return parts[1] if len(parts) == 3 else DEFAULT_PRODUCT
+
+
+class CheckpointStore:
+    """
+    Persists the completion state of each pipeline stage in the local store.
+
+    Flexprep and aggregator checkpoints are scoped to the notification (cycle and step),
+    while Flexpart and Pyflexplot checkpoints are scoped to the Flexpart window, so that
+    a window is never run twice, whichever notification made it ready.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    cycle TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    detail TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (stage, item)
+                )
+            """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS checkpoints_cycle ON checkpoints (cycle)")
+
+    def mark(self, cycle: str, stage: str, item: str, status: str, detail: Any = None) -> None:
+        """
+        Record the status of a stage item, replacing any previous record.
+
+        Args:
+            cycle (str): Forecast cycle which triggered the stage.
+            stage (str): Pipeline stage.
+            item (str): Identifier of the unit of work within the stage.
+            status (str): One of RUNNING, DONE, FAILED or SUPERSEDED.
+            detail (Any): JSON-serializable result of the stage, e.g. the aggregator configurations.
+        """
+        with self.conn:
+            self._insert(cycle, stage, item, status, detail)
+
+    def claim(self, cycle: str, stage: str, item: str) -> bool:
+        """
+        Atomically mark a stage item as running in this process, unless it is done or
+        running in another live orchestrator process.
+
+        Returns:
+            bool: True if this process now owns the item.
+        """
+        with immediate_transaction(self.conn):
+            row = self.conn.execute(
+                "SELECT status, detail FROM checkpoints WHERE stage = ? AND item = ?", (stage, item)
+            ).fetchone()
+            if row is not None and row[0] == DONE:
+                return False
+            if row is not None and row[0] == RUNNING and row[1] is not None:
+                owner = json.loads(row[1]).get("pid")
+                if owner is not None and process_exists(owner):
+                    logger.info("%s of %s is already running in process %d.", stage, item, owner)
+                    return False
+            self._insert(cycle, stage, item, RUNNING, {"pid": os.getpid()})
+        return True
+
+    def _insert(self, cycle: str, stage: str, item: str, status: str, detail: Any) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                cycle,
+                stage,
+                item,
+                status,
+                json.dumps(detail) if detail is not None else None,
+                datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            ),
+        )
+
+    def is_done(self, stage: str, item: str) -> bool:
+        row = self.conn.execute(
+            "SELECT status FROM checkpoints WHERE stage = ? AND item = ?", (stage, item)
+        ).fetchone()
+        return row is not None and row[0] == DONE
+
+    def result(self, stage: str, item: str) -> Any:
+        """
+        Returns:
+            Any: The stored detail of a completed stage item, None if the item is not done.
+        """
+        row = self.conn.execute(
+            "SELECT detail FROM checkpoints WHERE stage = ? AND item = ? AND status = ?",
+            (stage, item, DONE),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def failure(self, stage: str, item: str) -> Any:
+        """
+        Returns:
+            Any: The stored detail of a failed stage item, None if the item did not fail or
+                its failure has no detail.
+        """
+        row = self.conn.execute(
+            "SELECT detail FROM checkpoints WHERE stage = ? AND item = ? AND status = ?",
+            (stage, item, FAILED),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def count(self, stage: str, status: str, detail: Any = None) -> int:
+        """
+        Returns:
+            int: Number of items of a stage with the given status, and detail if given.
+        """
+        query = "SELECT COUNT(*) FROM checkpoints WHERE stage = ? AND status = ?"
+        parameters: tuple = (stage, status)
+        if detail is not None:
+            query += " AND detail = ?"
+            parameters += (json.dumps(detail),)
+        (count,) = self.conn.execute(query, parameters).fetchone()
+        return count
+
+    def in_flight(self) -> dict[str, int]:
+        """
+        Returns:
+            dict[str, int]: Number of stage items currently running, across all orchestrator processes.
+        """
+        return dict(
+            self.conn.execute(
+                "SELECT stage, COUNT(*) FROM checkpoints WHERE status = ? GROUP BY stage", (RUNNING,)
+            ).fetchall()
+        )
+
+    def cycles(self, cycle: str | None = None, limit: int = 10) -> dict[str, dict[str, dict[str, int]]]:
+        """
+        Summarize the checkpoints per cycle.
+
+        Args:
+            cycle (str | None): Restrict the summary to a single cycle (YYYYMMDDHH).
+            limit (int): Maximum number of most recent cycles to summarize.
+
+        Returns:
+            dict: Mapping of cycle -> stage -> status -> number of items.
+        """
+        if cycle is None:
+            cycles = [
+                c for (c,) in self.conn.execute(
+                    "SELECT DISTINCT cycle FROM checkpoints ORDER BY cycle DESC LIMIT ?", (limit,)
+                )
+            ]
+        else:
+            cycles = [cycle]
+
+        summary: dict[str, dict[str, dict[str, int]]] = {}
+        for c in cycles:
+            stages: dict[str, dict[str, int]] = {}
+            for stage, status, count in self.conn.execute(
+                "SELECT stage, status, COUNT(*) FROM checkpoints WHERE cycle = ? GROUP BY stage, status",
+                (c,),
+            ):
+                stages.setdefault(stage, {})[status] = count
+            summary[c] = stages
+        return summary
+
+
+def format_status(summary: dict[str, dict[str, dict[str, int]]]) -> str:
+    """
+    Render a checkpoint summary as a table with one row per cycle and one column per stage.
+
+    Returns:
+        str: The formatted table.
+    """
+    if not summary:
+        return "No checkpoints recorded."
+
+    lines = [f"{'cycle':<12}" + "".join(f"{stage:>24}" for stage in STAGES)]
+    for cycle, stages in summary.items():
+        cells = []
+        for stage in STAGES:
+            counts = stages.get(stage, {})
+            cell = " ".join(
+                f"{status}={counts[status]}" for status in (DONE, RUNNING, FAILED, SUPERSEDED)
+                if status in counts
+            )
+            cells.append(f"{cell or '-':>24}")
+        lines.append(f"{cycle:<12}" + "".join(cells))
+    return "\n".join(lines)
@@ -0,0 +1,317 @@
+"""
+Adaptive limit of the containers of a service running concurrently on the host.
+
+The limit follows an additive-increase/multiplicative-decrease (AIMD) policy: it grows
+by a fixed step while all slots are busy and the host has headroom, and is cut by a
+factor as soon as the host is under load or memory pressure or runs get slower than
+they used to be. Limit and slots live in the local store, so that all orchestrator
+processes started by Aviso share them.
+"""
+
+import contextlib
+import logging
+import math
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from typing import Iterator, NamedTuple
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import ConcurrencySettings
+from flex_container_orchestrator.services.local_store import (
+    connect_local_store, immediate_transaction, process_exists)
+from flex_container_orchestrator.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent runs compared against the older ones to detect duration inflation
+RECENT_RUNS = 3
+
+# Reasons of a limit adjustment
+INCREASE = "increase"
+LOAD = "load"
+MEMORY = "memory"
+DURATION = "duration"
+
+ADJUSTMENTS = REGISTRY.counter(
+    "orchestrator_concurrency_adjustments_total", "Changes of the concurrency limit.", ("service", "reason")
+)
+SLOT_WAIT = REGISTRY.histogram(
+    "orchestrator_concurrency_slot_wait_seconds", "Time spent waiting for a container slot.", ("service",)
+)
+HOST_LOAD = REGISTRY.gauge(
+    "orchestrator_host_load_per_cpu", "1-minute load average per CPU at the last limit adjustment."
+)
+HOST_MEMORY = REGISTRY.gauge(
+    "orchestrator_host_memory_available_ratio", "Available memory fraction at the last limit adjustment."
+)
+DURATION_INFLATION = REGISTRY.gauge(
+    "orchestrator_duration_inflation_ratio",
+    "Median duration of the most recent runs relative to the older ones.", ("service",)
+)
+
+
+class HostPressure(NamedTuple):
+    # 1-minute load average divided by the number of CPUs
+    load_per_cpu: float
+    # MemAvailable / MemTotal
+    available_memory: float
+
+
+def read_host_pressure(proc_root: str = "/proc") -> HostPressure | None:
+    """
+    Returns:
+        HostPressure | None: Load and memory pressure of the host, None if /proc is not readable.
+    """
+    try:
+        with open(os.path.join(proc_root, "loadavg"), encoding="utf-8") as f:
+            load = float(f.read().split()[0])
+        meminfo = {}
+        with open(os.path.join(proc_root, "meminfo"), encoding="utf-8") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                meminfo[name] = int(value.split()[0])
+        available = meminfo["MemAvailable"] / meminfo["MemTotal"]
+    except (OSError, ValueError, KeyError, IndexError, ZeroDivisionError) as e:
+        logger.debug("Could not read host pressure: %s", e)
+        return None
+    return HostPressure(load / (os.cpu_count() or 1), available)
+
+
+def duration_inflation(durations: list[float], recent: int = RECENT_RUNS) -> float:
+    """
+    Args:
+        durations (list[float]): Durations of successful runs, most recent first.
+        recent (int): Number of most recent runs to compare against the older ones.
+
+    Returns:
+        float: Median of the recent durations divided by the median of the older ones,
+            1 if there is not enough history.
+    """
+    if len(durations) < 2 * recent:
+        return 1.0
+    baseline = statistics.median(durations[recent:])
+    return statistics.median(durations[:recent]) / baseline if baseline > 0 else 1.0
+
+
+def next_limit(
+    limit: int, busy: int, pressure: HostPressure | None, inflation: float, settings: ConcurrencySettings
+) -> tuple[int, str | None]:
+    """
+    Apply one AIMD step to a concurrency limit.
+
+    Args:
+        limit (int): Current limit.
+        busy (int): Number of slots currently held.
+        pressure (HostPressure | None): Current host pressure, None if unknown.
+        inflation (float): Current duration inflation, see `duration_inflation`.
+        settings (ConcurrencySettings): Bounds and thresholds of the service.
+
+    Returns:
+        tuple[int, str | None]: The new limit and the reason of the change, None if unchanged.
+    """
+    if pressure is not None and pressure.available_memory < settings.min_available_memory:
+        reason: str | None = MEMORY
+    elif pressure is not None and pressure.load_per_cpu > settings.max_load_per_cpu:
+        reason = LOAD
+    elif inflation > settings.max_duration_inflation:
+        reason = DURATION
+    elif busy >= limit:
+        reason = INCREASE
+    else:
+        reason = None
+
+    if reason == INCREASE:
+        new_limit = limit + settings.increase_step
+    elif reason is not None:
+        new_limit = math.floor(limit * settings.decrease_factor)
+    else:
+        new_limit = limit
+    new_limit = max(settings.min_limit, min(settings.max_limit, new_limit))
+    return new_limit, reason if new_limit != limit else None
+
+
+class ConcurrencyLimiter:
+    """
+    Counting semaphore per service, persisted in the local store.
+
+    Slots are held by (process, thread) pairs. Slots of processes that no longer exist
+    are reclaimed, so that a crashed orchestrator does not leak capacity.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS concurrency_limits (
+                    service TEXT PRIMARY KEY,
+                    slot_limit INTEGER NOT NULL,
+                    reason TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS concurrency_slots (
+                    service TEXT NOT NULL,
+                    holder TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    acquired_at REAL NOT NULL,
+                    PRIMARY KEY (service, holder)
+                ) WITHOUT ROWID
+            """
+            )
+
+    def limit(self, service: str, settings: ConcurrencySettings) -> int:
+        row = self.conn.execute(
+            "SELECT slot_limit FROM concurrency_limits WHERE service = ?", (service,)
+        ).fetchone()
+        limit = row[0] if row else settings.initial_limit
+        # The bounds may have been reconfigured since the limit was stored
+        return max(settings.min_limit, min(settings.max_limit, limit))
+
+    def busy(self, service: str) -> int:
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM concurrency_slots WHERE service = ?", (service,)
+        ).fetchone()
+        return count
+
+    def adjust(
+        self, service: str, settings: ConcurrencySettings, pressure: HostPressure | None, inflation: float
+    ) -> tuple[int, str | None]:
+        """
+        Apply an AIMD step to the limit of a service, at most once per adjustment interval
+        across all orchestrator processes.
+
+        Returns:
+            tuple[int, str | None]: The limit and the reason of the change, None if unchanged.
+        """
+        now = time.time()
+        with immediate_transaction(self.conn):
+            row = self.conn.execute(
+                "SELECT updated_at FROM concurrency_limits WHERE service = ?", (service,)
+            ).fetchone()
+            limit = self.limit(service, settings)
+            if row is not None and now - row[0] < settings.adjust_interval:
+                return limit, None
+
+            self._reclaim(service)
+            new_limit, reason = next_limit(limit, self.busy(service), pressure, inflation, settings)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO concurrency_limits VALUES (?, ?, ?, ?)",
+                (service, new_limit, reason, now),
+            )
+        if reason is not None:
+            logger.info("Concurrency limit of %s changed from %d to %d (%s).", service, limit, new_limit, reason)
+        return new_limit, reason
+
+    def try_acquire(self, service: str, holder: str, settings: ConcurrencySettings) -> bool:
+        """
+        Returns:
+            bool: True if a slot was acquired, False if all slots are busy.
+        """
+        with immediate_transaction(self.conn):
+            self._reclaim(service)
+            if self.busy(service) >= self.limit(service, settings):
+                return False
+            self.conn.execute(
+                "INSERT OR REPLACE INTO concurrency_slots VALUES (?, ?, ?, ?)",
+                (service, holder, os.getpid(), time.time()),
+            )
+        return True
+
+    def release(self, service: str, holder: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM concurrency_slots WHERE service = ? AND holder = ?", (service, holder)
+            )
+
+    def state(self) -> dict[str, tuple[int, int]]:
+        """
+        Returns:
+            dict[str, tuple[int, int]]: Stored limit and number of busy slots per service.
+        """
+        limits = dict(self.conn.execute("SELECT service, slot_limit FROM concurrency_limits").fetchall())
+        busy = dict(
+            self.conn.execute("SELECT service, COUNT(*) FROM concurrency_slots GROUP BY service").fetchall()
+        )
+        return {service: (limit, busy.get(service, 0)) for service, limit in limits.items()}
+
+    def _reclaim(self, service: str) -> None:
+        stale = [
+            (service, holder) for holder, pid in self.conn.execute(
+                "SELECT holder, pid FROM concurrency_slots WHERE service = ?", (service,)
+            )
+            if not process_exists(pid)
+        ]
+        if stale:
+            logger.warning("Reclaiming %d slot(s) of %s held by terminated processes.", len(stale), service)
+            self.conn.executemany(
+                "DELETE FROM concurrency_slots WHERE service = ? AND holder = ?", stale
+            )
+
+
+@contextlib.contextmanager
+def concurrency_slot(service: str, durations: list[float]) -> Iterator[None]:
+    """
+    Hold one of the slots of a service for the wrapped container run, waiting until one is free.
+
+    Services without concurrency settings are not limited. Neither are runs while the
+    local store is unavailable, the limiter must not block the pipeline.
+
+    Args:
+        service (str): Docker compose service name.
+        durations (list[float]): Durations of the recent successful runs of the same kind, see
+            `run_history_key`, most recent first.
+    """
+    settings = CONFIG.main.concurrency.get(service)
+    if settings is None:
+        yield
+        return
+
+    try:
+        limiter = ConcurrencyLimiter(connect_local_store())
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Local store unavailable, running %s without concurrency limit: %s", service, e)
+        yield
+        return
+
+    holder = f"{os.getpid()}:{threading.get_ident()}"
+    inflation = duration_inflation(durations)
+    DURATION_INFLATION.set(inflation, service=service)
+    start = time.monotonic()
+    acquired = False
+    try:
+        try:
+            while True:
+                pressure = read_host_pressure()
+                if pressure is not None:
+                    HOST_LOAD.set(pressure.load_per_cpu)
+                    HOST_MEMORY.set(pressure.available_memory)
+                limit, reason = limiter.adjust(service, settings, pressure, inflation)
+                if reason is not None:
+                    ADJUSTMENTS.inc(service=service, reason=reason)
+                if limiter.try_acquire(service, holder, settings):
+                    acquired = True
+                    break
+                logger.debug("All %d slot(s) of %s busy, waiting.", limit, service)
+                time.sleep(settings.poll_interval)
+            SLOT_WAIT.observe(time.monotonic() - start, service=service)
+        except sqlite3.Error as e:
+            # E.g. the busy timeout expired while other processes held the store
+            logger.warning("Local store unavailable, running %s without concurrency limit: %s", service, e)
+
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    limiter.release(service, holder)
+                except sqlite3.Error as e:
+                    logger.warning("Could not release the slot of %s held by %s: %s", service, holder, e)
+    finally:
+        limiter.conn.close()
@@ -0,0 +1,202 @@
+import collections
+import logging
+import os
+import subprocess
+import threading
+import time
+from typing import IO, Callable
+
+from flex_container_orchestrator import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Interval in seconds after which buffered output is flushed to the run log file
+FLUSH_INTERVAL = 1.0
+# Seconds a timed out process gets to shut down after SIGTERM before it is killed
+TERMINATE_GRACE_PERIOD = 30
+# Seconds between two polls of the cancellation callback of a running command
+CANCEL_POLL_INTERVAL = 5
+
+
+class CommandCancelled(subprocess.SubprocessError):
+    """Raised when a command was terminated because its cancellation callback returned True."""
+
+    def __init__(self, cmd: list[str] | str, output: list[str]):
+        super().__init__(f"Command '{cmd}' was cancelled.")
+        self.cmd = cmd
+        self.output = output
+
+
+class RotatingLogFile:
+    """
+    Append-only log file which is rotated once it grows above a size limit.
+
+    Rotated files are renamed to "<path>.1", "<path>.2", ... with the oldest one
+    being dropped once `backup_count` files exist.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "ab")  # pylint: disable=consider-using-with
+        self._size = self._file.tell()
+        self._last_flush = time.monotonic()
+
+    def write(self, data: bytes) -> None:
+        if self.max_bytes > 0 and self._size + len(data) > self.max_bytes and self._size > 0:
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+        now = time.monotonic()
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                src = f"{self.path}.{index}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")  # pylint: disable=consider-using-with
+        self._size = 0
+
+
+class OutputCapture:
+    """
+    Streams the output of a process line by line into a rotating log file while
+    keeping only the last `tail_lines` lines in memory.
+
+    Memory usage is bounded by the ring buffer size, independently of how verbose
+    or long-running the process is.
+    """
+
+    def __init__(self, log_path: str, max_bytes: int, backup_count: int, tail_lines: int):
+        self.log_path = log_path
+        self._log_file = RotatingLogFile(log_path, max_bytes, backup_count)
+        self._tail: collections.deque[bytes] = collections.deque(maxlen=tail_lines)
+        self.line_count = 0
+
+    def consume(self, stream: IO[bytes]) -> None:
+        """
+        Read the stream until EOF, writing every line to the log file.
+
+        Args:
+            stream (IO[bytes]): Binary stream, typically the stdout of a subprocess.
+        """
+        try:
+            for line in iter(stream.readline, b""):
+                self._log_file.write(line)
+                self._tail.append(line)
+                self.line_count += 1
+        finally:
+            self._log_file.close()
+
+    @property
+    def tail(self) -> list[str]:
+        """
+        Returns:
+            list[str]: The last lines of output, decoded and stripped of line endings.
+        """
+        return [line.decode(errors="replace").rstrip("\r\n") for line in self._tail]
+
+
+def stream_command(
+    command: list[str] | str, log_name: str, timeout: float | None = None,
+    cancel: Callable[[], bool] | None = None
+) -> None:
+    """
+    Run a command and stream its combined stdout/stderr into a per-run rotating log file.
+
+    The output is consumed by a reader thread so that the calling thread can enforce
+    the timeout and poll the cancellation callback. A timed out or cancelled process is
+    terminated (docker compose forwards the signal to the container) and killed if it
+    does not exit within the grace period.
+
+    Args:
+        command (list[str] | str): Command to execute.
+        log_name (str): Name of the log file, relative to the container log directory.
+        timeout (float | None): Maximum runtime in seconds, None to wait indefinitely.
+        cancel (Callable[[], bool] | None): Polled while the command runs, returns True to stop it.
+
+    Raises:
+        subprocess.CalledProcessError: If the command returns a non-zero exit code.
+        subprocess.TimeoutExpired: If the command did not finish within the timeout.
+        CommandCancelled: If the command was cancelled.
+        In all cases the `output` attribute holds the last lines of output kept in memory.
+    """
+    settings = CONFIG.main.container_logs
+    capture = OutputCapture(
+        os.path.join(settings.path, f"{log_name}.log"),
+        settings.max_bytes,
+        settings.backup_count,
+        settings.tail_lines,
+    )
+    logger.info("Streaming output of '%s' to %s", command, capture.log_path)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as process:
+        assert process.stdout is not None
+        reader = threading.Thread(target=capture.consume, args=(process.stdout,), daemon=True)
+        reader.start()
+        while True:
+            waits = [CANCEL_POLL_INTERVAL if cancel else None]
+            if deadline is not None:
+                waits.append(max(0.0, deadline - time.monotonic()))
+            try:
+                returncode = process.wait(timeout=min((w for w in waits if w is not None), default=None))
+                break
+            except subprocess.TimeoutExpired:
+                if deadline is not None and time.monotonic() >= deadline:
+                    logger.warning("Command '%s' exceeded its timeout of %ss, terminating.", command, timeout)
+                    _stop(process, reader)
+                    raise subprocess.TimeoutExpired(command, timeout or 0, output=capture.tail) from None
+                if cancel is not None and cancel():
+                    logger.warning("Command '%s' was cancelled, terminating.", command)
+                    _stop(process, reader)
+                    raise CommandCancelled(command, capture.tail) from None
+        reader.join()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, output=capture.tail)
+
+
+def _stop(process: subprocess.Popen, reader: threading.Thread) -> None:
+    _terminate(process)
+    # Grandchildren may still hold the pipe open, do not wait for them forever
+    reader.join(timeout=TERMINATE_GRACE_PERIOD)
+
+
+def _terminate(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=TERMINATE_GRACE_PERIOD)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_log_name(date: str, time_: str, service: str, *parts: str) -> str:
+    """
+    Build the per-run log file name of a container, grouped by forecast cycle.
+
+    Args:
+        date (str): Forecast reference date in YYYYMMDD format.
+        time_ (str): Forecast reference time in HH format.
+        service (str): Docker compose service name.
+        parts (str): Additional identifiers of the run, e.g. the step or the Flexpart start time.
+
+    Returns:
+        str: Relative log name, e.g. "20250627_00/flexprep_01".
+    """
+    return os.path.join(f"{date}_{int(time_):02d}", "_".join([service, *parts]))
@@ -0,0 +1,94 @@
+import logging
+import sqlite3
+import time
+
+from flex_container_orchestrator.services.local_store import immediate_transaction
+
+logger = logging.getLogger(__name__)
+
+CLAIMED = "claimed"
+DONE = "done"
+
+
+def event_key(date: str, time_: str, step: str, location: str) -> str:
+    """
+    Returns:
+        str: Identity of a dissemination event, independent of the stream it was received on.
+    """
+    return f"{date}{int(time_):02d}_{int(step):02d}_{location}"
+
+
+class SeenEventStore:
+    """
+    Persistent, TTL-bounded record of the dissemination events already handled.
+
+    An event is claimed before it is processed. A claim is exclusive across concurrent
+    orchestrator processes because it is taken within an immediate (write-locked)
+    transaction on an indexed primary key. Claims of completed events suppress
+    duplicates until they expire; claims of events still in progress suppress
+    duplicates until the lease runs out, after which a crashed run can be taken over.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS seen_events (
+                    event_key TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    claimed_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    duplicates INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS seen_events_expiry ON seen_events (expires_at)")
+
+    def claim(self, key: str, ttl: float, lease: float) -> bool:
+        """
+        Try to claim an event for processing.
+
+        Args:
+            key (str): Event identity, see `event_key`.
+            ttl (float): Seconds during which a handled event suppresses duplicates.
+            lease (float): Seconds after which an unfinished claim may be taken over.
+
+        Returns:
+            bool: True if the caller should process the event, False if it is a duplicate.
+        """
+        now = time.time()
+        with immediate_transaction(self.conn):
+            self.conn.execute("DELETE FROM seen_events WHERE expires_at < ?", (now,))
+            row = self.conn.execute(
+                "SELECT status, claimed_at FROM seen_events WHERE event_key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[0] == CLAIMED and now - row[1] >= lease):
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO seen_events VALUES (?, ?, ?, ?, 0)",
+                    (key, CLAIMED, now, now + ttl),
+                )
+                claimed = True
+            else:
+                self.conn.execute(
+                    "UPDATE seen_events SET duplicates = duplicates + 1 WHERE event_key = ?", (key,)
+                )
+                claimed = False
+        return claimed
+
+    def complete(self, key: str) -> None:
+        with self.conn:
+            self.conn.execute("UPDATE seen_events SET status = ? WHERE event_key = ?", (DONE, key))
+
+    def release(self, key: str) -> None:
+        """Forget a claim, e.g. after a failed run, so that a redelivery is processed again."""
+        with self.conn:
+            self.conn.execute("DELETE FROM seen_events WHERE event_key = ?", (key,))
+
+    def suppressed(self) -> int:
+        """
+        Returns:
+            int: Number of duplicates suppressed for the events still remembered.
+        """
+        (count,) = self.conn.execute("SELECT COALESCE(SUM(duplicates), 0) FROM seen_events").fetchone()
+        return count
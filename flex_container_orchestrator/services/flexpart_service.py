@@ -1,29 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from functools import partial
 import logging
 import os
 from pathlib import Path
+import sqlite3
 import subprocess
 import sys
+import threading
+from time import monotonic
+from typing import Any, Callable
 
-from flex_container_orchestrator.domain.lead_time_aggregator import run_aggregator
+from flex_container_orchestrator.domain.lead_time_aggregator import (
+    PROGRESSIVE, product_time_settings, run_aggregator, window_input_forecasts)
+from flex_container_orchestrator.services.checkpoints import (
+    AGGREGATOR, DONE, FAILED, FLEXPART, FLEXPREP, PYFLEXPLOT, RUNNING, SUPERSEDED,
+    CheckpointStore, cycle_key, window_key)
+from flex_container_orchestrator.services.container_output import run_log_name, stream_command
+from flex_container_orchestrator.services.input_manifest import InputManifest, inputs_processed, mark_ready
+from flex_container_orchestrator.services.latency import (
+    NOTIFIED, PLANNED, PLOTTED, PROCESSED, SIMULATED, LatencyStore, step_label)
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.met_cache import cached_met_files
+from flex_container_orchestrator.services.deduplication import SeenEventStore, event_key
+from flex_container_orchestrator.services.flexprep_service import run_flexprep
+from flex_container_orchestrator.services.metrics import (
+    DUPLICATES, ECR_TOKEN_AGE, NOTIFICATIONS, QUEUE_DEPTH, observe_readiness_query)
+from flex_container_orchestrator.services.output_handoff import OutputHandoff, output_handoff
+from flex_container_orchestrator.services.preflight import ALREADY_PROCESSED, step_processed
+from flex_container_orchestrator.services.profiling import profile_stage, profile_thread
+from flex_container_orchestrator.services.pyflexplot_service import run_pyflexplot
+from flex_container_orchestrator.services.stage_runner import (
+    StageCancelled, StageError, compose_command, run_history_key, run_stage)
+from flex_container_orchestrator.services.supersession import (
+    IN_FLIGHT, QUEUED, SUPERSEDED_RUNS, SupersessionCheck, supersession_settings)
 from flex_container_orchestrator import CONFIG
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
-def run_command(command: list[str] | str, capture_output: bool = False) -> bytes | None:
+# ECR authorization tokens are valid for 12 hours, renew them with some margin
+ECR_TOKEN_VALIDITY = 11 * 3600
+_ECR_LOGIN_TIME: float | None = None
+_ECR_LOGIN_LOCK = threading.Lock()
+
+# Release site of the Flexpart windows
+RELEASE_SITE = "BEZ"
+
+# Key of the Flexpart checkpoint detail of a window whose progressive start failed, and
+# qualifier of the run history of progressive starts, which wait for their inputs
+PROGRESSIVE_FAILURE = "progressive"
+
+# Variables of a Flexpart window, passed to its container. The image writes the output of
+# products other than the default product below their own prefix, see `flexpart_output_key`.
+WINDOW_VARIABLES = (
+    "RELEASE_SITE_NAME", "PRODUCT", "IBDATE", "IBTIME", "IEDATE", "IETIME", "FORECAST_DATETIME", "TDELTA", "TFREQ_F",
+    "TFREQ"
+)
+
+def run_command(
+    command: list[str] | str, capture_output: bool = False, log_name: str | None = None
+) -> bytes | None:
     """
     Helper function to run shell commands and handle errors.
+
+    If `log_name` is given, the command output is streamed line by line into its own
+    rotating log file below the configured container log directory instead of being
+    inherited by the orchestrator, and the last lines are reported on failure.
     """
     try:
         if capture_output:
             return subprocess.check_output(command).strip()
-        subprocess.check_call(command)
+        if log_name is None:
+            subprocess.check_call(command)
+        else:
+            stream_command(command, log_name)
     except subprocess.CalledProcessError as e:
         logger.error(f"Command '{' '.join(command)}' failed with error: {e}")
+        if e.output:
+            logger.error("Last output lines of the command:\n%s", "\n".join(e.output))
         sys.exit(1)
 
     return None
 
+
 def login_ecr():
     """
     Log in to AWS ECR by retrieving the login password and passing it to Docker login.
@@ -64,9 +124,114 @@ def login_ecr():
         logger.error("Error logging in to Docker: %s", e)
         sys.exit(1)
 
-def main(date: str, location: str, time: str, step: str) -> None:
-    # Retrieve ECR login password and log in to Docker
-    login_ecr()
+def ensure_ecr_login() -> None:
+    """
+    Log in to AWS ECR unless a login of this process is still valid.
+
+    The login is deferred until the first container actually has to run, so that
+    resumed pipelines with nothing left to do never contact ECR.
+    """
+    global _ECR_LOGIN_TIME  # pylint: disable=global-statement
+    with _ECR_LOGIN_LOCK:
+        if _ECR_LOGIN_TIME is None or monotonic() - _ECR_LOGIN_TIME > ECR_TOKEN_VALIDITY:
+            login_ecr()
+            _ECR_LOGIN_TIME = login_time = monotonic()
+            ECR_TOKEN_AGE.set_function(lambda: {(): monotonic() - login_time})
+
+
+def write_env_file(env_vars: dict[str, str]) -> None:
+    with open(".env", "w") as f:
+        for key, value in env_vars.items():
+            f.write(f"{key}={value}\n")
+
+    load_dotenv(dotenv_path=Path(".env"), override=True)
+
+
+def run_checkpointed_stage(
+    checkpoints: CheckpointStore,
+    cycle: str,
+    stage: str,
+    item: str,
+    action: Callable[[], None],
+    failure_detail: Any = None,
+) -> bool:
+    """
+    Run a stage unless the checkpoint store records it as done or running in another process.
+
+    Args:
+        action (Callable[[], None]): Runs the containers of the stage, raising StageError on failure.
+        failure_detail (Any): Detail recorded with the checkpoint if the stage failed.
+
+    Returns:
+        bool: False if another orchestrator process is running the stage, which then also
+            takes care of the following stages.
+
+    Raises:
+        StageCancelled: If the stage was cancelled, after recording it as superseded.
+        StageError: If the stage failed, after recording the failure.
+    """
+    if checkpoints.is_done(stage, item):
+        logger.info("Skipping %s for %s, already completed.", stage, item)
+        return True
+
+    if not checkpoints.claim(cycle, stage, item):
+        return checkpoints.is_done(stage, item)
+    try:
+        ensure_ecr_login()
+        with profile_stage(f"{stage}:{item}"):
+            action()
+    except StageCancelled:
+        checkpoints.mark(cycle, stage, item, SUPERSEDED)
+        raise
+    except BaseException:
+        checkpoints.mark(cycle, stage, item, FAILED, detail=failure_detail)
+        raise
+    checkpoints.mark(cycle, stage, item, DONE)
+    return True
+
+
+def main(date: str, location: str, time: str, step: str, force: bool = False) -> None:
+    """
+    Process a dissemination notification, unless it is a duplicate of an event already handled.
+
+    Args:
+        force (bool): Process the notification even if it was already handled.
+    """
+    NOTIFICATIONS.inc()
+    conn = connect_local_store()
+    settings = CONFIG.main.deduplication
+    if force or not settings.enabled:
+        run_pipeline(conn, date, location, time, step)
+        return
+
+    seen_events = SeenEventStore(conn)
+    key = event_key(date, time, step, location)
+    if not seen_events.claim(key, settings.ttl_hours * 3600, settings.lease_minutes * 60):
+        logger.info("Suppressing duplicate notification %s.", key)
+        DUPLICATES.inc()
+        return
+
+    try:
+        run_pipeline(conn, date, location, time, step)
+    except SystemExit as e:
+        # The aggregator exits with 0 when no Flexpart window is ready yet
+        if e.code in (0, None):
+            seen_events.complete(key)
+        else:
+            seen_events.release(key)
+        raise
+    except BaseException:
+        seen_events.release(key)
+        raise
+    seen_events.complete(key)
+
+
+def run_pipeline(conn: sqlite3.Connection, date: str, location: str, time: str, step: str) -> None:
+    cycle = cycle_key(date, time)
+    checkpoints = CheckpointStore(conn)
+    latencies = LatencyStore(conn)
+    label = step_label(date, time, step)
+    latencies.record(NOTIFIED, label)
 
     # Set only what you know so far
     env_vars = {
@@ -86,67 +251,253 @@ def main(date: str, location: str, time: str, step: str) -> None:
         "PRESET": ""
     }
 
-    # Write to .env
-    with open(".env", "w") as f:
-        for key, value in env_vars.items():
-            f.write(f"{key}={value}\n")
-
-    load_dotenv(dotenv_path=Path(".env"), override=True)
+    write_env_file(env_vars)
 
     # ====== Run flexprep ======
+    flexprep_item = f"{cycle}_{step}_{location}"
+    if not checkpoints.is_done(FLEXPREP, flexprep_item) and step_processed(label):
+        logger.info("Step %s is already processed in the flexprep database, skipping flexprep.", label)
+        checkpoints.mark(cycle, FLEXPREP, flexprep_item, DONE, detail=ALREADY_PROCESSED)
+
     try:
-        # Run Docker Compose to launch flexprep
-        docker_compose_command = ["docker", "compose", "run", "--rm", "flexprep"]
-        run_command(docker_compose_command)
+        claimed = run_checkpointed_stage(
+            checkpoints, cycle, FLEXPREP, flexprep_item,
+            partial(run_flexprep, date, time, step, location, run_log_name(date, time, FLEXPREP, step))
+        )
 
-    except subprocess.CalledProcessError:
+    except StageError:
         logger.error("Flexprep failed.")
         sys.exit(1)
 
+    if not claimed:
+        return
+
+    latencies.record(PROCESSED, label)
+    mark_ready({label})
     logger.info("Pre-processing container executed successfully.")
 
     # ====== Run lead_time_aggregator.py ======
-    try:
-        configurations = run_aggregator(date, time, int(step))
+    aggregator_item = f"{cycle}_{step}"
+    configurations = checkpoints.result(AGGREGATOR, aggregator_item)
+    if configurations is not None:
+        logger.info("Resuming with %d checkpointed Flexpart configuration(s).", len(configurations))
+    else:
+        try:
+            with profile_stage(AGGREGATOR):
+                configurations = run_aggregator(
+                    date, time, int(step), observe_readiness_query, partial(progressive_start_failed, checkpoints)
+                )
 
-    except Exception as e:
-        logger.error("Aggregator encountered an error: %s", e)
-        sys.exit(1)
+        except Exception as e:
+            logger.error("Aggregator encountered an error: %s", e)
+            sys.exit(1)
+
+        for config in configurations:
+            config["RELEASE_SITE_NAME"] = RELEASE_SITE
+        checkpoints.mark(cycle, AGGREGATOR, aggregator_item, DONE, detail=configurations)
+
+    for config in configurations:
+        latencies.record(PLANNED, window_key(config))
+    QUEUE_DEPTH.inc(len(configurations), stage=FLEXPART)
 
     logger.info("Aggregator launch script executed successfully.")
 
     # ====== Run Flexpart and Pyflexplot ======
-    for config in configurations:
-        env_vars.update({
-            "RELEASE_SITE_NAME": "BEZ",
-            "IBDATE": config["IBDATE"],
-            "IBTIME": config["IBTIME"],
-            "IEDATE": config["IEDATE"],
-            "IETIME": config["IETIME"],
-            "FORECAST_DATETIME": config["FORECAST_DATETIME"],
-            "PRESET": "opr/ifs-hres-eu/all_pdf"
-        })
-
-        with open(".env", "w") as f:
-            for key, value in env_vars.items():
-                f.write(f"{key}={value}\n")
-
-        load_dotenv(dotenv_path=Path(".env"), override=True)
+    workers = min(window_workers(), len(configurations)) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="window") as pool:
+        futures = {
+            window_key(config): pool.submit(run_window, date, time, config) for config in configurations
+        }
+
+    failed = [key for key, future in futures.items() if future.exception() is not None]
+    if failed:
+        logger.error("Flexpart or Pyflexplot failed for window(s): %s", ", ".join(failed))
+        sys.exit(1)
 
+
+def progressive_start_failed(checkpoints: CheckpointStore, config: dict) -> bool:
+    """
+    Returns:
+        bool: True if the last Flexpart run of the window was a failed progressive start, in
+            which case the window only runs again once all its inputs are processed.
+    """
+    failure = checkpoints.failure(FLEXPART, window_key({**config, "RELEASE_SITE_NAME": RELEASE_SITE}))
+    return isinstance(failure, dict) and bool(failure.get(PROGRESSIVE_FAILURE))
+
+
+def window_workers() -> int:
+    """
+    Returns:
+        int: Number of Flexpart windows run concurrently by one orchestrator process, i.e. the
+            largest Flexpart concurrency limit. The adaptive limit shared with the other
+            orchestrator processes applies on top.
+    """
+    concurrency = CONFIG.main.concurrency.get(FLEXPART)
+    return concurrency.max_limit if concurrency else 1
+
+
+def run_flexpart(
+    config: dict, log_name: str, cancel: Callable[[], bool] | None = None, handoff: OutputHandoff | None = None
+) -> None:
+    """
+    Run the Flexpart container of a configuration.
+
+    The window's variables are passed to the container instead of being written to the
+    .env file. If the met cache is enabled, the inputs are provided from the local cache.
+    A window started before all its inputs are processed gets an input manifest instead,
+    see `InputManifest`, and reads its inputs from S3. Its run is recorded apart from
+    complete windows, since it waits for its inputs.
+
+    Args:
+        config (dict): Flexpart configuration, see `define_config` and `tag_config`.
+        log_name (str): Name of the per-run log file, relative to the container log directory.
+        cancel (Callable[[], bool] | None): Polled while Flexpart runs, returns True to stop it.
+        handoff (OutputHandoff | None): Local directory receiving the output, None to let
+            Flexpart upload it.
+
+    Raises:
+        StageError: If Flexpart failed, or if the input manifest of a progressively started
+            window could not be written, so that the window runs once all inputs are processed.
+    """
+    # Configurations checkpointed before products were introduced lack the time settings
+    environment = {name: config[name] for name in WINDOW_VARIABLES if name in config}
+    labels = window_input_forecasts(config, product_time_settings(config.get("PRODUCT")))
+
+    volumes = []
+    if handoff is not None:
+        handoff.prepare()
+        volumes.append(handoff.volume)
+        environment[handoff.settings.output_dir_variable] = handoff.settings.container_path
+
+    manifest = None
+    if config.get(PROGRESSIVE):
+        manifest = InputManifest(config, CONFIG.main.manifests)
+        try:
+            manifest.create()
+        except OSError as e:
+            raise StageError(f"Could not write the input manifest of {manifest.key}: {e}") from e
+        volumes.append(manifest.volume)
+        environment[manifest.settings.manifest_variable] = manifest.container_file
+        # The later inputs cannot be cached before they are processed
+        labels = []
+
+    history_key = run_history_key(FLEXPART, config)
+    if manifest is not None:
+        history_key = f"{history_key}:{PROGRESSIVE_FAILURE}"
+
+    try:
+        with cached_met_files(labels, f"{os.getpid()}:{window_key(config)}") as volume:
+            if volume is not None:
+                volumes.append(volume)
+                environment[CONFIG.main.met_cache.input_dir_variable] = CONFIG.main.met_cache.container_path
+            command = compose_command(FLEXPART, environment=environment, volumes=volumes)
+            run_stage(FLEXPART, command, log_name, cancel=cancel, history_key=history_key)
+    finally:
+        if manifest is not None:
+            manifest.remove()
+
+
+def run_window(date: str, time: str, config: dict) -> None:
+    """
+    Run Flexpart and Pyflexplot for one Flexpart window.
+
+    Windows may run in worker threads, so each one uses its own local store connection,
+    passes its variables to the container instead of writing them to the .env file and is
+    profiled on its own if profiling is active.
+
+    If supersession is enabled for the product of the window, a window made obsolete by
+    newer IFS runs is dropped before Flexpart starts, or Flexpart is stopped while it runs.
+
+    A progressive window whose progressive start already failed, e.g. when resuming the
+    checkpointed configurations of a cycle, runs as a complete window if all its inputs are
+    processed. Otherwise it is deferred to the notification making it ready.
+
+    If the output hand-off is enabled, Pyflexplot reads the Flexpart output from a local
+    directory while it is uploaded. Without a local output, e.g. when resuming a window
+    whose upload completed, Pyflexplot reads it from S3.
+
+    Raises:
+        StageError: If Flexpart or Pyflexplot failed.
+    """
+    cycle = cycle_key(date, time)
+    key = window_key(config)
+    QUEUE_DEPTH.dec(stage=FLEXPART)
+    with profile_thread(), contextlib.closing(connect_local_store()) as conn:
+        checkpoints = CheckpointStore(conn)
+        latencies = LatencyStore(conn)
+
+        if config.get(PROGRESSIVE) and not checkpoints.is_done(FLEXPART, key) and (
+            progressive_start_failed(checkpoints, config)
+        ):
+            if not inputs_processed(config):
+                logger.info("Deferring Flexpart window %s until all its inputs are processed.", key)
+                return
+            logger.info("Running Flexpart window %s as a complete window, its progressive start failed.", key)
+            config = {name: value for name, value in config.items() if name != PROGRESSIVE}
+
+        settings = supersession_settings(config)
+        supersession = SupersessionCheck(config, settings) if settings is not None else None
+        if supersession is not None and not checkpoints.is_done(FLEXPART, key) and supersession.check():
+            logger.info("Dropping Flexpart window %s, %s.", key, supersession.reason)
+            SUPERSEDED_RUNS.inc(phase=QUEUED)
+            checkpoints.mark(cycle, FLEXPART, key, SUPERSEDED, detail=supersession.reason)
+            return
+
+        handoff = output_handoff(config)
         try:
             # Launch Flexpart using Docker Compose
-            docker_compose_command = ["docker", "compose", "run", "--rm", "flexpart"]
-            run_command(docker_compose_command)
+            log_name = run_log_name(date, time, FLEXPART, config["FORECAST_DATETIME"])
+            if not run_checkpointed_stage(
+                checkpoints, cycle, FLEXPART, key,
+                partial(run_flexpart, config, log_name, supersession, handoff=handoff),
+                failure_detail={PROGRESSIVE_FAILURE: True} if config.get(PROGRESSIVE) else None,
+            ):
+                return
+
+        except StageCancelled:
+            logger.info("Stopped Flexpart window %s, %s.", key, supersession.reason if supersession else "cancelled")
+            SUPERSEDED_RUNS.inc(phase=IN_FLIGHT)
+            if handoff is not None:
+                handoff.discard()
+            return
 
-        except subprocess.CalledProcessError:
+        except StageError:
             logger.error("Error running Flexpart for configuration: %s", config)
-            sys.exit(1)
+            if handoff is not None:
+                handoff.discard()
+            raise
+
+        latencies.record(SIMULATED, key)
+
+        uploading = None
+        if handoff is not None and handoff.available():
+            handoff.start_upload()
+            uploading = handoff
+        elif handoff is not None:
+            logger.info("No local Flexpart output for %s, Pyflexplot reads it from S3.", key)
+            handoff.discard()
 
         try:
-            # Launch Pyflexplot using Docker Compose
-            docker_compose_command = ["docker", "compose", "run", "--rm", "pyflexplot"]
-            run_command(docker_compose_command)
+            # Launch Pyflexplot for all presets of the release site
+            log_name = run_log_name(date, time, PYFLEXPLOT, config["FORECAST_DATETIME"])
+            local_output = uploading.output if uploading is not None else None
+            plotted = run_checkpointed_stage(
+                checkpoints, cycle, PYFLEXPLOT, key, partial(run_pyflexplot, config, log_name, local_output)
+            )
 
-        except subprocess.CalledProcessError:
-            logger.error("Error running Pyflexplot for configuration: %s", config)
-            sys.exit(1)
+        except BaseException as e:
+            if isinstance(e, StageError):
+                logger.error("Error running Pyflexplot for configuration: %s", config)
+            if uploading is not None:
+                # The failure of Pyflexplot is raised, an upload failure was already logged by the upload
+                with contextlib.suppress(StageError):
+                    uploading.finish()
+            raise
+
+        # The upload runs alongside Pyflexplot and the window is only complete once it finished
+        if uploading is not None:
+            uploading.finish()
+        if not plotted:
+            return
+
+        latencies.record(PLOTTED, key)
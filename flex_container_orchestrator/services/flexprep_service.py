@@ -0,0 +1,230 @@
+"""
+Pre-processing of one disseminated step with flexprep.
+
+A single flexprep container processes all input objects of a step one after the other,
+which is the critical path between dissemination and readiness. With sharding enabled,
+the orchestrator lists the objects under the step's location, splits them by size into
+shards processed by parallel flexprep containers, and marks the step as processed in the
+flexprep database once all shards succeeded.
+
+Each shard writes its part of the step's pre-processed met file to its own object key,
+see `shard_output_key`. Once all shards succeeded, the orchestrator concatenates the parts,
+i.e. their GRIB messages, into the met file and only then marks the step as processed.
+"""
+
+import contextlib
+import logging
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import FlexprepShardSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import parse_forecast_datetime
+from flex_container_orchestrator.services.checkpoints import FLEXPREP
+from flex_container_orchestrator.services.latency import step_label
+from flex_container_orchestrator.services.local_store import BUSY_TIMEOUT, immediate_transaction
+from flex_container_orchestrator.services.met_cache import met_file_key
+from flex_container_orchestrator.services.metrics import REGISTRY
+from flex_container_orchestrator.services.s3 import s3_client, split_s3_url
+from flex_container_orchestrator.services.stage_runner import StageError, compose_command, run_stage
+
+logger = logging.getLogger(__name__)
+
+SHARDS = REGISTRY.histogram(
+    "orchestrator_flexprep_shards", "Number of flexprep shards per pre-processed step.", buckets=(1, 2, 4, 8, 16)
+)
+
+# History key of shard runs, which process only part of a step and must not lower the reference of whole steps
+SHARD_HISTORY_KEY = f"{FLEXPREP}:shard"
+
+
+def list_input_objects(location: str, s3: Any = None) -> list[tuple[str, int]]:
+    """
+    Args:
+        location (str): Location of the step's input objects, e.g. s3://flexpart-input/P1S...
+
+    Returns:
+        list[tuple[str, int]]: Keys and sizes of the objects under the location.
+
+    Raises:
+        BotoCoreError, ClientError: If the objects could not be listed.
+    """
+    bucket, prefix = split_s3_url(location)
+    s3 = s3 if s3 is not None else s3_client()
+    objects = []
+    request = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = s3.list_objects_v2(**request)
+        objects += [(entry["Key"], int(entry["Size"])) for entry in response.get("Contents", [])]
+        if not response.get("IsTruncated"):
+            return objects
+        request["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def shard_count(total_bytes: int, objects: int, settings: FlexprepShardSettings) -> int:
+    """
+    Returns:
+        int: Number of shards of a step, one per started `shard_bytes` of input and at most
+            one per object.
+    """
+    return max(1, min(math.ceil(total_bytes / settings.shard_bytes), settings.max_shards, objects))
+
+
+def split_into_shards(objects: list[tuple[str, int]], count: int) -> list[list[str]]:
+    """
+    Split objects into shards of about equal size, the largest objects are assigned first
+    to the smallest shard.
+
+    Returns:
+        list[list[str]]: Sorted object keys of each non-empty shard.
+    """
+    shards: list[list[str]] = [[] for _ in range(count)]
+    sizes = [0] * count
+    for key, size in sorted(objects, key=lambda entry: (-entry[1], entry[0])):
+        smallest = sizes.index(min(sizes))
+        shards[smallest].append(key)
+        sizes[smallest] += size
+    return [sorted(shard) for shard in shards if shard]
+
+
+def plan_shards(location: str, settings: FlexprepShardSettings, s3: Any = None) -> list[list[str]] | None:
+    """
+    Returns:
+        list[list[str]] | None: Object keys of the shards of a step, None to process the step
+            with a single flexprep container.
+    """
+    if not settings.enabled:
+        return None
+    try:
+        objects = list_input_objects(location, s3)
+    except (BotoCoreError, ClientError) as e:
+        logger.warning("Could not list %s, running a single flexprep container: %s", location, e)
+        return None
+
+    count = shard_count(sum(size for _, size in objects), len(objects), settings)
+    if count < 2:
+        return None
+    shards = split_into_shards(objects, count)
+    logger.info("Splitting the %d input objects of %s into %d flexprep shards.", len(objects), location, len(shards))
+    return shards
+
+
+def shard_output_key(key: str, index: int) -> str:
+    """
+    Returns:
+        str: Object key of the part of the met file `key` written by the shard with the given index.
+    """
+    return f"{key}.shard{index}"
+
+
+def merge_shard_outputs(key: str, count: int, s3: Any = None) -> None:
+    """
+    Concatenate the parts written by the shards of a step into its met file in the flexprep
+    output bucket, in shard order, and remove the parts.
+
+    Raises:
+        StageError: If a part is missing or the met file could not be written. The parts are
+            kept, so that the step is pre-processed again by the next run.
+    """
+    bucket = CONFIG.main.s3.buckets.flexprep_output
+    s3 = s3 if s3 is not None else s3_client()
+    parts = [shard_output_key(key, index) for index in range(count)]
+    try:
+        with tempfile.TemporaryDirectory(prefix="flexprep-shards-") as directory:
+            merged = os.path.join(directory, "merged")
+            with open(merged, "wb") as output:
+                for part in parts:
+                    path = os.path.join(directory, os.path.basename(part))
+                    s3.download_file(bucket, part, path)
+                    with open(path, "rb") as f:
+                        shutil.copyfileobj(f, output)
+                    os.remove(path)
+            s3.upload_file(merged, bucket, key)
+    except (BotoCoreError, ClientError, OSError) as e:
+        raise StageError(f"Could not merge the {count} shard outputs of s3://{bucket}/{key}: {e}") from e
+
+    for part in parts:
+        try:
+            s3.delete_object(Bucket=bucket, Key=part)
+        except (BotoCoreError, ClientError) as e:
+            logger.warning("Could not remove shard output s3://%s/%s: %s", bucket, part, e)
+
+
+def mark_step_processed(date: str, time: str, step: str) -> None:
+    """
+    Mark a step as processed in the flexprep database, as flexprep does for unsharded steps.
+
+    Raises:
+        StageError: If the flexprep database could not be updated.
+    """
+    reference_time = parse_forecast_datetime(date, time).isoformat(" ")
+    db_path = os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)
+    try:
+        with contextlib.closing(sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)) as conn:
+            with immediate_transaction(conn):
+                updated = conn.execute(
+                    "UPDATE uploaded SET processed = 1 WHERE forecast_ref_time = ? AND step = ?",
+                    (reference_time, int(step)),
+                ).rowcount
+                if not updated:
+                    conn.execute(
+                        "INSERT INTO uploaded (forecast_ref_time, step, processed) VALUES (?, ?, 1)",
+                        (reference_time, int(step)),
+                    )
+    except sqlite3.Error as e:
+        raise StageError(f"Could not mark step {step} of {date}{time} as processed: {e}") from e
+
+
+def run_flexprep(date: str, time: str, step: str, location: str, log_name: str, s3: Any = None) -> None:
+    """
+    Pre-process a step with one flexprep container, or with parallel shards if enabled.
+
+    The arguments are passed explicitly, the .env file is shared with concurrent orchestrator processes.
+
+    Args:
+        log_name (str): Name of the per-run log file, relative to the container log directory.
+            Shards log to their own files with the shard index appended.
+        s3 (Any): S3 client listing the input objects and merging the shard outputs, created on demand.
+
+    Raises:
+        StageError: If flexprep failed for the step or any of its shards, or the shard outputs
+            could not be merged, in which case the step is not marked as processed.
+    """
+    arguments = ("--step", step, "--date", date, "--time", time, "--location", location)
+    settings = CONFIG.main.flexprep_shards
+    shards = plan_shards(location, settings, s3)
+    if shards is None:
+        SHARDS.observe(1)
+        run_stage(FLEXPREP, compose_command(FLEXPREP, *arguments), log_name)
+        return
+
+    SHARDS.observe(len(shards))
+    key = met_file_key(step_label(date, time, step), CONFIG.main.met_cache.key_template)
+    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="flexprep-shard") as pool:
+        futures = [
+            pool.submit(
+                run_stage,
+                FLEXPREP,
+                compose_command(FLEXPREP, *arguments, environment={
+                    settings.keys_variable: ",".join(keys),
+                    settings.shard_variable: f"{index}/{len(shards)}",
+                    settings.output_key_variable: shard_output_key(key, index),
+                }),
+                f"{log_name}_shard{index}",
+                history_key=SHARD_HISTORY_KEY,
+            )
+            for index, keys in enumerate(shards)
+        ]
+
+    failed = [str(index) for index, future in enumerate(futures) if future.exception() is not None]
+    if failed:
+        raise StageError(f"Flexprep failed for shard(s) {', '.join(failed)} of {len(shards)}")
+    merge_shard_outputs(key, len(shards), s3)
+    mark_step_processed(date, time, step)
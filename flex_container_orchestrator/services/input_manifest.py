@@ -0,0 +1,200 @@
+"""
+Input manifests of Flexpart windows started before all their inputs are processed.
+
+A progressively started window gets a JSON manifest in a directory mounted into its
+Flexpart container, listing the window's inputs in lead time order and whether flexprep
+processed them. The manifest is written when Flexpart starts and updated whenever a later
+input is processed, by the orchestrator process of the step or by the watcher. Flexpart
+reads an input once the manifest lists it as ready.
+
+If the window fails, e.g. because Flexpart caught up with its inputs, its checkpoint
+records the failed progressive start. The window is not started progressively again and
+runs, without manifest, once all its inputs are processed.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+from typing import Iterator
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import ManifestSettings, TimeSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import (
+    fetch_processed_labels, product_time_settings, window_input_forecasts)
+from flex_container_orchestrator.services.checkpoints import window_key
+from flex_container_orchestrator.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_SUFFIX = ".json"
+
+MANIFEST_UPDATES = REGISTRY.counter(
+    "orchestrator_manifest_updates_total", "Inputs marked as ready in the manifests of progressively started windows."
+)
+
+
+@contextlib.contextmanager
+def _locked(path: str) -> Iterator[None]:
+    # Manifests are updated by several orchestrator processes, the lock file serializes them
+    with open(f"{path}.lock", "a", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def manifest_document(key: str, inputs: list[str], ready: set[str]) -> dict:
+    """
+    Returns:
+        dict: Manifest of a Flexpart window, its inputs in lead time order and whether they are ready.
+    """
+    return {
+        "window": key,
+        "complete": all(label in ready for label in inputs),
+        "updated": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "inputs": [
+            {"label": label, "reference_time": label[:-2], "step": int(label[-2:]), "ready": label in ready}
+            for label in inputs
+        ],
+    }
+
+
+def update_manifest(path: str, ready: set[str], key: str | None = None, inputs: list[str] | None = None) -> int:
+    """
+    Mark inputs of a manifest as ready, inputs once ready stay ready.
+
+    Args:
+        path (str): Path of the manifest.
+        ready (set[str]): Labels of newly processed inputs.
+        key, inputs: Window key and inputs to create the manifest with if it does not exist.
+
+    Returns:
+        int: Number of inputs of the manifest newly marked as ready.
+    """
+    with _locked(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                document = json.load(f)
+            key = document["window"]
+            inputs = [entry["label"] for entry in document["inputs"]]
+            already_ready = {entry["label"] for entry in document["inputs"] if entry["ready"]}
+        except FileNotFoundError:
+            if key is None or inputs is None:
+                # The window finished and removed its manifest
+                return 0
+            document, already_ready = None, set()
+
+        newly_ready = (ready & set(inputs)) - already_ready
+        if document is not None and not newly_ready:
+            return 0
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(manifest_document(key, inputs, already_ready | newly_ready), f, indent=2)
+        # Flexpart never reads a partially written manifest
+        os.replace(temporary, path)
+    return len(newly_ready)
+
+
+class InputManifest:
+    """Manifest of the inputs of one progressively started Flexpart window."""
+
+    def __init__(self, config: dict, settings: ManifestSettings, time_settings: TimeSettings | None = None):
+        self.settings = settings
+        self.key = window_key(config)
+        self.inputs = window_input_forecasts(config, time_settings or product_time_settings(config.get("PRODUCT")))
+        self.path = os.path.join(os.path.abspath(settings.path), f"{self.key}{MANIFEST_SUFFIX}")
+
+    @property
+    def volume(self) -> str:
+        """Read-only volume of the manifest directory for the Flexpart container."""
+        return f"{os.path.dirname(self.path)}:{self.settings.container_path}:ro"
+
+    @property
+    def container_file(self) -> str:
+        """Path of the manifest in the Flexpart container."""
+        return f"{self.settings.container_path}/{os.path.basename(self.path)}"
+
+    def create(self) -> None:
+        """
+        Write the manifest and mark the inputs processed so far as ready.
+
+        The flexprep database is queried once the manifest exists, so that an input processed
+        in between is either found by the query or marked by `mark_ready`.
+
+        Raises:
+            OSError: If the manifest could not be written.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        update_manifest(self.path, set(), self.key, self.inputs)
+
+        db_path = os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)
+        try:
+            with contextlib.closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+                processed = fetch_processed_labels(conn, set(self.inputs))
+        except sqlite3.Error as e:
+            logger.warning("Could not read the processed inputs of %s, relying on later updates: %s", self.key, e)
+            return
+        ready = update_manifest(self.path, processed)
+        logger.info("Input manifest of %s lists %d of %d inputs as ready.", self.key, ready, len(self.inputs))
+
+    def remove(self) -> None:
+        with _locked(self.path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f"{self.path}.lock")
+
+
+def inputs_processed(config: dict) -> bool:
+    """
+    Returns:
+        bool: True if flexprep processed all inputs of a Flexpart window, False as well if the
+            flexprep database could not be read.
+    """
+    inputs = set(window_input_forecasts(config, product_time_settings(config.get("PRODUCT"))))
+    db_path = os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)
+    try:
+        with contextlib.closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+            return inputs <= fetch_processed_labels(conn, inputs)
+    except sqlite3.Error as e:
+        logger.warning("Could not read the processed inputs of %s: %s", window_key(config), e)
+        return False
+
+
+def mark_ready(labels: set[str], settings: ManifestSettings | None = None) -> int:
+    """
+    Mark newly processed inputs as ready in the manifests of all running windows taking them as input.
+
+    Args:
+        labels (set[str]): Labels of the processed steps, see `step_label`.
+        settings (ManifestSettings | None): Manifest settings, defaults to the configured ones.
+
+    Returns:
+        int: Number of manifests updated.
+    """
+    directory = (settings or CONFIG.main.manifests).path
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(MANIFEST_SUFFIX)]
+    except FileNotFoundError:
+        # No window was ever started progressively
+        return 0
+
+    updated = 0
+    for name in names:
+        try:
+            marked = update_manifest(os.path.join(directory, name), labels)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not update the input manifest %s: %s", name, e)
+            continue
+        if marked:
+            logger.info(
+                "Marked %d input(s) as ready in the manifest of %s.", marked, name.removesuffix(MANIFEST_SUFFIX)
+            )
+            MANIFEST_UPDATES.inc(marked)
+            updated += 1
+    return updated
@@ -0,0 +1,159 @@
+import datetime
+import logging
+import sqlite3
+import time
+
+from flex_container_orchestrator.domain.lead_time_aggregator import generate_forecast_times, product_time_settings
+from flex_container_orchestrator.domain.percentile import percentile
+from flex_container_orchestrator.services.checkpoints import window_product
+
+logger = logging.getLogger(__name__)
+
+# Milestones of the dissemination-to-plot path, in order
+NOTIFIED = "notified"      # Aviso notification received for a step (keyed by input label)
+PROCESSED = "processed"    # Step pre-processed by flexprep (keyed by input label)
+PLANNED = "planned"        # Flexpart window emitted by the aggregator (keyed by window)
+SIMULATED = "simulated"    # Flexpart run finished (keyed by window)
+PLOTTED = "plotted"        # Pyflexplot products finished (keyed by window)
+
+# Stage latencies reported for each window, as (name, from milestone, to milestone)
+STAGE_SPANS = (
+    ("flexprep", NOTIFIED, PROCESSED),
+    ("wait", PROCESSED, PLANNED),
+    ("flexpart", PLANNED, SIMULATED),
+    ("pyflexplot", SIMULATED, PLOTTED),
+    ("end_to_end", NOTIFIED, PLOTTED),
+)
+PERCENTILES = (50, 95, 99)
+
+
+def step_label(date: str, time_: str, step: str | int) -> str:
+    """
+    Returns:
+        str: Input label of a notified step, in the format of `generate_forecast_label`.
+    """
+    return f"{date}{int(time_):02d}00{int(step):02}"
+
+
+class LatencyStore:
+    """
+    Compact time series of the milestones of each step and Flexpart window in the local store.
+
+    Only the first occurrence of a milestone is kept, so that redelivered notifications
+    and resumed runs do not hide the latency of the original attempt.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS latency_events (
+                    milestone TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    ts REAL NOT NULL,
+                    PRIMARY KEY (milestone, key)
+                ) WITHOUT ROWID
+            """
+            )
+
+    def record(self, milestone: str, key: str, ts: float | None = None) -> None:
+        """
+        Args:
+            milestone (str): One of the milestones defined in this module.
+            key (str): Input label for step milestones, window key for window milestones.
+            ts (float | None): Unix timestamp, defaults to now.
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO latency_events VALUES (?, ?, ?)",
+                (milestone, key, time.time() if ts is None else ts),
+            )
+
+    def count(self, milestone: str) -> int:
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM latency_events WHERE milestone = ?", (milestone,)
+        ).fetchone()
+        return count
+
+    def milestones(self, milestone: str) -> dict[str, float]:
+        return dict(
+            self.conn.execute("SELECT key, ts FROM latency_events WHERE milestone = ?", (milestone,)).fetchall()
+        )
+
+
+def window_latencies(store: LatencyStore) -> list[dict]:
+    """
+    Compute the stage latencies of every plotted Flexpart window.
+
+    The critical-path step of a window is the input label which became processed last;
+    all step-level spans of the window are measured for that label.
+
+    Returns:
+        list[dict]: One entry per window with its key, cycle and critical label, and the
+            latency in seconds of each span of STAGE_SPANS which could be computed.
+    """
+    notified = store.milestones(NOTIFIED)
+    processed = store.milestones(PROCESSED)
+    window_ts = {m: store.milestones(m) for m in (PLANNED, SIMULATED, PLOTTED)}
+
+    results = []
+    for window, plotted_at in sorted(window_ts[PLOTTED].items()):
+        start_time = datetime.datetime.strptime(window.rsplit("_", 1)[-1], "%Y%m%d%H%M")
+        windows, _, _ = generate_forecast_times([start_time], product_time_settings(window_product(window)))
+        if not windows:
+            continue
+        known = [label for label in windows[0] if label in processed]
+        if not known:
+            continue
+        critical = max(known, key=lambda label: processed[label])
+
+        timestamps = {
+            NOTIFIED: notified.get(critical),
+            PROCESSED: processed[critical],
+            PLANNED: window_ts[PLANNED].get(window),
+            SIMULATED: window_ts[SIMULATED].get(window),
+            PLOTTED: plotted_at,
+        }
+        spans = {
+            name: timestamps[end] - timestamps[begin]
+            for name, begin, end in STAGE_SPANS
+            if timestamps[begin] is not None and timestamps[end] is not None
+        }
+        results.append({"window": window, "cycle": critical[:10], "critical_label": critical, **spans})
+    return results
+
+
+def format_report(latencies: list[dict]) -> str:
+    """
+    Render p50/p95/p99 latencies per stage, the end-to-end latency per cycle,
+    and the critical-path step of each window.
+
+    Returns:
+        str: The formatted report, latencies in minutes.
+    """
+    if not latencies:
+        return "No plotted Flexpart windows recorded."
+
+    def row(name: str, values: list[float]) -> str:
+        cells = "".join(f"{percentile(values, q) / 60:>11.1f}" for q in PERCENTILES)
+        return f"{name:<14}{len(values):>6}{cells}"
+
+    header = f"{'':<14}{'n':>6}" + "".join(f"{f'p{q} [min]':>11}" for q in PERCENTILES)
+    lines = ["Latency per stage", header]
+    for name, _, _ in STAGE_SPANS:
+        values = [entry[name] for entry in latencies if name in entry]
+        if values:
+            lines.append(row(name, values))
+
+    lines += ["", "End-to-end latency per cycle", header]
+    for cycle in sorted({entry["cycle"] for entry in latencies}):
+        values = [entry["end_to_end"] for entry in latencies if entry["cycle"] == cycle and "end_to_end" in entry]
+        if values:
+            lines.append(row(cycle, values))
+
+    lines += ["", f"{'window':<20}{'critical step':>16}{'end-to-end [min]':>18}"]
+    for entry in latencies:
+        end_to_end = f"{entry['end_to_end'] / 60:.1f}" if "end_to_end" in entry else "-"
+        lines.append(f"{entry['window']:<20}{entry['critical_label']:>16}{end_to_end:>18}")
+    return "\n".join(lines)
@@ -0,0 +1,79 @@
+import contextlib
+import logging
+import os
+import sqlite3
+from typing import Iterator
+
+from flex_container_orchestrator import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Seconds a connection waits for a lock held by a concurrent orchestrator process
+BUSY_TIMEOUT = 30
+
+
+def local_store_path() -> str:
+    """
+    Returns:
+        str: Path of the orchestrator's own SQLite database.
+    """
+    return os.path.join(CONFIG.main.local_store.path, CONFIG.main.local_store.name)
+
+
+def connect_local_store(db_path: str | None = None) -> sqlite3.Connection:
+    """
+    Open the orchestrator's local SQLite store, shared by concurrent orchestrator processes.
+
+    The database is kept separate from the flexprep database so that orchestrator
+    bookkeeping never contends with the flexprep writers. WAL mode allows readers
+    to proceed while another process writes.
+
+    Args:
+        db_path (str | None): Path to the database, defaults to the configured local store.
+
+    Returns:
+        sqlite3.Connection: SQLite connection object.
+    """
+    db_path = db_path or local_store_path()
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextlib.contextmanager
+def immediate_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    Run the wrapped statements in a transaction holding the write lock from its start.
+
+    Read-then-write sequences in such a transaction are atomic across concurrent
+    orchestrator processes, unlike in the deferred transactions opened by `with conn`.
+    """
+    previous_isolation = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = previous_isolation
+
+
+def process_exists(pid: int) -> bool:
+    """
+    Returns:
+        bool: True if a process with the given id exists on this host, used to reclaim
+            resources recorded in the local store by orchestrator processes that died.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,302 @@
+"""
+Host-level cache of the pre-processed met files read by Flexpart.
+
+Consecutive Flexpart windows share most of their inputs, e.g. 84 of 90 hourly steps with
+tdelta=90 and tfreq_f=6. Instead of every Flexpart container downloading all of its inputs
+again, the orchestrator downloads each input step once into a local directory which is
+mounted read-only into the containers.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import MetCacheSettings
+from flex_container_orchestrator.services.local_store import (
+    connect_local_store, immediate_transaction, process_exists)
+from flex_container_orchestrator.services.metrics import REGISTRY
+from flex_container_orchestrator.services.s3 import s3_client
+
+logger = logging.getLogger(__name__)
+
+HIT = "hit"
+MISS = "miss"
+
+# Fills are serialized by a fixed set of lock files, which are never removed so that all
+# processes always lock the same inode
+LOCK_DIRECTORY = ".locks"
+LOCK_STRIPES = 64
+
+REQUESTS = REGISTRY.counter(
+    "orchestrator_met_cache_requests_total", "Lookups of input steps in the local met file cache.", ("result",)
+)
+EVICTIONS = REGISTRY.counter(
+    "orchestrator_met_cache_evictions_total", "Met files evicted from the local cache."
+)
+CACHE_BYTES = REGISTRY.gauge(
+    "orchestrator_met_cache_bytes", "Size of the local met file cache after the last eviction."
+)
+
+
+class MetCacheError(RuntimeError):
+    """Raised when a met file could not be fetched into the cache."""
+
+
+def met_file_key(label: str, key_template: str) -> str:
+    """
+    Args:
+        label (str): Forecast label in the format "{reference_time}{step}".
+        key_template (str): Object key template, see `MetCacheSettings.key_template`.
+
+    Returns:
+        str: Object key of the pre-processed met file of the label.
+    """
+    reference_time = datetime.datetime.strptime(label[:-2], "%Y%m%d%H%M")
+    step = int(label[-2:])
+    return key_template.format(
+        reference_time=reference_time, valid_time=reference_time + datetime.timedelta(hours=step), step=step
+    )
+
+
+class MetCache:
+    """
+    Least recently used cache of met files within a byte budget, indexed in the local store.
+
+    Files are pinned by the Flexpart runs using them and never evicted while pinned.
+    Concurrent fills of the same file, from threads or processes, are serialized by one of
+    `LOCK_STRIPES` lock files so that every file is downloaded once.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, settings: MetCacheSettings, s3: Any = None):
+        self.conn = conn
+        self.settings = settings
+        self._s3 = s3
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS met_cache (
+                    label TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                ) WITHOUT ROWID
+            """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS met_cache_lru ON met_cache (last_used)")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS met_cache_pins (
+                    label TEXT NOT NULL,
+                    holder TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    PRIMARY KEY (label, holder)
+                ) WITHOUT ROWID
+            """
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS met_cache_stats (result TEXT PRIMARY KEY, count INTEGER NOT NULL)"
+            )
+
+    @property
+    def s3(self) -> Any:
+        if self._s3 is None:
+            self._s3 = s3_client()
+        return self._s3
+
+    def fetch(self, labels: list[str], holder: str) -> int:
+        """
+        Pin the met files of the given labels and download those not cached yet.
+
+        The missing files are downloaded concurrently, by at most `fill_workers` threads
+        with their own local store connections.
+
+        Args:
+            labels (list[str]): Forecast labels of the input steps.
+            holder (str): Identifier of the run using the files, see `release`.
+
+        Returns:
+            int: Number of labels already cached.
+
+        Raises:
+            MetCacheError: If a file could not be downloaded.
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO met_cache_pins VALUES (?, ?, ?)",
+                [(label, holder, os.getpid()) for label in labels],
+            )
+        misses = [label for label in labels if not self._lookup(self.conn, label)]
+        if misses:
+            workers = min(self.settings.fill_workers, len(misses))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="met-cache") as pool:
+                filled = list(pool.map(self._fill_in_thread, misses))
+            # Files provided meanwhile by a concurrent fill count as hits
+            misses = [label for label, downloaded in zip(misses, filled) if downloaded]
+
+        hits = len(labels) - len(misses)
+        REQUESTS.inc(hits, result=HIT)
+        REQUESTS.inc(len(misses), result=MISS)
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO met_cache_stats VALUES (?, ?)
+                ON CONFLICT (result) DO UPDATE SET count = count + excluded.count
+            """,
+                [(HIT, hits), (MISS, len(misses))],
+            )
+        self.evict()
+        return hits
+
+    def stats(self) -> tuple[int, float | None]:
+        """
+        Returns:
+            tuple[int, float | None]: Size of the cache in bytes and the hit ratio of all
+                lookups by any orchestrator process, None if there were none.
+        """
+        (size,) = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM met_cache").fetchone()
+        counts = dict(self.conn.execute("SELECT result, count FROM met_cache_stats").fetchall())
+        lookups = counts.get(HIT, 0) + counts.get(MISS, 0)
+        return size, counts.get(HIT, 0) / lookups if lookups else None
+
+    def release(self, holder: str) -> None:
+        """Unpin the files of a run, allowing their eviction."""
+        with self.conn:
+            self.conn.execute("DELETE FROM met_cache_pins WHERE holder = ?", (holder,))
+
+    def evict(self) -> int:
+        """
+        Evict the least recently used unpinned files until the cache fits its byte budget.
+
+        Returns:
+            int: Size of the cache in bytes after eviction.
+        """
+        with immediate_transaction(self.conn):
+            stale = [
+                (holder,) for holder, pid in self.conn.execute("SELECT DISTINCT holder, pid FROM met_cache_pins")
+                if not process_exists(pid)
+            ]
+            self.conn.executemany("DELETE FROM met_cache_pins WHERE holder = ?", stale)
+
+            (total,) = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM met_cache").fetchone()
+            candidates = self.conn.execute(
+                """
+                SELECT label, path, size FROM met_cache
+                WHERE label NOT IN (SELECT label FROM met_cache_pins)
+                ORDER BY last_used
+            """
+            ).fetchall()
+            for label, path, size in candidates:
+                if total <= self.settings.max_bytes:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.settings.path, path))
+                self.conn.execute("DELETE FROM met_cache WHERE label = ?", (label,))
+                total -= size
+                EVICTIONS.inc()
+
+        CACHE_BYTES.set(total)
+        if total > self.settings.max_bytes:
+            logger.warning("Met files pinned by running Flexpart windows exceed the cache budget.")
+        return total
+
+    def _lookup(self, conn: sqlite3.Connection, label: str) -> bool:
+        row = conn.execute("SELECT path FROM met_cache WHERE label = ?", (label,)).fetchone()
+        if row is None or not os.path.exists(os.path.join(self.settings.path, row[0])):
+            return False
+        with conn:
+            conn.execute("UPDATE met_cache SET last_used = ? WHERE label = ?", (time.time(), label))
+        return True
+
+    def _fill_in_thread(self, label: str) -> bool:
+        # Connections cannot be shared between threads
+        with contextlib.closing(connect_local_store()) as conn:
+            return self._fill(conn, label)
+
+    def _fill(self, conn: sqlite3.Connection, label: str) -> bool:
+        """
+        Returns:
+            bool: True if the file was downloaded, False if a concurrent fill provided it meanwhile.
+        """
+        key = met_file_key(label, self.settings.key_template)
+        path = os.path.join(self.settings.path, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(self._lock_path(key), "a", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self._lookup(conn, label):
+                return False
+
+            bucket = CONFIG.main.s3.buckets.flexprep_output
+            partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            try:
+                self.s3.download_file(bucket, key, partial_path)
+                os.replace(partial_path, path)
+            except (BotoCoreError, ClientError, OSError) as e:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(partial_path)
+                raise MetCacheError(f"Could not download s3://{bucket}/{key}: {e}") from e
+
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO met_cache VALUES (?, ?, ?, ?)",
+                    (label, key, os.path.getsize(path), time.time()),
+                )
+        return True
+
+    def _lock_path(self, key: str) -> str:
+        directory = os.path.join(self.settings.path, LOCK_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{zlib.crc32(key.encode()) % LOCK_STRIPES:02}.lock")
+
+
+@contextlib.contextmanager
+def cached_met_files(labels: list[str], holder: str) -> Iterator[str | None]:
+    """
+    Provide the met files of a Flexpart run from the local cache while the run lasts.
+
+    Args:
+        labels (list[str]): Forecast labels of the run's input steps.
+        holder (str): Identifier of the run.
+
+    Yields:
+        str | None: Read-only volume of the cache for the Flexpart container, None if the cache is
+            disabled or could not be filled, in which case Flexpart downloads its inputs itself.
+    """
+    settings = CONFIG.main.met_cache
+    if not settings.enabled or not labels:
+        yield None
+        return
+
+    try:
+        cache = MetCache(connect_local_store(), settings)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Local store unavailable, Flexpart downloads its inputs itself: %s", e)
+        yield None
+        return
+
+    try:
+        try:
+            hits = cache.fetch(labels, holder)
+            logger.info("Met cache provided %d of %d input steps of %s.", hits, len(labels), holder)
+            volume: str | None = f"{os.path.abspath(settings.path)}:{settings.container_path}:ro"
+        except (MetCacheError, sqlite3.Error, OSError) as e:
+            logger.warning("Could not fill the met cache, Flexpart downloads its inputs itself: %s", e)
+            volume = None
+        yield volume
+    finally:
+        try:
+            cache.release(holder)
+        except sqlite3.Error as e:
+            logger.warning("Could not unpin the met files of %s: %s", holder, e)
+        cache.conn.close()
@@ -0,0 +1,293 @@
+"""
+In-process metrics and a stdlib-only HTTP endpoint serving them in the Prometheus text format.
+
+Recording a metric only updates a dictionary entry under a lock, so instrumenting the
+scheduling path has negligible overhead. Everything else happens when the endpoint is scraped.
+"""
+
+import abc
+import bisect
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.01, 0.1, 1, 10, 30, 60, 300, 600, 1800, 3600, 7200, 14400)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: dict[str, str] | None = None) -> str:
+        pairs = list(zip(self.labelnames, values)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = (
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    @abc.abstractmethod
+    def samples(self) -> list[str]:
+        """Returns the sample lines of the metric in the Prometheus text format."""
+
+    def render(self) -> str:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(header + self.samples())
+
+
+class _SingleValueMetric(_Metric):
+    """Metric with one value per label values, the common base of counters and gauges."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def _add(self, amount: float, labels: dict[str, str]) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{self._format_labels(key)} {value:g}" for key, value in sorted(values.items())]
+
+
+class Counter(_SingleValueMetric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Raises:
+            ValueError: If the amount is negative, counters only go up.
+        """
+        if amount < 0:
+            raise ValueError(f"Counter {self.name} cannot be decreased")
+        self._add(amount, labels)
+
+
+class Gauge(_SingleValueMetric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Callable[[], dict[LabelValues, float]] | None = None
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self._add(-amount, labels)
+
+    def set_function(self, function: Callable[[], dict[LabelValues, float]]) -> None:
+        """
+        Compute the gauge values when scraped instead of recording them.
+
+        Args:
+            function (Callable): Returns a mapping of label values to gauge values.
+        """
+        self._function = function
+
+    def samples(self) -> list[str]:
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Could not compute metric %s: %s", self.name, e)
+                values = {}
+            with self._lock:
+                self._values = dict(values)
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count per bucket (last one is +Inf), sum of observations
+        self._values: dict[LabelValues, tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: str) -> int:
+        counts, _ = self._values.get(self._key(labels)) or ([0], 0.0)
+        return sum(counts)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = self._register(Counter(name, documentation, labelnames))
+        assert isinstance(metric, Counter)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        metric = self._register(Gauge(name, documentation, labelnames))
+        assert isinstance(metric, Gauge)
+        return metric
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = self._register(Histogram(name, documentation, labelnames, buckets))
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+NOTIFICATIONS = REGISTRY.counter(
+    "orchestrator_notifications_received_total", "Dissemination notifications received."
+)
+DUPLICATES = REGISTRY.counter(
+    "orchestrator_duplicate_notifications_total", "Duplicate notifications suppressed."
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "orchestrator_stage_queue_depth", "Planned units of work waiting for a stage.", ("stage",)
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "orchestrator_containers_in_flight", "Containers currently running.", ("service",)
+)
+STAGE_DURATION = REGISTRY.histogram(
+    "orchestrator_stage_duration_seconds", "Duration of container stage attempts.", ("service", "outcome")
+)
+DB_QUERY_DURATION = REGISTRY.histogram(
+    "orchestrator_db_query_seconds", "Duration of flexprep database queries, including lock waits.",
+    ("query",), buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+ECR_TOKEN_AGE = REGISTRY.gauge(
+    "orchestrator_ecr_token_age_seconds", "Age of the ECR login of this process."
+)
+
+
+def observe_readiness_query(seconds: float) -> None:
+    """Record the duration of the readiness query of the aggregator, see `plan_ready_windows`."""
+    DB_QUERY_DURATION.observe(seconds, query="processed_forecasts")
+
+
+# Readiness checks by name, each returning True when the dependency is available
+ReadinessCheck = Callable[[], bool]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+    readiness_checks: dict[str, ReadinessCheck] = {}
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path == "/metrics":
+            self._respond(200, self.registry.render(), "text/plain; version=0.0.4")
+        elif self.path in ("/health", "/healthz"):
+            self._respond(200, "ok\n")
+        elif self.path in ("/ready", "/readyz"):
+            failed = [name for name, check in self.readiness_checks.items() if not _safe_check(check)]
+            if failed:
+                self._respond(503, f"not ready: {', '.join(failed)}\n")
+            else:
+                self._respond(200, "ready\n")
+        else:
+            self._respond(404, "not found\n")
+
+    def _respond(self, status: int, body: str, content_type: str = "text/plain") -> None:
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: object) -> None:  # pylint: disable=redefined-builtin
+        logger.debug("Metrics endpoint: " + format, *args)
+
+
+def _safe_check(check: ReadinessCheck) -> bool:
+    try:
+        return check()
+    except Exception:  # pylint: disable=broad-exception-caught
+        return False
+
+
+def start_metrics_server(
+    host: str, port: int, readiness_checks: dict[str, ReadinessCheck] | None = None,
+    registry: Registry = REGISTRY
+) -> ThreadingHTTPServer:
+    """
+    Serve /metrics, /healthz and /readyz from a daemon thread.
+
+    Args:
+        host (str): Interface to bind to.
+        port (int): Port to bind to, 0 to pick a free one.
+        readiness_checks (dict[str, ReadinessCheck] | None): Checks which must pass for /readyz.
+        registry (Registry): Metrics to serve.
+
+    Returns:
+        ThreadingHTTPServer: The running server, call `shutdown()` to stop it.
+    """
+    handler = type("MetricsHandler", (_Handler,), {
+        "registry": registry, "readiness_checks": readiness_checks or {}
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True)
+    thread.start()
+    logger.info("Serving metrics on http://%s:%d/metrics", *server.server_address[:2])
+    return server
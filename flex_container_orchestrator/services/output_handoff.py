@@ -0,0 +1,113 @@
+"""
+Local hand-off of the Flexpart output to Pyflexplot.
+
+Instead of Pyflexplot downloading the output Flexpart has just uploaded, Flexpart writes
+it to a scratch directory of the window which is mounted into the Pyflexplot containers.
+The orchestrator uploads the output to the Flexpart output bucket while Pyflexplot runs
+and removes the directory once both are done.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import HandoffSettings
+from flex_container_orchestrator.services.checkpoints import window_key
+from flex_container_orchestrator.services.metrics import REGISTRY
+from flex_container_orchestrator.services.pyflexplot_service import flexpart_output_key
+from flex_container_orchestrator.services.s3 import s3_client
+from flex_container_orchestrator.services.stage_runner import StageError
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DURATION = REGISTRY.histogram(
+    "orchestrator_handoff_upload_seconds", "Duration of the uploads of handed-off Flexpart output.", ("outcome",)
+)
+
+
+class OutputHandoff:
+    """
+    Scratch directory of the output of one Flexpart window and its asynchronous upload.
+
+    The directory is kept if the upload failed, so that a rerun of the window can upload
+    the output again without rerunning Flexpart.
+    """
+
+    def __init__(self, config: dict, settings: HandoffSettings, s3: Any = None):
+        self.settings = settings
+        self.directory = os.path.abspath(os.path.join(settings.path, window_key(config)))
+        key = flexpart_output_key(config)
+        self.prefix = os.path.dirname(key)
+        self.output = os.path.join(self.directory, os.path.basename(key))
+        self._s3 = s3
+        self._upload: threading.Thread | None = None
+        self._error: Exception | None = None
+
+    @property
+    def volume(self) -> str:
+        """Writable volume of the directory for the Flexpart container."""
+        return f"{self.directory}:{self.settings.container_path}"
+
+    def prepare(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+    def available(self) -> bool:
+        """
+        Returns:
+            bool: True if the concentration output of Flexpart is in the directory.
+        """
+        return os.path.isfile(self.output)
+
+    def start_upload(self) -> None:
+        """Upload all files of the directory to the Flexpart output bucket in a background thread."""
+        self._upload = threading.Thread(target=self._upload_files, name=f"upload-{os.path.basename(self.directory)}")
+        self._upload.start()
+
+    def finish(self) -> None:
+        """
+        Wait for the upload and remove the directory if it succeeded.
+
+        Raises:
+            StageError: If the upload failed.
+        """
+        if self._upload is not None:
+            self._upload.join()
+        if self._error is not None:
+            raise StageError(f"Could not upload the Flexpart output in {self.directory}: {self._error}")
+        self.discard()
+
+    def discard(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _upload_files(self) -> None:
+        bucket = CONFIG.main.s3.buckets.flexpart_output
+        start = time.monotonic()
+        try:
+            s3 = self._s3 if self._s3 is not None else s3_client()
+            for root, _, filenames in os.walk(self.directory):
+                for filename in sorted(filenames):
+                    path = os.path.join(root, filename)
+                    key = f"{self.prefix}/{os.path.relpath(path, self.directory)}"
+                    logger.info("Uploading %s to s3://%s/%s", path, bucket, key)
+                    s3.upload_file(path, bucket, key)
+        except (BotoCoreError, ClientError, OSError) as e:
+            logger.error("Upload of the Flexpart output in %s failed: %s", self.directory, e)
+            self._error = e
+            UPLOAD_DURATION.observe(time.monotonic() - start, outcome="failure")
+            return
+        UPLOAD_DURATION.observe(time.monotonic() - start, outcome="success")
+
+
+def output_handoff(config: dict) -> OutputHandoff | None:
+    """
+    Returns:
+        OutputHandoff | None: The hand-off of the window's output, None if disabled.
+    """
+    settings = CONFIG.main.handoff
+    return OutputHandoff(config, settings) if settings.enabled else None
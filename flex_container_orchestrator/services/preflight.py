@@ -0,0 +1,77 @@
+"""
+Preflight check of the flexprep stage.
+
+Redelivered notifications, replays and steps flexprep already handled through another
+trigger would otherwise pay a full flexprep container start and input download for
+nothing. A step marked as processed in the flexprep `uploaded` table, and optionally
+with its pre-processed met file in the flexprep output bucket, is not pre-processed again.
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+from typing import Any
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import PreflightSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import fetch_processed_labels
+from flex_container_orchestrator.services.met_cache import met_file_key
+from flex_container_orchestrator.services.s3 import s3_client
+
+logger = logging.getLogger(__name__)
+
+# Detail of the flexprep checkpoint of a step skipped by the preflight check, counted by the metrics endpoint
+ALREADY_PROCESSED = "already processed"
+
+
+def output_exists(label: str, s3: Any = None) -> bool:
+    """
+    Returns:
+        bool: True if the pre-processed met file of the label is in the flexprep output bucket.
+    """
+    bucket = CONFIG.main.s3.buckets.flexprep_output
+    key = met_file_key(label, CONFIG.main.met_cache.key_template)
+    try:
+        (s3 if s3 is not None else s3_client()).head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            logger.warning("Could not check for s3://%s/%s: %s", bucket, key, e)
+        return False
+    except BotoCoreError as e:
+        logger.warning("Could not check for s3://%s/%s: %s", bucket, key, e)
+        return False
+    return True
+
+
+def step_processed(label: str, settings: PreflightSettings | None = None, s3: Any = None) -> bool:
+    """
+    Check whether flexprep already processed a step.
+
+    Args:
+        label (str): Forecast label of the step, see `step_label`.
+        settings (PreflightSettings | None): Preflight settings, defaults to the configured ones.
+        s3 (Any): S3 client for the output check, created on demand.
+
+    Returns:
+        bool: True if flexprep can be skipped for the step. False if the check is disabled or
+            the flexprep database is unavailable, in which case flexprep runs as usual.
+    """
+    settings = settings or CONFIG.main.preflight
+    if not settings.enabled:
+        return False
+
+    db_path = os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)
+    try:
+        with contextlib.closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+            processed = label in fetch_processed_labels(conn, {label})
+    except sqlite3.Error as e:
+        logger.debug("Preflight check of %s skipped, flexprep database unavailable: %s", label, e)
+        return False
+
+    if processed and settings.check_output and not output_exists(label, s3):
+        logger.info("Step %s is marked as processed but its output is missing, running flexprep.", label)
+        return False
+    return processed
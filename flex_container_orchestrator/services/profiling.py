@@ -0,0 +1,169 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, ContextManager, Iterator
+
+from flex_container_orchestrator import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Environment variable enabling profiling for runs triggered by Aviso
+PROFILE_ENV = "FLEX_ORCHESTRATOR_PROFILE"
+# Number of allocation sites written to the tracemalloc report
+TOP_ALLOCATIONS = 25
+
+_NO_PROFILING: ContextManager[None] = contextlib.nullcontext()
+
+
+def profiling_requested(flag: bool = False) -> bool:
+    """
+    Returns:
+        bool: True if profiling was requested on the command line or through the environment.
+    """
+    return flag or os.getenv(PROFILE_ENV, "").lower() in ("1", "true", "yes")
+
+
+class Profiler:
+    """
+    Profiles the orchestrator process and measures wall versus CPU time per stage.
+
+    The CPU time of a stage is the time of the thread running it, so that stages of
+    concurrently running windows are told apart. The CPU time of the whole process and of
+    its finished child processes, i.e. the containers, is only recorded for the whole run,
+    it cannot be attributed to single stages.
+
+    Before Python 3.12, cProfile only covers the thread enabling it, so worker threads are
+    profiled separately, see `profile_thread`, and merged into the same statistics.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.stages: list[dict[str, Any]] = []
+        self._profile = cProfile.Profile()
+        self._thread_profiles: list[cProfile.Profile] = []
+        self._thread = threading.get_ident()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self._thread = threading.get_ident()
+        tracemalloc.start()
+        self._profile.enable()
+
+    def stop(self) -> None:
+        self._profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        statistics = pstats.Stats(self._profile)
+        with self._lock:
+            for profile in self._thread_profiles:
+                statistics.add(profile)
+        statistics.dump_stats(os.path.join(self.output_dir, "main.prof"))
+        with open(os.path.join(self.output_dir, "tracemalloc_top.txt"), "w", encoding="utf-8") as f:
+            for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                f.write(f"{statistic}\n")
+        with open(os.path.join(self.output_dir, "stages.json"), "w", encoding="utf-8") as f:
+            json.dump(self.stages, f, indent=2)
+        logger.info("Profiling results written to %s", self.output_dir)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            stage = {"stage": name, "wall": time.perf_counter() - wall, "cpu": time.thread_time() - cpu}
+            with self._lock:
+                self.stages.append(stage)
+
+    @contextlib.contextmanager
+    def run(self) -> Iterator[None]:
+        """Measure the whole run, including the process-wide CPU times."""
+        process, children = time.process_time(), _children_cpu_time()
+        with self.stage("main"):
+            yield
+        with self._lock:
+            self.stages[-1].update(
+                process_cpu=time.process_time() - process, process_children_cpu=_children_cpu_time() - children
+            )
+
+    @contextlib.contextmanager
+    def thread(self) -> Iterator[None]:
+        """Profile the wrapped code of a worker thread."""
+        if threading.get_ident() == self._thread:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # From Python 3.12 on, cProfile profiles all threads and only one profiler can be active
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._thread_profiles.append(profile)
+
+
+_ACTIVE: Profiler | None = None
+
+
+def _children_cpu_time() -> float:
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def profile_stage(name: str) -> ContextManager[None]:
+    """
+    Measure a stage if profiling is active, otherwise return a shared no-op context manager.
+    """
+    if _ACTIVE is None:
+        return _NO_PROFILING
+    return _ACTIVE.stage(name)
+
+
+def profile_thread() -> ContextManager[None]:
+    """
+    Profile the code of a worker thread if profiling is active, otherwise return a shared
+    no-op context manager.
+    """
+    if _ACTIVE is None:
+        return _NO_PROFILING
+    return _ACTIVE.thread()
+
+
+@contextlib.contextmanager
+def profiling(enabled: bool, run_name: str) -> Iterator[None]:
+    """
+    Profile the wrapped code into a per-run directory below the configured profiling path.
+
+    Args:
+        enabled (bool): Whether to profile at all.
+        run_name (str): Identifier of the run, used in the output directory name.
+    """
+    global _ACTIVE  # pylint: disable=global-statement
+    if not enabled:
+        yield
+        return
+
+    timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")
+    profiler = Profiler(os.path.join(CONFIG.main.profiling.path, f"{run_name}_{timestamp}"))
+    _ACTIVE = profiler
+    profiler.start()
+    try:
+        with profiler.run():
+            yield
+    finally:
+        _ACTIVE = None
+        profiler.stop()
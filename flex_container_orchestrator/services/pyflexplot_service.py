@@ -0,0 +1,160 @@
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.domain.lead_time_aggregator import DEFAULT_PRODUCT
+from flex_container_orchestrator.services.checkpoints import window_key
+from flex_container_orchestrator.services.s3 import s3_client
+from flex_container_orchestrator.services.stage_runner import (
+    StageError, compose_command, run_history_key, run_stage)
+
+logger = logging.getLogger(__name__)
+
+# Mount point of the local copy of the Flexpart output in parallel Pyflexplot containers
+CONTAINER_INPUT_DIR = "/scratch/input"
+
+
+def flexpart_output_key(config: dict) -> str:
+    """
+    Returns:
+        str: Object key of the Flexpart concentration output of a configuration. Products
+            other than the default product are kept below their own prefix, so that windows
+            of several products starting at the same time do not overwrite each other.
+    """
+    prefix = f"{config['IBDATE']}_{config['IBTIME']}/{config['RELEASE_SITE_NAME']}"
+    product = config.get("PRODUCT", DEFAULT_PRODUCT)
+    if product != DEFAULT_PRODUCT:
+        prefix = f"{prefix}/{product}"
+    return f"{prefix}/grid_conc_{config['IBDATE']}{config['IBTIME']}0000.nc"
+
+
+def pyflexplot_arguments(presets: list[str], infile: str, base_time: str) -> list[str]:
+    """
+    Build the Pyflexplot arguments rendering the given presets of one Flexpart output.
+
+    Args:
+        presets (list[str]): Pyflexplot presets, e.g. "opr/ifs-hres-eu/all_pdf".
+        infile (str): Flexpart NetCDF output, either an S3 URL or a path in the container.
+        base_time (str): Start of the Flexpart run in format YYYYMMDDHH.
+
+    Returns:
+        list[str]: The arguments.
+    """
+    arguments = []
+    for preset in presets:
+        arguments += ["--preset", preset]
+    return arguments + [
+        "--merge-pdfs",
+        f"--dest=s3://{CONFIG.main.s3.buckets.pyflexplot_output}",
+        "--setup", "infile", infile,
+        "--setup", "base_time", base_time,
+    ]
+
+
+def run_pyflexplot(config: dict, log_name: str, local_output: str | None = None) -> None:
+    """
+    Render all presets configured for the release site of a Flexpart configuration.
+
+    In "single" mode, one container renders all presets from the Flexpart output on S3.
+    In "parallel" mode, the output is downloaded once to a local scratch directory which
+    is mounted read-only into one container per preset. An output handed off locally by
+    Flexpart is mounted instead of being read from S3 in either mode.
+
+    Args:
+        config (dict): Flexpart configuration, see `define_config`.
+        log_name (str): Name of the per-run log file, relative to the container log directory.
+        local_output (str | None): Host path of the Flexpart output, see `OutputHandoff`.
+
+    Raises:
+        StageError: If the Flexpart output could not be fetched or a preset failed.
+    """
+    presets = CONFIG.main.pyflexplot.presets.get(config["RELEASE_SITE_NAME"], [])
+    if not presets:
+        logger.warning("No Pyflexplot presets configured for release site %s.", config["RELEASE_SITE_NAME"])
+        return
+
+    key = flexpart_output_key(config)
+    base_time = f"{config['IBDATE']}{config['IBTIME']}"
+    single = CONFIG.main.pyflexplot.mode == "single" or len(presets) == 1
+    history_key = run_history_key("pyflexplot", config)
+
+    if local_output is not None:
+        input_dir, filename = os.path.split(local_output)
+        if single:
+            infile = f"{CONTAINER_INPUT_DIR}/{filename}"
+            volume = f"{os.path.abspath(input_dir)}:{CONTAINER_INPUT_DIR}:ro"
+            command = compose_command(
+                "pyflexplot", *pyflexplot_arguments(presets, infile, base_time), volumes=(volume,)
+            )
+            run_stage("pyflexplot", command, log_name, history_key=history_key)
+        else:
+            run_parallel_presets(presets, filename, input_dir, base_time, log_name, history_key)
+        return
+
+    if single:
+        infile = f"s3://{CONFIG.main.s3.buckets.flexpart_output}/{key}"
+        command = compose_command("pyflexplot", *pyflexplot_arguments(presets, infile, base_time))
+        run_stage("pyflexplot", command, log_name, history_key=history_key)
+        return
+
+    scratch_dir = os.path.join(CONFIG.main.pyflexplot.scratch_path, window_key(config))
+    try:
+        download_flexpart_output(key, scratch_dir)
+        run_parallel_presets(presets, os.path.basename(key), scratch_dir, base_time, log_name, history_key)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def download_flexpart_output(key: str, scratch_dir: str) -> str:
+    """
+    Returns:
+        str: Local path of the downloaded Flexpart output.
+
+    Raises:
+        StageError: If the download failed.
+    """
+    os.makedirs(scratch_dir, exist_ok=True)
+    path = os.path.join(scratch_dir, os.path.basename(key))
+    bucket = CONFIG.main.s3.buckets.flexpart_output
+    logger.info("Downloading s3://%s/%s to %s", bucket, key, path)
+    try:
+        s3_client().download_file(bucket, key, path)
+    except (BotoCoreError, ClientError) as e:
+        raise StageError(f"Could not download Flexpart output s3://{bucket}/{key}: {e}") from e
+    return path
+
+
+def run_parallel_presets(
+    presets: list[str], filename: str, scratch_dir: str, base_time: str, log_name: str,
+    history_key: str | None = None
+) -> None:
+    """
+    Run one Pyflexplot container per preset, all reading the same local Flexpart output.
+
+    The runs are recorded under `history_key`, see `run_history_key`.
+
+    Raises:
+        StageError: If any of the presets failed, after all containers finished.
+    """
+    infile = f"{CONTAINER_INPUT_DIR}/{filename}"
+    volume = f"{os.path.abspath(scratch_dir)}:{CONTAINER_INPUT_DIR}:ro"
+
+    with ThreadPoolExecutor(max_workers=len(presets)) as pool:
+        futures = {
+            preset: pool.submit(
+                run_stage,
+                "pyflexplot",
+                compose_command("pyflexplot", *pyflexplot_arguments([preset], infile, base_time), volumes=(volume,)),
+                f"{log_name}_{preset.replace('/', '-')}",
+                history_key=history_key,
+            )
+            for preset in presets
+        }
+
+    failed = [preset for preset, future in futures.items() if future.exception() is not None]
+    if failed:
+        raise StageError(f"Pyflexplot failed for preset(s): {', '.join(failed)}")
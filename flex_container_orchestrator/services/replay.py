@@ -0,0 +1,251 @@
+"""
+Replay of an Aviso notification log against a test instance of the orchestrator.
+
+Every notification is fired as its own orchestrator process, as the Aviso `command`
+trigger does, at the pace it was received (optionally sped up) or as fast as possible.
+The containers and the ECR login are replaced by fake `docker` and `aws` executables,
+so that the replay measures the orchestrator itself: the fake flexprep marks its step
+as processed in the flexprep database of the instance, and all containers just sleep.
+"""
+
+import datetime
+import os
+import stat
+import subprocess
+import sys
+import time
+from typing import IO
+
+from pydantic import BaseModel
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.domain.notifications import Notification
+from flex_container_orchestrator.domain.percentile import percentile
+from flex_container_orchestrator.domain.simulator import arrivals_from_notifications
+
+PERCENTILES = (50, 95, 99)
+
+# Seconds between two samples of the running processes and containers
+SAMPLE_INTERVAL = 0.05
+
+FAKE_AWS = """#!/bin/sh
+# Fake aws executable of a replay, prints an ECR password
+echo replay-password
+"""
+
+FAKE_DOCKER = '''#!{python}
+"""Fake docker executable of a replay, containers sleep instead of running."""
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+args = sys.argv[1:]
+if args[:1] == ["login"]:
+    sys.stdin.read()
+    sys.exit(0)
+if args[:2] != ["compose", "run"]:
+    sys.exit(0)
+
+service, arguments, options = None, [], iter(args[2:])
+for arg in options:
+    if arg in ("--volume", "--env", "-v", "-e"):
+        next(options, None)
+    elif not arg.startswith("-"):
+        service, arguments = arg, list(options)
+        break
+
+marker = os.path.join(os.environ["REPLAY_CONTAINERS_DIR"], f"{{service}}-{{os.getpid()}}")
+open(marker, "w").close()
+try:
+    seconds = os.environ.get(f"REPLAY_{{str(service).upper()}}_SECONDS", os.environ["REPLAY_CONTAINER_SECONDS"])
+    time.sleep(float(seconds))
+    if service == "flexprep":
+        request = dict(zip(arguments[::2], arguments[1::2]))
+        reference_time = datetime.datetime.strptime(f"{{request['--date']}}{{int(request['--time']):02}}", "%Y%m%d%H")
+        conn = sqlite3.connect(os.environ["REPLAY_FLEXPREP_DB"], timeout=60)
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)"
+            )
+            conn.execute(
+                "INSERT INTO uploaded VALUES (?, ?, 1)", (reference_time.isoformat(" "), int(request["--step"]))
+            )
+        conn.close()
+finally:
+    os.remove(marker)
+'''
+
+# Settings redirected to the working directory of the replay, so that it never touches
+# the state of the production instance
+_INSTANCE_PATHS = {
+    "MAIN__DB__PATH": "flexprep-db",
+    "MAIN__LOCAL_STORE__PATH": "store",
+    "MAIN__CONTAINER_LOGS__PATH": "logs",
+    "MAIN__PYFLEXPLOT__SCRATCH_PATH": "scratch",
+    "MAIN__PROFILING__PATH": "profiles",
+    "MAIN__MET_CACHE__PATH": "met-cache",
+    "MAIN__HANDOFF__PATH": "handoff",
+    "MAIN__MANIFESTS__PATH": "manifests",
+}
+
+
+class ReplayResult(BaseModel):
+    events: int
+    failed: int
+    # Seconds from the first launch to the exit of the last orchestrator process
+    duration: float
+    # Seconds from the scheduled arrival of each event to the exit of its process
+    latencies: list[float]
+    peak_processes: int
+    peak_containers: int
+
+
+def parse_speed(value: str) -> float | None:
+    """
+    Args:
+        value (str): Replay speed, e.g. "1", "10x" or "max".
+
+    Returns:
+        float | None: Speed-up factor, None to fire the events as fast as possible.
+
+    Raises:
+        ValueError: If the speed is neither "max" nor a positive number.
+    """
+    if value.lower() == "max":
+        return None
+    speed = float(value.lower().removesuffix("x"))
+    if speed <= 0:
+        raise ValueError(f"Replay speed must be positive, got {value}")
+    return speed
+
+
+def replay_schedule(notifications: list[Notification], speed: float | None) -> list[tuple[float, Notification]]:
+    """
+    Returns:
+        list[tuple[float, Notification]]: Launch offsets in seconds and the notifications to fire.
+            At finite speed, notifications without receive time are dropped.
+    """
+    if speed is None:
+        return [(0.0, notification) for notification in notifications]
+    return [(offset / speed, notification) for offset, notification in arrivals_from_notifications(notifications)]
+
+
+def prepare_instance(workdir: str, container_seconds: float) -> dict[str, str]:
+    """
+    Install the fake executables and the state directories of a test instance.
+
+    Returns:
+        dict[str, str]: Environment of the orchestrator processes of the instance.
+    """
+    bin_dir = os.path.join(workdir, "bin")
+    containers_dir = os.path.join(workdir, "containers")
+    os.makedirs(bin_dir, exist_ok=True)
+    os.makedirs(containers_dir, exist_ok=True)
+    for name, content in (("docker", FAKE_DOCKER.format(python=sys.executable)), ("aws", FAKE_AWS)):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    environment = dict(os.environ)
+    for variable, directory in _INSTANCE_PATHS.items():
+        path = os.path.join(workdir, directory)
+        os.makedirs(path, exist_ok=True)
+        environment[variable] = path + os.sep
+
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment.update({
+        "PATH": f"{bin_dir}{os.pathsep}{environment.get('PATH', '')}",
+        "PYTHONPATH": os.pathsep.join(filter(None, (os.path.dirname(package_root), environment.get("PYTHONPATH")))),
+        "AWS_ACCOUNT_ID": environment.get("AWS_ACCOUNT_ID", "000000000000"),
+        "REPLAY_CONTAINERS_DIR": containers_dir,
+        "REPLAY_CONTAINER_SECONDS": str(container_seconds),
+        "REPLAY_FLEXPREP_DB": os.path.join(workdir, "flexprep-db", CONFIG.main.db.name),
+    })
+    return environment
+
+
+def replay(
+    notifications: list[Notification], speed: float | None, workdir: str, container_seconds: float = 1.0
+) -> ReplayResult:
+    """
+    Fire the notifications into orchestrator processes of a test instance in the working directory.
+
+    Args:
+        notifications (list[Notification]): Notifications to replay, see `parse_aviso_log`.
+        speed (float | None): Speed-up factor of the receive times, None for as fast as possible.
+        workdir (str): Directory of the test instance, created if needed.
+        container_seconds (float): Runtime of every fake container. REPLAY_<SERVICE>_SECONDS
+            environment variables override it per docker compose service.
+
+    Returns:
+        ReplayResult: Throughput, latencies and peak concurrency of the replay.
+    """
+    workdir = os.path.abspath(workdir)
+    environment = prepare_instance(workdir, container_seconds)
+    containers_dir = environment["REPLAY_CONTAINERS_DIR"]
+    schedule = replay_schedule(notifications, speed)
+
+    running: list[tuple[float, subprocess.Popen, IO]] = []
+    latencies: list[float] = []
+    failed = peak_processes = peak_containers = 0
+
+    def sample() -> None:
+        nonlocal failed, peak_processes, peak_containers
+        now = time.monotonic()
+        for entry in list(running):
+            arrival, process, log = entry
+            if process.poll() is not None:
+                running.remove(entry)
+                log.close()
+                latencies.append(now - arrival)
+                failed += process.returncode != 0
+        peak_processes = max(peak_processes, len(running))
+        peak_containers = max(peak_containers, len(os.listdir(containers_dir)))
+
+    start = time.monotonic()
+    for index, (offset, notification) in enumerate(schedule):
+        while time.monotonic() < start + offset:
+            sample()
+            time.sleep(min(SAMPLE_INTERVAL, max(0.0, start + offset - time.monotonic())))
+        log = open(os.path.join(workdir, "logs", f"replay_{index:06}.log"), "wb")  # pylint: disable=consider-using-with
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", "flex_container_orchestrator.main", *notification.arguments()],
+            cwd=workdir, env=environment, stdout=log, stderr=subprocess.STDOUT,
+        )
+        running.append((start + offset, process, log))
+        sample()
+
+    while running:
+        time.sleep(SAMPLE_INTERVAL)
+        sample()
+
+    return ReplayResult(
+        events=len(schedule),
+        failed=failed,
+        duration=time.monotonic() - start,
+        latencies=latencies,
+        peak_processes=peak_processes,
+        peak_containers=peak_containers,
+    )
+
+
+def format_replay(result: ReplayResult) -> str:
+    """
+    Returns:
+        str: Sustained throughput, latency percentiles and peak concurrency of a replay.
+    """
+    if not result.events:
+        return "No notifications to replay."
+    rate = result.events / result.duration if result.duration > 0 else float("inf")
+    lines = [
+        f"Replayed {result.events} events in {datetime.timedelta(seconds=round(result.duration))} "
+        f"({rate:.2f} events/s), {result.failed} failed",
+        "Latency [s]  " + "".join(f"{f'p{q}':>9}" for q in PERCENTILES),
+        " " * 13 + "".join(f"{percentile(result.latencies, q):>9.2f}" for q in PERCENTILES),
+        f"Peak orchestrator processes: {result.peak_processes}",
+        f"Peak containers: {result.peak_containers}",
+    ]
+    return "\n".join(lines)
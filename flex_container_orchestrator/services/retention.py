@@ -0,0 +1,196 @@
+"""
+Retention of the flexprep `uploaded` table.
+
+Flexprep adds a row for every step of every IFS run and never removes any, while the
+readiness queries only look at the last few reference times. Rows older than the
+retention are moved to an archive table, in the flexprep database or in an attached
+archive database, in small transactions so that flexprep writers only ever wait for
+one batch. The query planner statistics are refreshed and freed pages are returned
+to the file system if the database uses incremental auto-vacuum.
+"""
+
+import contextlib
+import datetime
+import logging
+import sqlite3
+import statistics
+import time
+
+from pydantic import BaseModel
+
+from flex_container_orchestrator.config.service_settings import RetentionSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import fetch_processed_forecasts
+from flex_container_orchestrator.services.local_store import BUSY_TIMEOUT, immediate_transaction
+from flex_container_orchestrator.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_TABLE = "uploaded_archive"
+READINESS_INDEX = "uploaded_forecast_ref_time_step"
+
+# Most recent reference times queried to measure the readiness query latency, about a day of IFS runs
+MEASURED_CYCLES = 4
+MEASURED_REPEATS = 5
+
+# auto_vacuum mode of databases returning freed pages with PRAGMA incremental_vacuum
+INCREMENTAL = 2
+
+ARCHIVED_ROWS = REGISTRY.counter(
+    "orchestrator_retention_archived_rows_total", "Rows moved from the flexprep uploaded table to the archive."
+)
+
+
+class MaintenanceReport(BaseModel):
+    archived: int
+    rows_before: int
+    rows_after: int
+    bytes_before: int
+    bytes_after: int
+    # Median duration of the readiness query of the most recent reference times
+    query_seconds_before: float
+    query_seconds_after: float
+    vacuumed: bool
+
+
+def table_rows(conn: sqlite3.Connection) -> int:
+    (rows,) = conn.execute("SELECT COUNT(*) FROM uploaded").fetchone()
+    return rows
+
+
+def database_bytes(conn: sqlite3.Connection) -> int:
+    """
+    Returns:
+        int: Size of the pages of the flexprep database in use, i.e. excluding free pages.
+    """
+    (page_count,) = conn.execute("PRAGMA page_count").fetchone()
+    (freelist_count,) = conn.execute("PRAGMA freelist_count").fetchone()
+    (page_size,) = conn.execute("PRAGMA page_size").fetchone()
+    return (page_count - freelist_count) * page_size
+
+
+def readiness_query_seconds(conn: sqlite3.Connection) -> float:
+    """
+    Returns:
+        float: Median duration of the readiness query of the aggregator over the most recent
+            reference times.
+
+    Raises:
+        sqlite3.Error: If the query failed, e.g. because the database stayed locked.
+    """
+    frt_s = {
+        datetime.datetime.fromisoformat(str(frt)) for (frt,) in conn.execute(
+            "SELECT DISTINCT forecast_ref_time FROM uploaded ORDER BY forecast_ref_time DESC LIMIT ?",
+            (MEASURED_CYCLES,),
+        )
+    }
+    durations = []
+    for _ in range(MEASURED_REPEATS):
+        start = time.perf_counter()
+        fetch_processed_forecasts(conn, frt_s)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def archive_rows(conn: sqlite3.Connection, cutoff: datetime.datetime, settings: RetentionSettings) -> int:
+    """
+    Move the rows of reference times before the cutoff to the archive table, batch by batch.
+
+    Returns:
+        int: Number of archived rows.
+    """
+    schema = "archive" if settings.archive_path else "main"
+    with conn:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{ARCHIVE_TABLE} AS SELECT * FROM main.uploaded WHERE 0")
+
+    archived = 0
+    while True:
+        with immediate_transaction(conn):
+            rowids = [
+                rowid for (rowid,) in conn.execute(
+                    "SELECT rowid FROM main.uploaded WHERE forecast_ref_time < ? LIMIT ?",
+                    (cutoff.isoformat(" "), settings.batch_size),
+                )
+            ]
+            if rowids:
+                placeholders = ", ".join("?" * len(rowids))
+                conn.execute(
+                    f"INSERT INTO {schema}.{ARCHIVE_TABLE} SELECT * FROM main.uploaded WHERE rowid IN ({placeholders})",
+                    rowids,
+                )
+                conn.execute(f"DELETE FROM main.uploaded WHERE rowid IN ({placeholders})", rowids)
+        archived += len(rowids)
+        ARCHIVED_ROWS.inc(len(rowids))
+        if len(rowids) < settings.batch_size:
+            return archived
+        time.sleep(settings.batch_pause)
+
+
+def maintain(db_path: str, settings: RetentionSettings) -> MaintenanceReport:
+    """
+    Archive the rows older than the retention, refresh the statistics and vacuum the freed pages.
+
+    The index supporting the readiness queries is created if flexprep did not create it.
+
+    Args:
+        db_path (str): Path of the flexprep database.
+        settings (RetentionSettings): Retention policy.
+
+    Returns:
+        MaintenanceReport: Size of the table and latency of the readiness query before and after.
+
+    Raises:
+        sqlite3.Error: If the database could not be read or updated, the maintenance is retried
+            by the next run.
+    """
+    with contextlib.closing(sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)) as conn:
+        if settings.archive_path:
+            conn.execute("ATTACH DATABASE ? AS archive", (settings.archive_path,))
+
+        rows_before, bytes_before = table_rows(conn), database_bytes(conn)
+        query_before = readiness_query_seconds(conn)
+
+        with conn:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {READINESS_INDEX} ON uploaded (forecast_ref_time, step)")
+        cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(
+            hours=settings.retention_hours
+        )
+        archived = archive_rows(conn, cutoff, settings)
+        conn.execute("ANALYZE main.uploaded")
+        conn.commit()
+
+        (auto_vacuum,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+        vacuumed = auto_vacuum == INCREMENTAL
+        if vacuumed:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        else:
+            logger.info(
+                "The flexprep database does not use incremental auto-vacuum, freed pages are reused but the "
+                "file does not shrink."
+            )
+
+        report = MaintenanceReport(
+            archived=archived,
+            rows_before=rows_before,
+            rows_after=table_rows(conn),
+            bytes_before=bytes_before,
+            bytes_after=database_bytes(conn),
+            query_seconds_before=query_before,
+            query_seconds_after=readiness_query_seconds(conn),
+            vacuumed=vacuumed,
+        )
+    logger.info("Archived %d rows of the flexprep uploaded table older than %s.", archived, cutoff)
+    return report
+
+
+def format_maintenance(report: MaintenanceReport) -> str:
+    """
+    Returns:
+        str: Table size and readiness query latency before and after a maintenance run.
+    """
+    return "\n".join([
+        f"Archived rows: {report.archived}" + ("" if report.vacuumed else " (no incremental vacuum)"),
+        f"{'':<20}{'before':>12}{'after':>12}",
+        f"{'rows':<20}{report.rows_before:>12}{report.rows_after:>12}",
+        f"{'size [MB]':<20}{report.bytes_before / 1e6:>12.2f}{report.bytes_after / 1e6:>12.2f}",
+        f"{'readiness [ms]':<20}{report.query_seconds_before * 1e3:>12.2f}{report.query_seconds_after * 1e3:>12.2f}",
+    ])
@@ -0,0 +1,39 @@
+import logging
+import os
+from typing import Any
+
+import boto3
+
+from flex_container_orchestrator import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def s3_client() -> Any:
+    """
+    Create an S3 client for the configured object store.
+
+    The credentials are the ones handed to the containers, i.e. the S3_ACCESS_KEY and
+    S3_SECRET_KEY environment variables (typically loaded from .env.secrets).
+
+    Returns:
+        botocore.client.S3: S3 client.
+    """
+    return boto3.client(
+        "s3",
+        endpoint_url=CONFIG.main.s3.endpoint_url,
+        aws_access_key_id=os.getenv("S3_ACCESS_KEY"),
+        aws_secret_access_key=os.getenv("S3_SECRET_KEY"),
+    )
+
+
+def split_s3_url(url: str) -> tuple[str, str]:
+    """
+    Args:
+        url (str): URL in the format s3://bucket/key.
+
+    Returns:
+        tuple[str, str]: Bucket name and object key (or key prefix).
+    """
+    bucket, _, key = url.removeprefix("s3://").partition("/")
+    return bucket, key
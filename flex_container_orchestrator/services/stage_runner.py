@@ -0,0 +1,258 @@
+import datetime
+import logging
+import sqlite3
+import statistics
+import subprocess
+import time
+from typing import Callable
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import StageSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import DEFAULT_PRODUCT
+from flex_container_orchestrator.services.concurrency import concurrency_slot
+from flex_container_orchestrator.services.container_output import CommandCancelled, stream_command
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.metrics import IN_FLIGHT, STAGE_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent successful runs used as historical reference for a service
+HISTORY_WINDOW = 50
+
+SUCCESS = "success"
+FAILED = "failed"
+TIMEOUT = "timeout"
+STRAGGLER = "straggler"
+CANCELLED = "cancelled"
+
+
+class StageError(RuntimeError):
+    """Raised when a stage did not succeed within its configured number of attempts."""
+
+
+class StageCancelled(StageError):
+    """Raised when a stage was stopped by its cancellation callback."""
+
+
+class RunHistory:
+    """
+    Records the outcome and duration of every stage attempt in the local store.
+
+    Runs are recorded under their history key, see `run_history_key`. The successful durations
+    of a history key are the reference for straggler detection, and the recorded timeouts
+    and retries make the tail latency of each stage visible.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        with self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stage_runs (
+                    service TEXT NOT NULL,
+                    run_key TEXT NOT NULL,
+                    attempt INTEGER NOT NULL,
+                    outcome TEXT NOT NULL,
+                    started_at TEXT NOT NULL,
+                    duration REAL NOT NULL
+                )
+            """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS stage_runs_service ON stage_runs (service, outcome, started_at)"
+            )
+
+    def record(
+        self, service: str, run_key: str, attempt: int, outcome: str,
+        started_at: datetime.datetime, duration: float
+    ) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO stage_runs VALUES (?, ?, ?, ?, ?, ?)",
+                (service, run_key, attempt, outcome, started_at.isoformat(), duration),
+            )
+
+    def durations(self, service: str, limit: int = HISTORY_WINDOW) -> list[float]:
+        """
+        Returns:
+            list[float]: Durations in seconds of the most recent successful runs of the service
+                or history key.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT duration FROM stage_runs
+            WHERE service = ? AND outcome = ?
+            ORDER BY started_at DESC LIMIT ?
+        """,
+            (service, SUCCESS, limit),
+        ).fetchall()
+        return [duration for (duration,) in rows]
+
+
+def run_history_key(service: str, config: dict | None = None) -> str:
+    """
+    Returns:
+        str: Key the runs of a service are recorded and compared under. Runs of products
+            other than the default product take another time and keep their own history.
+    """
+    product = (config or {}).get("PRODUCT", DEFAULT_PRODUCT)
+    return service if product == DEFAULT_PRODUCT else f"{service}:{product}"
+
+
+def straggler_threshold(durations: list[float], settings: StageSettings) -> float | None:
+    """
+    Compute the runtime above which an attempt is considered a straggler.
+
+    Args:
+        durations (list[float]): Historical durations of successful runs in seconds.
+        settings (StageSettings): Timeout and retry policy of the stage.
+
+    Returns:
+        float | None: Threshold in seconds, None if straggler detection is disabled
+            or not enough history is available yet.
+    """
+    if not settings.straggler_factor or len(durations) < settings.straggler_min_history:
+        return None
+    return settings.straggler_factor * statistics.median(durations)
+
+
+def backoff_delay(attempt: int, settings: StageSettings) -> float:
+    """
+    Returns:
+        float: Delay in seconds before the retry following the given (1-based) attempt.
+    """
+    return min(settings.backoff_max, settings.backoff_base * 2 ** (attempt - 1))
+
+
+def compose_command(
+    service: str, *args: str, volumes: tuple[str, ...] = (), environment: dict[str, str] | None = None
+) -> list[str]:
+    """
+    Build the docker compose command running a single container of a service.
+
+    Args:
+        service (str): Docker compose service name.
+        args (str): Arguments overriding the command of the service, if any.
+        volumes (tuple[str, ...]): Additional volumes in the format host_path:container_path[:mode].
+        environment (dict[str, str] | None): Container environment variables overriding those
+            of the service, so that concurrent runs do not depend on the shared .env file.
+
+    Returns:
+        list[str]: The command.
+    """
+    command = ["docker", "compose", "run", "--rm"]
+    for volume in volumes:
+        command += ["--volume", volume]
+    for name, value in (environment or {}).items():
+        command += ["--env", f"{name}={value}"]
+    return command + [service, *args]
+
+
+def run_stage(
+    service: str, command: list[str], log_name: str, cancel: Callable[[], bool] | None = None,
+    history_key: str | None = None
+) -> None:
+    """
+    Run a container stage with the timeout, straggler and retry policy configured for its service.
+
+    Every attempt is bounded by the smaller of the configured timeout and the straggler
+    threshold derived from the historical durations of the same kind of runs. Failed and timed out
+    attempts are retried with bounded exponential backoff. Each attempt waits for a slot
+    of the adaptive concurrency limit of the service, if one is configured.
+
+    Args:
+        service (str): Docker compose service name, used to look up the stage settings.
+        command (list[str]): Command to execute.
+        log_name (str): Name of the per-run log file, relative to the container log directory.
+        cancel (Callable[[], bool] | None): Polled while the stage runs, returns True to stop it.
+        history_key (str | None): History key the attempts are recorded and compared under, see
+            `run_history_key`, defaults to the service.
+
+    Raises:
+        StageCancelled: If the stage was cancelled, it is not retried.
+        StageError: If no attempt succeeded.
+    """
+    settings = CONFIG.main.stages.get(service, StageSettings())
+    key = history_key or service
+    history = _open_history()
+
+    durations = history.durations(key) if history else []
+    straggler_limit = straggler_threshold(durations, settings)
+    limits = [limit for limit in (settings.timeout, straggler_limit) if limit is not None]
+    deadline = min(limits) if limits else None
+
+    try:
+        _run_attempts(
+            service, key, command, log_name, settings, history, durations, deadline, straggler_limit, cancel
+        )
+    finally:
+        if history:
+            history.conn.close()
+
+
+# pylint: disable=too-many-arguments
+def _run_attempts(
+    service: str, key: str, command: list[str], log_name: str, settings: StageSettings,
+    history: RunHistory | None, durations: list[float], deadline: float | None, straggler_limit: float | None,
+    cancel: Callable[[], bool] | None
+) -> None:
+    for attempt in range(1, settings.max_attempts + 1):
+        with concurrency_slot(service, durations):
+            started_at = datetime.datetime.now(datetime.timezone.utc)
+            start = time.monotonic()
+            outcome = _run_attempt(service, command, log_name, deadline, straggler_limit, cancel)
+            duration = time.monotonic() - start
+        STAGE_DURATION.observe(duration, service=service, outcome=outcome)
+
+        if history:
+            try:
+                history.record(key, log_name, attempt, outcome, started_at, duration)
+            except sqlite3.Error as e:
+                logger.warning("Could not record run of %s: %s", service, e)
+
+        if outcome == SUCCESS:
+            if attempt > 1:
+                logger.info("%s succeeded on attempt %d after %.1fs.", service, attempt, duration)
+            return
+        if outcome == CANCELLED or (cancel is not None and cancel()):
+            raise StageCancelled(f"{service} was cancelled after {attempt} attempt(s).")
+
+        logger.warning(
+            "%s attempt %d/%d ended with outcome '%s' after %.1fs.",
+            service, attempt, settings.max_attempts, outcome, duration
+        )
+        if attempt < settings.max_attempts:
+            delay = backoff_delay(attempt, settings)
+            logger.info("Retrying %s in %.0fs.", service, delay)
+            time.sleep(delay)
+
+    raise StageError(f"{service} did not succeed within {settings.max_attempts} attempt(s).")
+
+
+def _run_attempt(
+    service: str, command: list[str], log_name: str, deadline: float | None, straggler_limit: float | None,
+    cancel: Callable[[], bool] | None
+) -> str:
+    IN_FLIGHT.inc(service=service)
+    try:
+        stream_command(command, log_name, timeout=deadline, cancel=cancel)
+        return SUCCESS
+    except CommandCancelled:
+        return CANCELLED
+    except subprocess.TimeoutExpired:
+        is_straggler = straggler_limit is not None and deadline == straggler_limit
+        return STRAGGLER if is_straggler else TIMEOUT
+    except subprocess.CalledProcessError as e:
+        logger.error("Last output lines of %s:\n%s", service, "\n".join(e.output or []))
+        return FAILED
+    finally:
+        IN_FLIGHT.dec(service=service)
+
+
+def _open_history() -> RunHistory | None:
+    # The run history is best effort, a broken local store must not block the pipeline
+    try:
+        return RunHistory(connect_local_store())
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Local store unavailable, running without run history: %s", e)
+        return None
@@ -0,0 +1,79 @@
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import SupersessionSettings, TimeSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import (
+    DEFAULT_PRODUCT, fetch_latest_processed_cycle, fetch_processed_labels, newer_forecast_labels,
+    product_time_settings, supersession_reason, window_input_forecasts)
+from flex_container_orchestrator.services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Phases in which a superseded Flexpart window is detected
+QUEUED = "queued"
+IN_FLIGHT = "in_flight"
+
+SUPERSEDED_RUNS = REGISTRY.counter(
+    "orchestrator_superseded_runs_total", "Flexpart windows dropped or stopped because of newer IFS inputs.",
+    ("phase",)
+)
+
+
+def supersession_settings(config: dict) -> SupersessionSettings | None:
+    """
+    Returns:
+        SupersessionSettings | None: The supersession policy of the configuration's product, None if disabled.
+    """
+    settings = CONFIG.main.supersession.get(config.get("PRODUCT", DEFAULT_PRODUCT))
+    return settings if settings is not None and settings.enabled else None
+
+
+class SupersessionCheck:
+    """
+    Checks against the flexprep database whether newer IFS runs made a Flexpart window obsolete.
+
+    Calling the check queries the database at most once per check interval, so that it can
+    be polled as cancellation callback while the Flexpart container runs.
+    """
+
+    def __init__(self, config: dict, settings: SupersessionSettings, time_settings: TimeSettings | None = None):
+        self.settings = settings
+        self.time_settings = time_settings or product_time_settings(config.get("PRODUCT"))
+        self.input_forecasts = window_input_forecasts(config, self.time_settings)
+        self.reason: str | None = None
+        self._last_check: float | None = None
+
+    def check(self) -> str | None:
+        """
+        Returns:
+            str | None: Why the window is superseded, None if it is current or the database is unavailable.
+        """
+        newer = {
+            label
+            for input_forecast in self.input_forecasts
+            for label in newer_forecast_labels(input_forecast, self.time_settings.tfreq)
+        }
+        db_path = os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)
+        try:
+            with contextlib.closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)) as conn:
+                processed = fetch_processed_labels(conn, newer)
+                latest_cycle = fetch_latest_processed_cycle(conn) if self.settings.max_lag_hours is not None else None
+        except sqlite3.Error as e:
+            logger.warning("Could not check for superseding IFS runs: %s", e)
+            return None
+
+        self.reason = supersession_reason(
+            self.input_forecasts, processed, latest_cycle, self.time_settings.tfreq, self.settings.max_lag_hours
+        )
+        return self.reason
+
+    def __call__(self) -> bool:
+        now = time.monotonic()
+        if self._last_check is None or now - self._last_check >= self.settings.check_interval:
+            self._last_check = now
+            self.check()
+        return self.reason is not None
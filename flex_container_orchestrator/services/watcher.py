@@ -0,0 +1,176 @@
+"""
+Planning of Flexpart windows driven by commits to the flexprep database.
+
+Without the watcher, windows are only planned when an Aviso notification triggers the
+orchestrator, so a step processed late or backfilled leaves its windows waiting for an
+unrelated notification. The watcher detects commits of other connections with
+`PRAGMA data_version`, which is a cheap read of the database header, and plans only the
+windows taking the newly processed steps as input. Checkpoint claims keep a window from
+being launched both by the watcher and by an orchestrator process started by Aviso.
+"""
+
+import contextlib
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.domain.lead_time_aggregator import (
+    plan_ready_windows, product_time_settings, window_input_forecasts)
+from flex_container_orchestrator.services.checkpoints import FLEXPART, PYFLEXPLOT, CheckpointStore, window_key
+from flex_container_orchestrator.services.flexpart_service import (
+    RELEASE_SITE, progressive_start_failed, run_window, window_workers)
+from flex_container_orchestrator.services.input_manifest import mark_ready
+from flex_container_orchestrator.services.latency import PLANNED, PROCESSED, LatencyStore, step_label
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.metrics import QUEUE_DEPTH, REGISTRY, observe_readiness_query
+from flex_container_orchestrator.services.retention import maintain
+
+logger = logging.getLogger(__name__)
+
+DETECTED_STEPS = REGISTRY.counter(
+    "orchestrator_watch_steps_total", "Processed steps detected by the flexprep database watcher."
+)
+
+
+class ProcessedStepWatcher:
+    """
+    Detects the steps newly marked as processed in the flexprep database.
+
+    The connection is kept open, `PRAGMA data_version` only changes for commits of other
+    connections since the previous call on the same connection.
+    """
+
+    def __init__(self, db_path: str, lookback_hours: float):
+        self.db_path = db_path
+        self.lookback = datetime.timedelta(hours=lookback_hours)
+        self.conn: sqlite3.Connection | None = None
+        self._data_version: int | None = None
+        self._seen: set[tuple[datetime.datetime, int]] = set()
+
+    def poll(self) -> list[tuple[datetime.datetime, int]]:
+        """
+        Returns:
+            list[tuple[datetime.datetime, int]]: Reference times and steps processed since the
+                previous poll, all those within the lookback on the first poll.
+        """
+        try:
+            if self.conn is None:
+                self.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            (data_version,) = self.conn.execute("PRAGMA data_version").fetchone()
+            if data_version == self._data_version:
+                return []
+
+            cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - self.lookback
+            rows = self.conn.execute(
+                "SELECT forecast_ref_time, step FROM uploaded WHERE processed AND forecast_ref_time >= ?",
+                (cutoff.isoformat(" "),),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Could not read the flexprep database, retrying: %s", e)
+            self.close()
+            return []
+
+        self._data_version = data_version
+        processed = {(datetime.datetime.fromisoformat(str(frt)), int(step)) for frt, step in rows}
+        # Rows falling out of the lookback are forgotten, keeping the memory bounded
+        new, self._seen = processed - self._seen, processed
+        return sorted(new)
+
+    def forget(self, steps: list[tuple[datetime.datetime, int]]) -> None:
+        """Report steps again on the next poll, e.g. because planning them failed."""
+        self._seen.difference_update(steps)
+        self._data_version = None
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+        self._data_version = None
+
+
+def window_cycle(config: dict) -> tuple[str, str]:
+    """
+    Returns:
+        tuple[str, str]: Date (YYYYMMDD) and time (HH) of the newest IFS run among the inputs
+            of a Flexpart window, which plays the role of the notified run.
+    """
+    newest = max(window_input_forecasts(config, product_time_settings(config.get("PRODUCT"))))
+    return newest[:8], newest[8:10]
+
+
+def watch(stop: threading.Event | None = None) -> None:
+    """
+    Plan and run the Flexpart windows made ready by steps processed in the flexprep database
+    until stopped. If retention is enabled, the flexprep database is maintained on start and
+    every retention interval.
+
+    Args:
+        stop (threading.Event | None): Ends the watch once set, windows already started are awaited.
+    """
+    stop = stop or threading.Event()
+    settings = CONFIG.main.watch
+    # Interpolated into the volumes of the compose services, usually from the .env file
+    # written by orchestrator processes started by Aviso
+    os.environ.setdefault("MAIN__DB_PATH", CONFIG.main.db.path)
+    db_path = os.path.join(CONFIG.main.db.path, CONFIG.main.db.name)
+    watcher = ProcessedStepWatcher(db_path, settings.lookback_hours)
+    running: dict[str, Future] = {}
+    next_maintenance = time.monotonic()
+
+    def report(key: str, future: Future) -> None:
+        if future.exception() is not None:
+            logger.error("Flexpart or Pyflexplot failed for window %s: %s", key, future.exception())
+
+    with contextlib.closing(connect_local_store()) as conn, \
+            ThreadPoolExecutor(max_workers=window_workers(), thread_name_prefix="window") as pool:
+        checkpoints = CheckpointStore(conn)
+        latencies = LatencyStore(conn)
+        logger.info("Watching %s for processed steps.", watcher.db_path)
+
+        while not stop.is_set():
+            retention = CONFIG.main.retention
+            if retention.enabled and time.monotonic() >= next_maintenance:
+                next_maintenance = time.monotonic() + retention.interval_hours * 3600
+                try:
+                    maintain(db_path, retention)
+                except sqlite3.Error as e:
+                    logger.warning("Maintenance of the flexprep database failed: %s", e)
+
+            steps = watcher.poll()
+            if steps and watcher.conn is not None:
+                DETECTED_STEPS.inc(len(steps))
+                labels = {step_label(frt.strftime("%Y%m%d"), f"{frt.hour:02}", step) for frt, step in steps}
+                for label in labels:
+                    latencies.record(PROCESSED, label)
+                mark_ready(labels)
+                try:
+                    configurations = plan_ready_windows(
+                        watcher.conn, steps, observe_readiness_query, partial(progressive_start_failed, checkpoints)
+                    )
+                except sqlite3.Error as e:
+                    logger.warning("Could not query the flexprep database, retrying the steps later: %s", e)
+                    watcher.forget(steps)
+                    configurations = []
+
+                for config in configurations:
+                    config["RELEASE_SITE_NAME"] = RELEASE_SITE
+                    key = window_key(config)
+                    if key in running or checkpoints.is_done(PYFLEXPLOT, key):
+                        continue
+                    logger.info("Launching Flexpart window %s.", key)
+                    latencies.record(PLANNED, key)
+                    QUEUE_DEPTH.inc(stage=FLEXPART)
+                    future = pool.submit(run_window, *window_cycle(config), config)
+                    future.add_done_callback(lambda f, key=key: report(key, f))
+                    running[key] = future
+
+            running = {key: future for key, future in running.items() if not future.done()}
+            stop.wait(settings.poll_interval)
+
+    watcher.close()
@@ -1 +1,12 @@
 import pytest
+
+from flex_container_orchestrator import CONFIG
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    """Point the orchestrator's local store and container logs to a temporary directory."""
+    monkeypatch.setattr(CONFIG.main.local_store, "path", str(tmp_path / "store"))
+    monkeypatch.setattr(CONFIG.main.container_logs, "path", str(tmp_path / "logs"))
+    monkeypatch.setattr(CONFIG.main.manifests, "path", str(tmp_path / "manifests"))
+    return tmp_path
@@ -1,11 +1,18 @@
 import datetime
+import sqlite3
 from unittest.mock import MagicMock, patch
 
 import pytest
 
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.domain import lead_time_aggregator
 from flex_container_orchestrator.domain.lead_time_aggregator import (
-    generate_forecast_label, define_config, fetch_processed_forecasts,
-    generate_flexpart_start_times)
+    generate_forecast_label, define_config, fetch_latest_processed_cycle, fetch_processed_forecasts,
+    fetch_processed_labels, generate_flexpart_start_times, generate_forecast_times,
+    newer_forecast_labels, plan_flexpart_windows, plan_ready_windows, ready_lead_hours, run_aggregator,
+    supersession_reason, window_input_forecasts)
+from flex_container_orchestrator.config.service_settings import ProductSettings, ProgressiveSettings, TimeSettings
+from flex_container_orchestrator.services.checkpoints import window_key
 
 
 @pytest.mark.parametrize(
@@ -59,12 +66,25 @@ def test_fetch_processed_forecasts(mock_connect):
     mock_conn = MagicMock()
     mock_cursor = MagicMock()
     mock_conn.cursor.return_value = mock_cursor
-    mock_cursor.fetchall.return_value = [(True, "12"), (False, "24")]
+    mock_cursor.fetchall.return_value = [("2023-10-22 06:00:00", True, "12"), ("2023-10-22 06:00:00", False, "24")]
     frt_s = {datetime.datetime(2023, 10, 22, 6, 0)}
     result = fetch_processed_forecasts(mock_conn, frt_s)
     assert result == {"20231022060012"}
 
 
+def test_failed_readiness_query_exits_only_the_aggregator(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    sqlite3.connect(tmp_path / CONFIG.main.db.name).close()
+    steps = [(datetime.datetime(2023, 10, 22, 6, 0), 5)]
+
+    # Without the uploaded table, planning raises for the watcher to retry later
+    with pytest.raises(sqlite3.Error):
+        plan_ready_windows(sqlite3.connect(tmp_path / CONFIG.main.db.name), steps)
+    with pytest.raises(SystemExit) as exit_info:
+        run_aggregator("20231022", "06", 5)
+    assert exit_info.value.code == 1
+
+
 def test_define_config():
     st = datetime.datetime(2023, 10, 22, 6, 0)
     et = datetime.datetime(2023, 10, 22, 18, 0)
@@ -78,3 +98,166 @@ def test_define_config():
         "RELEASE_SITE_NAME": "BEZ"
     }
     assert result == expected_config
+
+
+@pytest.mark.parametrize(
+    "time, cycle_horizons, expected",
+    [
+        # The 06 run reaches step 4, no fallback needed
+        (datetime.datetime(2023, 10, 22, 10, 0), {0: 90, 6: 4}, "20231022060004"),
+        # The 06 run stops at step 3, the 00 run covers the lead time instead
+        (datetime.datetime(2023, 10, 22, 10, 0), {0: 90, 6: 3}, "20231022000010"),
+        # No run covers the lead time
+        (datetime.datetime(2023, 10, 22, 10, 0), {0: 6, 6: 3, 12: 3, 18: 3}, None),
+    ],
+)
+def test_generate_forecast_label_cycle_horizons(time, cycle_horizons, expected):
+    assert generate_forecast_label(time, 6, cycle_horizons) == expected
+
+
+def test_generate_forecast_times_skips_unreachable_windows():
+    time_settings = TimeSettings(
+        tincr=1, tdelta=6, tfreq_f=6, tfreq=6, cycle_horizons={0: 6, 6: 6, 12: 2, 18: 6}
+    )
+    start_times = [datetime.datetime(2023, 10, 22, 6, 0), datetime.datetime(2023, 10, 22, 12, 0)]
+
+    input_forecasts, leadtimes, _ = generate_forecast_times(start_times, time_settings)
+
+    # 12 + 3h is neither covered by the 12 run (step 3 > 2) nor by the 06 run (step 9 > 6)
+    assert len(input_forecasts) == 1
+    assert leadtimes[0][0] == datetime.datetime(2023, 10, 22, 6, 0)
+
+
+def test_plan_flexpart_windows_keeps_windows_consuming_the_step():
+    time_settings = TimeSettings(tincr=1, tdelta=6, tfreq_f=6, tfreq=6)
+
+    input_forecasts, _, input_forecasts_set = plan_flexpart_windows(
+        datetime.datetime(2023, 10, 22, 6, 0), 6, time_settings
+    )
+    assert [forecasts[0] for forecasts in input_forecasts] == ["20231022060006"]
+    assert datetime.datetime(2023, 10, 22, 12, 0) in input_forecasts_set
+
+    # Step 9 of the 00 run is superseded by step 3 of the 06 run, no run needs it
+    assert plan_flexpart_windows(datetime.datetime(2023, 10, 22, 0, 0), 9, time_settings) == ([], [], set())
+
+    # Unless the 06 run does not reach that lead time
+    time_settings.cycle_horizons = {0: 90, 6: 2}
+    input_forecasts, _, _ = plan_flexpart_windows(datetime.datetime(2023, 10, 22, 0, 0), 9, time_settings)
+    assert input_forecasts == [[
+        "20231022000006", "20231022060001", "20231022060002", "20231022000009", "20231022000010", "20231022000011"
+    ]]
+
+
+def test_newer_forecast_labels():
+    assert newer_forecast_labels("20231022000010", 6) == ["20231022060004"]
+    assert newer_forecast_labels("20231022000014", 6) == ["20231022120002", "20231022060008"]
+    assert newer_forecast_labels("20231022060006", 6) == []
+
+
+def test_supersession_reason():
+    inputs = ["20231022000006", "20231022000007"]
+    latest = datetime.datetime(2023, 10, 22, 6, 0)
+
+    assert supersession_reason(inputs, set(), latest, 6) is None
+    assert supersession_reason(inputs, {"20231022060001"}, latest, 6) == (
+        "input 20231022000007 superseded by 20231022060001"
+    )
+    assert supersession_reason(inputs, set(), datetime.datetime(2023, 10, 23, 6, 0), 6, max_lag_hours=24) == (
+        "inputs lag IFS run 2023102306 by 30h"
+    )
+    assert supersession_reason(inputs, set(), latest, 6, max_lag_hours=24) is None
+
+
+def test_fetch_processed_labels_and_latest_cycle():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.executemany(
+        "INSERT INTO uploaded VALUES (?, ?, ?)",
+        [("2023-10-22 00:00:00", 6, True), ("2023-10-22 06:00:00", 1, True), ("2023-10-22 12:00:00", 1, False)],
+    )
+
+    labels = {"20231022000006", "20231022060001", "20231022060002", "20231022120001"}
+    assert fetch_processed_labels(conn, labels) == {"20231022000006", "20231022060001"}
+    assert fetch_processed_labels(conn, set()) == set()
+    assert fetch_latest_processed_cycle(conn) == datetime.datetime(2023, 10, 22, 6, 0)
+
+
+def test_run_aggregator_plans_all_products_with_one_query(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    monkeypatch.setattr(CONFIG.main, "products", [
+        ProductSettings(name="short-range", time_settings=TimeSettings(tincr=1, tdelta=6, tfreq_f=6, tfreq=6)),
+        ProductSettings(name="long-range", time_settings=TimeSettings(tincr=1, tdelta=12, tfreq_f=12, tfreq=6)),
+    ])
+    conn = sqlite3.connect(tmp_path / CONFIG.main.db.name)
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.executemany(
+        "INSERT INTO uploaded VALUES (?, ?, ?)",
+        [(f"2023-10-{day} {hour:02}:00:00", step, True) for day, hour in ((21, 18), (22, 0), (22, 6))
+         for step in range(1, 7)],
+    )
+    conn.commit()
+    conn.close()
+
+    queries = []
+    connect = lead_time_aggregator.connect_db
+
+    def traced_connect(db_path):
+        traced = connect(db_path)
+        traced.set_trace_callback(lambda statement: queries.append(statement) if "uploaded" in statement else None)
+        return traced
+
+    monkeypatch.setattr(lead_time_aggregator, "connect_db", traced_connect)
+
+    durations = []
+    configs = run_aggregator("20231022", "06", 5, durations.append)
+
+    assert len(queries) == 1
+    assert len(durations) == 1
+    assert {(c["PRODUCT"], c["FORECAST_DATETIME"], c["TDELTA"]) for c in configs} == {
+        ("short-range", "202310220600", "6"), ("long-range", "202310220000", "12")
+    }
+    assert len({window_key(c) for c in configs}) == 2
+
+
+def test_ready_lead_hours():
+    inputs = ["20231022000006", "20231022060001", "20231022060002", "20231022060003"]
+    assert ready_lead_hours(inputs, {"20231022000006", "20231022060001", "20231022060003"}, 1) == 2
+    assert ready_lead_hours(inputs, set(inputs), 3) == 12
+    assert ready_lead_hours(inputs, {"20231022060001"}, 1) == 0
+
+
+def test_plan_ready_windows_starts_progressive_windows(monkeypatch):
+    time_settings = TimeSettings(tincr=1, tdelta=6, tfreq_f=6, tfreq=6)
+    monkeypatch.setattr(CONFIG.main, "products", [ProductSettings(name="short-range", time_settings=time_settings)])
+    inputs = window_input_forecasts({"FORECAST_DATETIME": "202310220600"}, time_settings)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+
+    def process(label):
+        frt = datetime.datetime.strptime(label[:-2], "%Y%m%d%H%M")
+        conn.execute("INSERT INTO uploaded VALUES (?, ?, 1)", (frt.isoformat(" "), int(label[-2:])))
+        return frt, int(label[-2:])
+
+    monkeypatch.setattr(CONFIG.main, "progressive", {
+        "short-range": ProgressiveSettings(enabled=True, ready_hours=2, margin_hours=1)
+    })
+    steps = [process(label) for label in inputs[:2]]
+    assert plan_ready_windows(conn, steps[-1:]) == []
+
+    steps.append(process(inputs[2]))
+    (config,) = plan_ready_windows(conn, steps[-1:])
+    assert (config["FORECAST_DATETIME"], config["PROGRESSIVE"]) == ("202310220600", "1")
+
+    monkeypatch.setattr(CONFIG.main.progressive["short-range"], "enabled", False)
+    assert plan_ready_windows(conn, steps[-1:]) == []
+    monkeypatch.setattr(CONFIG.main.progressive["short-range"], "enabled", True)
+
+    # Excluded windows, e.g. after a failed progressive start, wait for all their inputs
+    excluded = []
+    assert plan_ready_windows(conn, steps[-1:], exclude_progressive=lambda c: excluded.append(c) or True) == []
+    assert [(c["PRODUCT"], c["FORECAST_DATETIME"]) for c in excluded] == [("short-range", "202310220600")]
+
+    # Once all inputs are processed, the window is planned as usual
+    steps += [process(label) for label in inputs[3:]]
+    (config,) = plan_ready_windows(conn, steps[-1:])
+    assert config["FORECAST_DATETIME"] == "202310220600" and "PROGRESSIVE" not in config
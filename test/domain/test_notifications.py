@@ -0,0 +1,22 @@
+import datetime
+
+from flex_container_orchestrator.domain.notifications import parse_aviso_log
+
+
+def test_parse_aviso_log():
+    lines = [
+        '2025-06-27 05:41:02.123 {"event": "dissemination", "request": {"class": "od", "date": "20250627", '
+        '"time": "0000", "step": "1", "stream": "oper"}, "location": "s3://flexpart-input/P1S06270000062701001"}\n',
+        "some unrelated line\n",
+        '{"event": "dissemination", "request": {"date": "20250627", "time": "6", "step": "12", '
+        '"location": "s3://flexpart-input/P1S"}}\n',
+    ]
+
+    first, second = parse_aviso_log(lines)
+
+    assert first.arguments() == [
+        "--step", "01", "--date", "20250627", "--time", "00",
+        "--location", "s3://flexpart-input/P1S06270000062701001",
+    ]
+    assert first.received_at == datetime.datetime(2025, 6, 27, 5, 41, 2, 123000)
+    assert (second.time, second.step, second.received_at) == ("06", "12", None)
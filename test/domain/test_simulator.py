@@ -0,0 +1,63 @@
+import datetime
+
+from flex_container_orchestrator.config.service_settings import TimeSettings
+from flex_container_orchestrator.domain.notifications import Notification
+from flex_container_orchestrator.domain.simulator import (
+    DurationDistribution, SimulationSettings, arrivals_from_notifications, simulate, synthetic_arrivals)
+
+TIME_SETTINGS = TimeSettings(tincr=1, tdelta=6, tfreq_f=6, tfreq=6)
+CYCLES = [datetime.datetime(2025, 1, 1, 0) + datetime.timedelta(hours=6 * i) for i in range(4)]
+
+
+def _settings(**kwargs):
+    durations = {
+        "flexprep": DurationDistribution(mean=60),
+        "flexpart": DurationDistribution(mean=600),
+        "pyflexplot": DurationDistribution(mean=120),
+    }
+    return SimulationSettings(time_settings=TIME_SETTINGS, durations=durations, **kwargs)
+
+
+def test_synthetic_arrivals():
+    arrivals = synthetic_arrivals(CYCLES[:2], last_step=2, first_delay=100, step_interval=10)
+    assert [at for at, _ in arrivals] == [100, 110, 120, 21700, 21710, 21720]
+    assert arrivals[-1][1].time == "06"
+    assert arrivals[-1][1].step == "02"
+
+
+def test_arrivals_from_notifications_with_equal_receive_times():
+    received_at = datetime.datetime(2025, 1, 1, 6, 0)
+    notifications = [
+        Notification(date="20250101", time="00", step=step, location="P1S", received_at=received_at)
+        for step in ("02", "01")
+    ] + [Notification(date="20250101", time="00", step="03", location="P1S")]
+
+    arrivals = arrivals_from_notifications(notifications)
+    assert [(at, n.step) for at, n in arrivals] == [(0.0, "02"), (0.0, "01")]
+
+
+def test_simulate_without_contention():
+    arrivals = synthetic_arrivals(CYCLES, last_step=6, first_delay=0, step_interval=60)
+    result = simulate(_settings(), arrivals)
+
+    # Each window needs the last step of the previous cycle, so the first cycle starts none
+    assert sorted(result.latencies) == ["202501010600", "202501011200", "202501011800"]
+    assert set(result.latencies.values()) == {60 + 600 + 120}
+    assert result.stages["flexprep"].jobs == 28
+    assert result.stages["flexpart"].max_queue_depth == 0
+
+
+def test_simulate_with_single_flexprep_worker_queues_steps():
+    arrivals = synthetic_arrivals(CYCLES, last_step=6, first_delay=0, step_interval=10)
+    result = simulate(_settings(workers={"flexprep": 1, "flexpart": 1, "pyflexplot": 1}), arrivals)
+
+    assert result.stages["flexprep"].max_queue_depth > 1
+    assert 0 < result.stages["flexprep"].utilisation <= 1
+    assert min(result.latencies.values()) > 60 + 600 + 120
+
+
+def test_lognormal_durations_are_reproducible():
+    arrivals = synthetic_arrivals(CYCLES, last_step=6, first_delay=0, step_interval=60)
+    settings = _settings(seed=3)
+    settings.durations["flexpart"] = DurationDistribution(kind="lognormal", mean=600, spread=0.5)
+    assert simulate(settings, arrivals) == simulate(settings, arrivals)
@@ -0,0 +1,61 @@
+import subprocess
+
+from flex_container_orchestrator.services.checkpoints import (
+    AGGREGATOR, DONE, FAILED, FLEXPART, FLEXPREP, RUNNING, CheckpointStore,
+    cycle_key, format_status, window_key, window_product)
+from flex_container_orchestrator.services.local_store import connect_local_store
+
+
+def test_checkpoint_store_roundtrip(local_store):
+    store = CheckpointStore(connect_local_store())
+    cycle = cycle_key("20250627", "6")
+    assert cycle == "2025062706"
+
+    store.mark(cycle, FLEXPREP, "2025062706_1_s3://loc", RUNNING)
+    assert not store.is_done(FLEXPREP, "2025062706_1_s3://loc")
+    store.mark(cycle, FLEXPREP, "2025062706_1_s3://loc", DONE)
+    assert store.is_done(FLEXPREP, "2025062706_1_s3://loc")
+
+    configs = [{"IBDATE": "20250627", "FORECAST_DATETIME": "202506270600"}]
+    store.mark(cycle, AGGREGATOR, "2025062706_1", DONE, detail=configs)
+    assert store.result(AGGREGATOR, "2025062706_1") == configs
+    assert store.result(AGGREGATOR, "2025062706_2") is None
+
+    store.mark(cycle, FLEXPART, "BEZ_202506270600", FAILED)
+    assert store.cycles() == {
+        "2025062706": {FLEXPREP: {DONE: 1}, AGGREGATOR: {DONE: 1}, FLEXPART: {FAILED: 1}}
+    }
+
+
+def test_format_status():
+    table = format_status({"2025062706": {FLEXPREP: {DONE: 2, RUNNING: 1}}})
+    assert "2025062706" in table
+    assert "done=2 running=1" in table
+    assert format_status({}) == "No checkpoints recorded."
+
+
+def test_window_key_includes_non_default_product():
+    config = {"RELEASE_SITE_NAME": "BEZ", "FORECAST_DATETIME": "202506270000"}
+    assert window_key(config) == "BEZ_202506270000"
+    assert window_key({**config, "PRODUCT": "default"}) == "BEZ_202506270000"
+    assert window_key({**config, "PRODUCT": "long-range"}) == "BEZ_long-range_202506270000"
+    assert window_product("BEZ_long-range_202506270000") == "long-range"
+    assert window_product("BEZ_202506270000") == "default"
+
+
+def test_claim_excludes_other_live_processes(local_store):
+    store = CheckpointStore(connect_local_store())
+
+    assert store.claim("2025062700", FLEXPART, "BEZ_202506270000")
+    # Running in this process, which is alive
+    assert not store.claim("2025062700", FLEXPART, "BEZ_202506270000")
+
+    with subprocess.Popen(["true"]) as process:
+        process.wait()
+    store.mark("2025062700", FLEXPART, "BEZ_202506270000", RUNNING, detail={"pid": process.pid})
+    assert store.claim("2025062700", FLEXPART, "BEZ_202506270000")
+
+    store.mark("2025062700", FLEXPART, "BEZ_202506270000", DONE)
+    assert not store.claim("2025062700", FLEXPART, "BEZ_202506270000")
+    store.mark("2025062700", FLEXPART, "BEZ_202506270000", FAILED)
+    assert store.claim("2025062700", FLEXPART, "BEZ_202506270000")
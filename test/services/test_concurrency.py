@@ -0,0 +1,138 @@
+import sqlite3
+import subprocess
+import threading
+
+import pytest
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import ConcurrencySettings
+from flex_container_orchestrator.services.concurrency import (
+    DURATION, INCREASE, LOAD, MEMORY, ConcurrencyLimiter, HostPressure,
+    concurrency_slot, duration_inflation, next_limit, read_host_pressure)
+from flex_container_orchestrator.services.local_store import connect_local_store
+
+SETTINGS = ConcurrencySettings(min_limit=1, max_limit=8, initial_limit=2, adjust_interval=0, poll_interval=0.01)
+IDLE_HOST = HostPressure(load_per_cpu=0.2, available_memory=0.8)
+
+
+def test_read_host_pressure(tmp_path, monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 4)
+    (tmp_path / "loadavg").write_text("6.00 4.00 2.00 3/512 4242\n")
+    (tmp_path / "meminfo").write_text("MemTotal:       1000 kB\nMemFree:  100 kB\nMemAvailable:    250 kB\n")
+    assert read_host_pressure(str(tmp_path)) == HostPressure(1.5, 0.25)
+    assert read_host_pressure(str(tmp_path / "missing")) is None
+
+
+def test_duration_inflation():
+    assert duration_inflation([30, 30, 30, 10, 10]) == 1.0
+    assert duration_inflation([30, 20, 40, 10, 10, 10]) == 3.0
+
+
+def test_next_limit_is_aimd():
+    assert next_limit(4, 4, IDLE_HOST, 1.0, SETTINGS) == (5, INCREASE)
+    assert next_limit(4, 2, IDLE_HOST, 1.0, SETTINGS) == (4, None)
+    assert next_limit(4, 4, HostPressure(2.0, 0.8), 1.0, SETTINGS) == (2, LOAD)
+    assert next_limit(4, 4, HostPressure(0.2, 0.05), 1.0, SETTINGS) == (2, MEMORY)
+    assert next_limit(4, 4, None, 2.0, SETTINGS) == (2, DURATION)
+    assert next_limit(8, 8, IDLE_HOST, 1.0, SETTINGS) == (8, None)
+    assert next_limit(1, 1, HostPressure(2.0, 0.8), 1.0, SETTINGS) == (1, None)
+
+
+def test_controller_tracks_capacity_of_synthetic_workload():
+    # A host with 4 CPUs, each Flexpart run keeps one CPU busy and slows down once they are
+    # oversubscribed. Demand never runs out, so every slot the controller grants is used.
+    cpus, base_duration = 4, 600.0
+    settings = SETTINGS.model_copy(update={"max_limit": 16, "max_load_per_cpu": 1.0})
+    limit, durations, limits = 1, [], []
+    for _ in range(200):
+        running = limit
+        durations.insert(0, base_duration * max(1.0, running / cpus))
+        pressure = HostPressure(load_per_cpu=running / cpus, available_memory=0.5)
+        limit, _ = next_limit(limit, running, pressure, duration_inflation(durations), settings)
+        limits.append(limit)
+
+    steady = limits[20:]
+    assert settings.min_limit <= min(steady) and max(steady) <= cpus + 1
+    # The additive increase probes back to the capacity after every decrease
+    assert steady.count(cpus) >= len(steady) // 5
+    assert sum(steady) / len(steady) >= cpus / 2
+
+
+def test_limiter_is_shared_across_connections(local_store):
+    first = ConcurrencyLimiter(connect_local_store())
+    second = ConcurrencyLimiter(connect_local_store())
+
+    assert first.try_acquire("flexpart", "a", SETTINGS)
+    assert second.try_acquire("flexpart", "b", SETTINGS)
+    assert not second.try_acquire("flexpart", "c", SETTINGS)
+
+    assert first.adjust("flexpart", SETTINGS, IDLE_HOST, 1.0) == (3, INCREASE)
+    assert second.try_acquire("flexpart", "c", SETTINGS)
+    assert first.state() == {"flexpart": (3, 3)}
+
+    first.release("flexpart", "a")
+    assert second.busy("flexpart") == 2
+
+
+def test_slots_of_terminated_processes_are_reclaimed(local_store):
+    limiter = ConcurrencyLimiter(connect_local_store())
+    with subprocess.Popen(["true"]) as process:
+        process.wait()
+    with limiter.conn:
+        limiter.conn.execute(
+            "INSERT INTO concurrency_slots VALUES (?, ?, ?, 0)", ("flexpart", "crashed", process.pid)
+        )
+        limiter.conn.execute(
+            "INSERT INTO concurrency_slots VALUES (?, ?, ?, 0)", ("flexpart", "crashed2", process.pid)
+        )
+
+    assert limiter.try_acquire("flexpart", "new", SETTINGS)
+    assert limiter.busy("flexpart") == 1
+
+
+def test_concurrency_slot_waits_for_a_free_slot(local_store, monkeypatch):
+    settings = SETTINGS.model_copy(update={"max_limit": 1, "initial_limit": 1})
+    monkeypatch.setitem(CONFIG.main.concurrency, "fake", settings)
+    events = []
+    first_running = threading.Event()
+    release_first = threading.Event()
+
+    def first():
+        with concurrency_slot("fake", []):
+            events.append("first started")
+            first_running.set()
+            release_first.wait(5)
+            events.append("first finished")
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    first_running.wait(5)
+    threading.Timer(0.1, release_first.set).start()
+    with concurrency_slot("fake", []):
+        events.append("second started")
+    thread.join()
+
+    assert events == ["first started", "first finished", "second started"]
+
+
+def test_concurrency_slot_runs_without_limit_if_the_store_is_busy(local_store, monkeypatch):
+    monkeypatch.setitem(CONFIG.main.concurrency, "fake", SETTINGS)
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    try_acquire = ConcurrencyLimiter.try_acquire
+    monkeypatch.setattr(ConcurrencyLimiter, "try_acquire", locked)
+    runs = []
+    with concurrency_slot("fake", []):
+        runs.append("acquire failed")
+
+    monkeypatch.setattr(ConcurrencyLimiter, "try_acquire", try_acquire)
+    monkeypatch.setattr(ConcurrencyLimiter, "release", locked)
+    with concurrency_slot("fake", []):
+        runs.append("release failed")
+    assert runs == ["acquire failed", "release failed"]
+
+    # Errors of the wrapped run are not swallowed
+    with pytest.raises(ValueError), concurrency_slot("fake", []):
+        raise ValueError("flexpart failed")
@@ -0,0 +1,43 @@
+import io
+import time
+
+import pytest
+
+from flex_container_orchestrator.services import container_output
+from flex_container_orchestrator.services.container_output import CommandCancelled, OutputCapture, stream_command
+
+
+def test_output_capture_keeps_bounded_tail(tmp_path):
+    log_path = tmp_path / "run.log"
+    capture = OutputCapture(str(log_path), max_bytes=0, backup_count=0, tail_lines=3)
+    capture.consume(io.BytesIO(b"".join(f"line {i}\n".encode() for i in range(1000))))
+
+    assert capture.line_count == 1000
+    assert capture.tail == ["line 997", "line 998", "line 999"]
+    assert len(log_path.read_text().splitlines()) == 1000
+
+
+def test_output_capture_rotates_log_file(tmp_path):
+    log_path = tmp_path / "run.log"
+    capture = OutputCapture(str(log_path), max_bytes=20, backup_count=2, tail_lines=10)
+    capture.consume(io.BytesIO(b"0123456789\n" * 5))
+
+    assert log_path.read_bytes() == b"0123456789\n"
+    assert (tmp_path / "run.log.1").read_bytes() == b"0123456789\n"
+    assert (tmp_path / "run.log.2").read_bytes() == b"0123456789\n"
+    assert not (tmp_path / "run.log.3").exists()
+
+
+def test_stream_command_cancel(local_store, monkeypatch):
+    monkeypatch.setattr(container_output, "CANCEL_POLL_INTERVAL", 0.05)
+    polls = []
+
+    def cancel():
+        polls.append(True)
+        return len(polls) >= 2
+
+    start = time.monotonic()
+    with pytest.raises(CommandCancelled) as excinfo:
+        stream_command(["sh", "-c", "echo started; exec sleep 10"], "cancelled_run", cancel=cancel)
+    assert time.monotonic() - start < 5
+    assert excinfo.value.output == ["started"]
@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from flex_container_orchestrator.services.deduplication import SeenEventStore, event_key
+from flex_container_orchestrator.services.local_store import connect_local_store
+
+KEY = event_key("20250627", "0", "1", "s3://flexpart-input/P1S06270000062701001")
+
+
+def test_event_key():
+    assert KEY == "2025062700_01_s3://flexpart-input/P1S06270000062701001"
+
+
+def test_duplicates_are_suppressed_until_expiry(local_store):
+    store = SeenEventStore(connect_local_store())
+
+    assert store.claim(KEY, ttl=3600, lease=600)
+    assert not store.claim(KEY, ttl=3600, lease=600)
+    store.complete(KEY)
+    assert not store.claim(KEY, ttl=3600, lease=0)
+    assert store.suppressed() == 2
+
+    assert store.claim(event_key("20250627", "0", "2", "loc"), ttl=-1, lease=600)
+    assert store.claim(event_key("20250627", "0", "2", "loc"), ttl=3600, lease=600)
+
+
+def test_released_and_stale_claims_can_be_taken_over(local_store):
+    store = SeenEventStore(connect_local_store())
+
+    assert store.claim(KEY, ttl=3600, lease=600)
+    store.release(KEY)
+    assert store.claim(KEY, ttl=3600, lease=600)
+    # The claim of a crashed run is taken over once its lease ran out
+    assert store.claim(KEY, ttl=3600, lease=0)
+
+
+def test_concurrent_claims_are_exclusive(local_store):
+    SeenEventStore(connect_local_store())
+
+    def claim(_):
+        return SeenEventStore(connect_local_store()).claim(KEY, ttl=3600, lease=600)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(claim, range(16)))
+
+    assert results.count(True) == 1
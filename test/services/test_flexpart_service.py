@@ -2,7 +2,10 @@ import logging
 
 import pytest
 
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.services import flexpart_service, flexprep_service, pyflexplot_service
 from flex_container_orchestrator.services.flexpart_service import run_command
+from flex_container_orchestrator.services.stage_runner import StageError
 
 
 # Mock logging
@@ -22,3 +25,86 @@ def test_run_command_failure():
     command = ["false"]  # This command will fail
     with pytest.raises(SystemExit):
         run_command(command)
+
+
+@pytest.fixture
+def container_log_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.container_logs, "path", str(tmp_path))
+    monkeypatch.setattr(CONFIG.main.container_logs, "tail_lines", 2)
+    return tmp_path
+
+
+def test_run_command_streams_to_log_file(container_log_dir):
+    command = ["sh", "-c", "echo first; echo second >&2"]
+    result = run_command(command, log_name="20250627_00/flexprep_01")
+    assert result is None
+    log_file = container_log_dir / "20250627_00" / "flexprep_01.log"
+    assert log_file.read_text() == "first\nsecond\n"
+
+
+def test_run_command_streamed_failure_reports_tail(container_log_dir, mock_logging):
+    command = ["sh", "-c", "for i in 1 2 3; do echo line$i; done; exit 3"]
+    with pytest.raises(SystemExit):
+        run_command(command, log_name="flexpart_202506270000")
+    assert "line2\nline3" in mock_logging.text
+    assert "line1" not in mock_logging.text
+
+
+def test_main_resumes_at_first_incomplete_stage(local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    config = {
+        "IBDATE": "20250627", "IBTIME": "00", "IEDATE": "20250627", "IETIME": "05",
+        "FORECAST_DATETIME": "202506270000", "RELEASE_SITE_NAME": "BEZ"
+    }
+    monkeypatch.setattr(
+        flexpart_service, "run_aggregator",
+        lambda date, time, step, observe_query=None, exclude_progressive=None: [config],
+    )
+
+    calls = []
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        calls.append(service)
+        if service == "pyflexplot" and calls.count("pyflexplot") == 1:
+            raise StageError("pyflexplot failed")
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(flexprep_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(pyflexplot_service, "run_stage", fake_run_stage)
+
+    with pytest.raises(SystemExit):
+        flexpart_service.main("20250627", "s3://flexpart-input/P1S", "00", "5")
+    assert calls == ["flexprep", "flexpart", "pyflexplot"]
+
+    flexpart_service.main("20250627", "s3://flexpart-input/P1S", "00", "5")
+    assert calls == ["flexprep", "flexpart", "pyflexplot", "pyflexplot"]
+
+
+def test_main_suppresses_duplicate_notifications(local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runs = []
+    monkeypatch.setattr(flexpart_service, "run_pipeline", lambda *args: runs.append(args[1:]))
+
+    flexpart_service.main("20250627", "s3://flexpart-input/P1S", "00", "5")
+    flexpart_service.main("20250627", "s3://flexpart-input/P1S", "0", "05")
+    flexpart_service.main("20250627", "s3://flexpart-input/P1S", "00", "5", force=True)
+
+    assert len(runs) == 2
+
+
+def test_main_passes_the_notified_step_to_flexprep(local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    monkeypatch.setattr(flexpart_service, "run_aggregator", lambda *args, **kwargs: [])
+    commands = {}
+    monkeypatch.setattr(
+        flexprep_service, "run_stage", lambda service, command, *args, **kwargs: commands.setdefault(service, command)
+    )
+
+    flexpart_service.main("20250627", "s3://flexpart-input/P1S", "00", "5")
+
+    # The step does not depend on the .env file shared with concurrent orchestrator processes
+    assert commands["flexprep"][-9:] == [
+        "flexprep", "--step", "5", "--date", "20250627", "--time", "00", "--location", "s3://flexpart-input/P1S"
+    ]
@@ -0,0 +1,175 @@
+import sqlite3
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import FlexprepShardSettings
+from flex_container_orchestrator.services import flexprep_service
+from flex_container_orchestrator.services.flexprep_service import (
+    list_input_objects, plan_shards, run_flexprep, shard_count, split_into_shards)
+from flex_container_orchestrator.services.stage_runner import StageError
+
+LOCATION = "s3://flexpart-input/P1S06270000062700011"
+
+
+class InMemoryS3Client:
+    """Stand-in of an S3 bucket, whose listing returns at most `page_size` objects per page."""
+
+    def __init__(self, objects, page_size=2, fail=False):
+        self.objects = dict(objects)
+        self.contents = {}
+        self.page_size = page_size
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def put(self, bucket, key, body):
+        with self.lock:
+            self.objects[(bucket, key)] = len(body)
+            self.contents[(bucket, key)] = body
+
+    def download_file(self, bucket, key, path):
+        if (bucket, key) not in self.contents:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "GetObject")
+        with open(path, "wb") as f:
+            f.write(self.contents[(bucket, key)])
+
+    def upload_file(self, path, bucket, key):
+        with open(path, "rb") as f:
+            self.put(bucket, key, f.read())
+
+    def delete_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        self.objects.pop((Bucket, Key), None)
+        self.contents.pop((Bucket, Key), None)
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):  # pylint: disable=invalid-name
+        if self.fail:
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Denied"}}, "ListObjectsV2")
+        keys = sorted(key for (bucket, key) in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + self.page_size]
+        response = {"Contents": [{"Key": key, "Size": self.objects[(Bucket, key)]} for key in page]}
+        if start + self.page_size < len(keys):
+            response.update(IsTruncated=True, NextContinuationToken=str(start + self.page_size))
+        return response
+
+
+OBJECTS = {
+    ("flexpart-input", "P1S06270000062700011"): 500,
+    ("flexpart-input", "P1S06270000062700011.ml"): 300,
+    ("flexpart-input", "P1S06270000062700011.pl"): 250,
+    ("flexpart-input", "P1S06270000062700011.sfc"): 150,
+    ("flexpart-input", "P1S06270000062700021"): 100,
+    ("flexpart-output", "P1S06270000062700011"): 100,
+}
+
+
+@pytest.fixture
+def flexprep_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    conn = sqlite3.connect(tmp_path / CONFIG.main.db.name)
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.commit()
+    conn.close()
+    return tmp_path / CONFIG.main.db.name
+
+
+def test_list_input_objects_follows_pages():
+    assert list_input_objects(LOCATION, InMemoryS3Client(OBJECTS)) == [
+        ("P1S06270000062700011", 500), ("P1S06270000062700011.ml", 300),
+        ("P1S06270000062700011.pl", 250), ("P1S06270000062700011.sfc", 150),
+    ]
+
+
+def test_shard_count():
+    settings = FlexprepShardSettings(enabled=True, shard_bytes=400, max_shards=3)
+    assert shard_count(1200, 4, settings) == 3
+    assert shard_count(1200, 2, settings) == 2
+    assert shard_count(500, 4, settings) == 2
+    assert shard_count(0, 0, settings) == 1
+
+
+def test_split_into_shards_balances_sizes():
+    objects = [("a", 500), ("b", 300), ("c", 250), ("d", 150), ("e", 100)]
+    assert split_into_shards(objects, 2) == [["a", "d"], ["b", "c", "e"]]
+    assert split_into_shards(objects[:1], 3) == [["a"]]
+
+
+def test_plan_shards_falls_back_to_a_single_container():
+    settings = FlexprepShardSettings(enabled=True, shard_bytes=400, max_shards=4)
+    assert len(plan_shards(LOCATION, settings, InMemoryS3Client(OBJECTS))) == 3
+    assert plan_shards(LOCATION, settings.model_copy(update={"enabled": False}), InMemoryS3Client(OBJECTS)) is None
+    assert plan_shards(LOCATION, settings.model_copy(update={"shard_bytes": 10_000}), InMemoryS3Client(OBJECTS)) is None
+    assert plan_shards(LOCATION, settings, InMemoryS3Client(OBJECTS, fail=True)) is None
+
+
+def _processed(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT forecast_ref_time, step, processed FROM uploaded").fetchall()
+    conn.close()
+    return rows
+
+
+def test_run_flexprep_marks_the_step_once_all_shards_succeeded(flexprep_db, monkeypatch):
+    monkeypatch.setattr(
+        CONFIG.main, "flexprep_shards", FlexprepShardSettings(enabled=True, shard_bytes=400, max_shards=4)
+    )
+    shards = {}
+    s3 = InMemoryS3Client(OBJECTS)
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        environment = dict(arg.split("=", 1) for arg in command if arg.startswith("FLEXPREP_"))
+        with s3.lock:
+            shards[environment["FLEXPREP_SHARD"]] = environment["FLEXPREP_INPUT_KEYS"].split(",")
+        assert command[-8:] == ["--step", "1", "--date", "20250627", "--time", "00", "--location", LOCATION]
+        assert log_name.startswith("flexprep_1_shard")
+        # Shard runs do not count as runs of whole steps
+        assert history_key == flexprep_service.SHARD_HISTORY_KEY
+        s3.put("flexprep-output", environment["FLEXPREP_OUTPUT_KEY"], environment["FLEXPREP_SHARD"].encode())
+
+    monkeypatch.setattr(flexprep_service, "run_stage", fake_run_stage)
+    run_flexprep("20250627", "00", "1", LOCATION, "flexprep_1", s3)
+
+    assert sorted(key for keys in shards.values() for key in keys) == sorted(
+        key for bucket, key in OBJECTS if bucket == "flexpart-input" and key.startswith("P1S06270000062700011")
+    )
+    assert set(shards) == {"0/3", "1/3", "2/3"}
+    # The parts are concatenated in shard order into the met file, and removed
+    assert s3.contents == {("flexprep-output", "202506270000/dispf2025062701"): b"0/31/32/3"}
+    assert _processed(flexprep_db) == [("2025-06-27 00:00:00", 1, 1)]
+
+
+def test_run_flexprep_leaves_the_step_unprocessed_if_a_shard_output_is_missing(flexprep_db, monkeypatch):
+    monkeypatch.setattr(
+        CONFIG.main, "flexprep_shards", FlexprepShardSettings(enabled=True, shard_bytes=400, max_shards=4)
+    )
+    s3 = InMemoryS3Client(OBJECTS)
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        environment = dict(arg.split("=", 1) for arg in command if arg.startswith("FLEXPREP_"))
+        if environment["FLEXPREP_SHARD"] != "1/3":
+            s3.put("flexprep-output", environment["FLEXPREP_OUTPUT_KEY"], b"grib")
+
+    monkeypatch.setattr(flexprep_service, "run_stage", fake_run_stage)
+    with pytest.raises(StageError, match="shard outputs"):
+        run_flexprep("20250627", "00", "1", LOCATION, "flexprep_1", s3)
+
+    assert ("flexprep-output", "202506270000/dispf2025062701") not in s3.contents
+    assert len(s3.contents) == 2
+    assert _processed(flexprep_db) == []
+
+
+def test_run_flexprep_leaves_the_step_unprocessed_if_a_shard_failed(flexprep_db, monkeypatch):
+    monkeypatch.setattr(
+        CONFIG.main, "flexprep_shards", FlexprepShardSettings(enabled=True, shard_bytes=400, max_shards=4)
+    )
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        if "FLEXPREP_SHARD=1/3" in command:
+            raise StageError("flexprep failed")
+
+    monkeypatch.setattr(flexprep_service, "run_stage", fake_run_stage)
+    with pytest.raises(StageError, match="shard"):
+        run_flexprep("20250627", "00", "1", LOCATION, "flexprep_1", InMemoryS3Client(OBJECTS))
+    assert _processed(flexprep_db) == []
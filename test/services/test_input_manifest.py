@@ -0,0 +1,175 @@
+import contextlib
+import datetime
+import functools
+import json
+import sqlite3
+
+import pytest
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import ManifestSettings, ProgressiveSettings, TimeSettings
+from flex_container_orchestrator.domain.lead_time_aggregator import plan_ready_windows
+from flex_container_orchestrator.services import flexpart_service, pyflexplot_service
+from flex_container_orchestrator.services.checkpoints import (
+    AGGREGATOR, DONE, FAILED, FLEXPART, FLEXPREP, CheckpointStore)
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.input_manifest import InputManifest, mark_ready
+from flex_container_orchestrator.services.stage_runner import StageError
+
+TIME_SETTINGS = TimeSettings(tincr=1, tdelta=6, tfreq_f=6, tfreq=6)
+CONFIG_0600 = {
+    "FORECAST_DATETIME": "202310220600", "IBDATE": "20231022", "IBTIME": "06", "IEDATE": "20231022",
+    "IETIME": "11", "RELEASE_SITE_NAME": "BEZ", "PROGRESSIVE": "1",
+}
+
+
+@pytest.fixture
+def flexprep_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    monkeypatch.setattr(CONFIG.main, "time_settings", TIME_SETTINGS)
+    conn = sqlite3.connect(tmp_path / CONFIG.main.db.name)
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.executemany(
+        "INSERT INTO uploaded VALUES (?, ?, 1)",
+        [("2023-10-22 00:00:00", 6), ("2023-10-22 06:00:00", 1), ("2023-10-22 06:00:00", 3)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _ready(manifest):
+    with open(manifest.path, encoding="utf-8") as f:
+        document = json.load(f)
+    return document["complete"], [entry["label"] for entry in document["inputs"] if entry["ready"]]
+
+
+def test_manifest_tracks_processed_inputs(flexprep_db, tmp_path):
+    settings = ManifestSettings(path=str(tmp_path / "manifests"))
+    manifest = InputManifest(CONFIG_0600, settings, TIME_SETTINGS)
+    manifest.create()
+    assert _ready(manifest) == (False, ["20231022000006", "20231022060001", "20231022060003"])
+    assert manifest.container_file == f"/scratch/manifests/{manifest.key}.json"
+
+    assert mark_ready({"20231022060002", "20231022120001"}, settings) == 1
+    assert mark_ready({"20231022060002"}, settings) == 0
+    assert mark_ready({"20231022060004", "20231022060005"}, settings) == 1
+    assert _ready(manifest) == (True, manifest.inputs)
+
+    manifest.remove()
+    assert mark_ready({"20231022060005"}, settings) == 0
+    assert list((tmp_path / "manifests").iterdir()) == []
+
+
+def test_mark_ready_without_progressive_windows(tmp_path):
+    assert mark_ready({"20231022060001"}, ManifestSettings(path=str(tmp_path / "missing"))) == 0
+
+
+def test_run_flexpart_passes_the_manifest(flexprep_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.manifests, "path", str(tmp_path / "manifests"))
+    commands = []
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        manifest = json.loads((tmp_path / "manifests" / "BEZ_202310220600.json").read_text())
+        commands.append((command, manifest["complete"]))
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    flexpart_service.run_flexpart(CONFIG_0600, "flexpart.log")
+
+    ((command, complete),) = commands
+    assert not complete
+    assert f"{tmp_path / 'manifests'}:/scratch/manifests:ro" in command
+    assert "INPUT_MANIFEST=/scratch/manifests/BEZ_202310220600.json" in command
+    # The manifest is removed with the window
+    assert not (tmp_path / "manifests" / "BEZ_202310220600.json").exists()
+
+    monkeypatch.setattr(CONFIG.main.manifests, "path", "/dev/null/manifests")
+    with pytest.raises(StageError):
+        flexpart_service.run_flexpart(CONFIG_0600, "flexpart.log")
+
+
+def test_failed_progressive_window_waits_for_all_inputs(flexprep_db, local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(CONFIG.main.manifests, "path", str(tmp_path / "manifests"))
+    monkeypatch.setattr(
+        CONFIG.main, "progressive", {"default": ProgressiveSettings(enabled=True, ready_hours=1, margin_hours=1)}
+    )
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    flexprep = sqlite3.connect(tmp_path / CONFIG.main.db.name)
+    checkpoints = CheckpointStore(connect_local_store())
+    exclude = functools.partial(flexpart_service.progressive_start_failed, checkpoints)
+    launched = []
+
+    def plan_and_run(step):
+        with flexprep:
+            flexprep.execute("INSERT INTO uploaded VALUES ('2023-10-22 06:00:00', ?, 1)", (step,))
+        for config in plan_ready_windows(flexprep, [(datetime.datetime(2023, 10, 22, 6), step)], None, exclude):
+            config["RELEASE_SITE_NAME"] = "BEZ"
+            launched.append(config.get("PROGRESSIVE"))
+            with contextlib.suppress(StageError):
+                flexpart_service.run_window("20231022", "06", config)
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        if service == "flexpart" and any(arg.startswith("INPUT_MANIFEST=") for arg in command):
+            raise StageError("flexpart caught up with its inputs")
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(pyflexplot_service, "run_stage", fake_run_stage)
+
+    # Steps 00/6 and 06/1 are processed, step 06/3 does not extend the ready prefix
+    plan_and_run(3)
+    assert launched == ["1"]
+    assert checkpoints.failure(FLEXPART, "BEZ_202310220600") == {"progressive": True}
+
+    # The next step would start the window progressively again
+    plan_and_run(2)
+    assert launched == ["1"]
+
+    plan_and_run(4)
+    plan_and_run(5)
+    assert launched == ["1", None]
+    assert checkpoints.is_done(FLEXPART, "BEZ_202310220600")
+
+
+def test_resumed_cycle_does_not_restart_a_failed_progressive_window(flexprep_db, local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(CONFIG.main.manifests, "path", str(tmp_path / "manifests"))
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    checkpoints = CheckpointStore(connect_local_store())
+    checkpoints.mark("2023102206", FLEXPREP, "2023102206_3_s3://flexpart-input/step3", DONE)
+    checkpoints.mark("2023102206", AGGREGATOR, "2023102206_3", DONE, detail=[CONFIG_0600])
+    checkpoints.mark("2023102206", FLEXPART, "BEZ_202310220600", FAILED, detail={"progressive": True})
+    runs = []
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        runs.append((service, history_key, any(arg.startswith("INPUT_MANIFEST=") for arg in command)))
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(pyflexplot_service, "run_stage", fake_run_stage)
+
+    def resume():
+        flexpart_service.run_pipeline(connect_local_store(), "20231022", "s3://flexpart-input/step3", "06", "3")
+
+    # Steps 06/2, 06/4 and 06/5 are missing, the window waits for them
+    resume()
+    assert not runs
+    assert checkpoints.failure(FLEXPART, "BEZ_202310220600") == {"progressive": True}
+
+    with contextlib.closing(sqlite3.connect(tmp_path / CONFIG.main.db.name)) as flexprep:
+        with flexprep:
+            flexprep.executemany("INSERT INTO uploaded VALUES ('2023-10-22 06:00:00', ?, 1)", [(2,), (4,), (5,)])
+    resume()
+    assert runs[0] == ("flexpart", "flexpart", False)
+    assert checkpoints.is_done(FLEXPART, "BEZ_202310220600")
+
+
+def test_progressive_runs_keep_their_own_history(flexprep_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.manifests, "path", str(tmp_path / "manifests"))
+    history_keys = []
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        history_keys.append(history_key)
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    flexpart_service.run_flexpart(CONFIG_0600, "flexpart.log")
+    flexpart_service.run_flexpart({**CONFIG_0600, "PROGRESSIVE": None}, "flexpart.log")
+    assert history_keys == ["flexpart:progressive", "flexpart"]
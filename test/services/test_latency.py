@@ -0,0 +1,46 @@
+import pytest
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.services.latency import (
+    NOTIFIED, PLANNED, PLOTTED, PROCESSED, SIMULATED, LatencyStore,
+    format_report, percentile, step_label, window_latencies)
+from flex_container_orchestrator.services.local_store import connect_local_store
+
+
+def test_step_label():
+    assert step_label("20250627", "6", "3") == "20250627060003"
+
+
+def test_percentile():
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([5], 99) == 5
+    assert percentile([0, 10], 95) == pytest.approx(9.5)
+
+
+def test_window_latencies_uses_critical_path_step(local_store, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.time_settings, "tdelta", 3)
+    monkeypatch.setattr(CONFIG.main.time_settings, "tincr", 1)
+    monkeypatch.setattr(CONFIG.main.time_settings, "tfreq", 6)
+    store = LatencyStore(connect_local_store())
+
+    # Window starting at 07 needs steps 1, 2 and 3 of the 06 cycle, step 3 arrives last
+    for step, notified_at in ((1, 0), (2, 60), (3, 120)):
+        label = step_label("20250627", "06", step)
+        store.record(NOTIFIED, label, notified_at)
+        store.record(PROCESSED, label, notified_at + 300)
+    store.record(NOTIFIED, step_label("20250627", "06", 3), 9999)  # redelivery is ignored
+    window = "BEZ_202506270700"
+    store.record(PLANNED, window, 430)
+    store.record(SIMULATED, window, 1000)
+    store.record(PLOTTED, window, 1320)
+
+    (entry,) = window_latencies(store)
+
+    assert entry["critical_label"] == "20250627060003"
+    assert entry["cycle"] == "2025062706"
+    assert entry["flexprep"] == 300
+    assert entry["wait"] == 10
+    assert entry["flexpart"] == 570
+    assert entry["pyflexplot"] == 320
+    assert entry["end_to_end"] == 1200
+    assert "20250627060003" in format_report([entry])
@@ -0,0 +1,113 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import MetCacheSettings
+from flex_container_orchestrator.services import met_cache
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.met_cache import (
+    LOCK_DIRECTORY, LOCK_STRIPES, MetCache, cached_met_files, met_file_key)
+
+LABELS = ["20250627000006", "20250627060001", "20250627060002"]
+
+
+class FakeS3Client:
+    def __init__(self, size=10, delay=0.0, fail=False):
+        self.size = size
+        self.delay = delay
+        self.fail = fail
+        self.downloads = []
+        self._lock = threading.Lock()
+
+    def download_file(self, bucket, key, path):
+        if self.fail:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "GetObject")
+        time.sleep(self.delay)
+        with self._lock:
+            self.downloads.append((bucket, key))
+        with open(path, "wb") as f:
+            f.write(b"x" * self.size)
+
+
+def _settings(tmp_path, **kwargs):
+    return MetCacheSettings(
+        enabled=True, path=str(tmp_path / "cache"), key_template="{reference_time:%Y%m%d%H%M}/{step:02}", **kwargs
+    )
+
+
+def test_met_file_key():
+    template = "{reference_time:%Y%m%d%H%M}/dispf{valid_time:%Y%m%d%H}_{step}"
+    assert met_file_key("20250627060003", template) == "202506270600/dispf2025062709_3"
+
+
+def test_each_file_is_downloaded_once(local_store, tmp_path):
+    settings = _settings(tmp_path)
+    s3 = FakeS3Client(delay=0.05)
+
+    def fetch(holder):
+        cache = MetCache(connect_local_store(), settings, s3)
+        hits = cache.fetch(LABELS, holder)
+        cache.release(holder)
+        return hits
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        hits = list(pool.map(fetch, ["a", "b", "c"]))
+
+    assert sorted(key for _, key in s3.downloads) == ["202506270000/06", "202506270600/01", "202506270600/02"]
+    assert sum(hits) == 2 * len(LABELS)
+    assert MetCache(connect_local_store(), settings).stats() == (30, 2 / 3)
+    assert (tmp_path / "cache" / "202506270600" / "01").read_bytes() == b"x" * 10
+
+
+def test_least_recently_used_unpinned_files_are_evicted(local_store, tmp_path):
+    cache = MetCache(connect_local_store(), _settings(tmp_path, max_bytes=25), FakeS3Client(size=10))
+
+    cache.fetch(LABELS[:2], "first")
+    cache.release("first")
+    cache.fetch(LABELS[:1], "second")
+    cache.release("second")
+    # LABELS[1] is the least recently used file and makes room for LABELS[2]
+    assert cache.fetch(LABELS[2:], "third") == 0
+    assert not (tmp_path / "cache" / "202506270600" / "01").exists()
+    # Lock files are shared by all entries and never removed
+    locks = list((tmp_path / "cache").rglob("*.lock"))
+    assert locks and all(path.parent == tmp_path / "cache" / LOCK_DIRECTORY for path in locks)
+    assert len(locks) <= LOCK_STRIPES
+    assert (tmp_path / "cache" / "202506270000" / "06").exists()
+
+    # Pinned files are kept even beyond the budget
+    assert cache.fetch(LABELS, "fourth") == 2
+    assert cache.evict() == 30
+    cache.release("fourth")
+    assert cache.evict() == 20
+
+
+def test_misses_are_filled_concurrently(local_store, tmp_path):
+    s3 = FakeS3Client(delay=0.2)
+    cache = MetCache(connect_local_store(), _settings(tmp_path, fill_workers=3), s3)
+
+    start = time.monotonic()
+    assert cache.fetch(LABELS, "window") == 0
+    assert time.monotonic() - start < 2 * s3.delay
+    assert len(s3.downloads) == len(LABELS)
+    assert all((tmp_path / "cache" / met_file_key(label, cache.settings.key_template)).exists() for label in LABELS)
+    assert cache.stats() == (30, 0.0)
+
+
+def test_cached_met_files_falls_back_without_cache(local_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main, "met_cache", _settings(tmp_path, container_path="/scratch/nwp"))
+    monkeypatch.setattr(met_cache, "s3_client", FakeS3Client)
+
+    with cached_met_files(LABELS, "window") as volume:
+        assert volume == f"{tmp_path / 'cache'}:/scratch/nwp:ro"
+
+    monkeypatch.setattr(met_cache, "s3_client", lambda: FakeS3Client(fail=True))
+    with cached_met_files(["20250628000001"], "window") as volume:
+        assert volume is None
+
+    monkeypatch.setattr(CONFIG.main.met_cache, "enabled", False)
+    with cached_met_files(LABELS, "window") as volume:
+        assert volume is None
@@ -0,0 +1,69 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from flex_container_orchestrator.services.metrics import Counter, Gauge, Registry, start_metrics_server
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def _get(server, path):
+    host, port = server.server_address[:2]
+    with urllib.request.urlopen(f"http://{host}:{port}{path}", timeout=5) as response:
+        return response.status, response.read().decode()
+
+
+def test_render_prometheus_format(registry):
+    counter = registry.counter("runs_total", "Runs.", ("service",))
+    counter.inc(service="flexpart")
+    counter.inc(2, service="flexpart")
+    histogram = registry.histogram("duration_seconds", "Durations.", buckets=(1, 10))
+    histogram.observe(0.5)
+    histogram.observe(5)
+    histogram.observe(50)
+    gauge = registry.gauge("age_seconds", "Age.")
+    gauge.set_function(lambda: {(): 42})
+
+    text = registry.render()
+
+    assert '# TYPE runs_total counter\nruns_total{service="flexpart"} 3' in text
+    assert 'duration_seconds_bucket{le="1"} 1' in text
+    assert 'duration_seconds_bucket{le="10"} 2' in text
+    assert 'duration_seconds_bucket{le="+Inf"} 3' in text
+    assert "duration_seconds_sum 55.5" in text
+    assert "age_seconds 42" in text
+
+
+def test_counters_and_gauges_are_distinct(registry):
+    counter = registry.counter("runs_total", "Runs.")
+    gauge = registry.gauge("queued", "Queued.")
+    gauge.inc(2)
+    gauge.dec(3)
+
+    assert gauge.value() == -1
+    assert not isinstance(gauge, Counter) and not isinstance(counter, Gauge)
+    with pytest.raises(ValueError):
+        counter.inc(-1)
+
+
+def test_endpoint_serves_health_readiness_and_metrics(registry):
+    registry.counter("notifications_total", "Notifications.").inc()
+    ready = {"db": True}
+    server = start_metrics_server("127.0.0.1", 0, {"db": lambda: ready["db"]}, registry=registry)
+    try:
+        assert _get(server, "/healthz") == (200, "ok\n")
+        assert _get(server, "/readyz") == (200, "ready\n")
+        status, body = _get(server, "/metrics")
+        assert status == 200
+        assert "notifications_total 1" in body
+
+        ready["db"] = False
+        with pytest.raises(urllib.error.HTTPError) as e:
+            _get(server, "/readyz")
+        assert e.value.code == 503
+    finally:
+        server.shutdown()
@@ -0,0 +1,147 @@
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import HandoffSettings
+from flex_container_orchestrator.services import flexpart_service, pyflexplot_service
+from flex_container_orchestrator.services.output_handoff import OutputHandoff
+from flex_container_orchestrator.services.stage_runner import StageError
+
+CONFIG_BEZ = {
+    "IBDATE": "20250627", "IBTIME": "00", "IEDATE": "20250627", "IETIME": "05",
+    "FORECAST_DATETIME": "202506270000", "RELEASE_SITE_NAME": "BEZ"
+}
+
+
+class FakeS3Client:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.uploads = []
+
+    def upload_file(self, path, bucket, key):
+        if self.fail:
+            raise ClientError({"Error": {"Code": "500", "Message": "Internal Error"}}, "PutObject")
+        self.uploads.append((bucket, key))
+
+
+def _write_output(handoff):
+    handoff.prepare()
+    for name in ("grid_conc_20250627000000.nc", "header"):
+        with open(os.path.join(handoff.directory, name), "w") as f:
+            f.write("flexpart")
+
+
+def test_output_is_uploaded_and_removed(tmp_path):
+    s3 = FakeS3Client()
+    handoff = OutputHandoff(CONFIG_BEZ, HandoffSettings(enabled=True, path=str(tmp_path)), s3)
+    assert handoff.volume == f"{tmp_path / 'BEZ_202506270000'}:/scratch/flexpart_output"
+    assert not handoff.available()
+
+    _write_output(handoff)
+    assert handoff.available()
+    handoff.start_upload()
+    handoff.finish()
+
+    assert sorted(s3.uploads) == [
+        ("flexpart-output", "20250627_00/BEZ/grid_conc_20250627000000.nc"),
+        ("flexpart-output", "20250627_00/BEZ/header"),
+    ]
+    assert not os.path.exists(handoff.directory)
+
+
+def test_output_is_kept_if_the_upload_failed(tmp_path):
+    handoff = OutputHandoff(CONFIG_BEZ, HandoffSettings(enabled=True, path=str(tmp_path)), FakeS3Client(fail=True))
+    _write_output(handoff)
+    handoff.start_upload()
+
+    with pytest.raises(StageError, match="Could not upload"):
+        handoff.finish()
+    assert handoff.available()
+
+
+def test_pyflexplot_reads_the_handed_off_output(local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    monkeypatch.setattr(CONFIG.main, "handoff", HandoffSettings(enabled=True, path=str(tmp_path / "handoff")))
+    monkeypatch.setattr(CONFIG.main.pyflexplot, "mode", "single")
+    s3 = FakeS3Client()
+    monkeypatch.setattr("flex_container_orchestrator.services.output_handoff.s3_client", lambda: s3)
+    output_dir = tmp_path / "handoff" / "BEZ_202506270000"
+    commands = {}
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        commands[service] = command
+        if service == "flexpart":
+            (output_dir / "grid_conc_20250627000000.nc").write_text("flexpart")
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(pyflexplot_service, "run_stage", fake_run_stage)
+
+    flexpart_service.run_window("20250627", "00", CONFIG_BEZ)
+
+    assert f"{output_dir}:/scratch/flexpart_output" in commands["flexpart"]
+    assert "FLEXPART_OUTPUT_DIR=/scratch/flexpart_output" in commands["flexpart"]
+    assert "/scratch/input/grid_conc_20250627000000.nc" in commands["pyflexplot"]
+    assert f"{output_dir}:/scratch/input:ro" in commands["pyflexplot"]
+    assert s3.uploads == [("flexpart-output", "20250627_00/BEZ/grid_conc_20250627000000.nc")]
+    assert not output_dir.exists()
+
+
+def test_pyflexplot_failure_is_not_masked_by_the_upload(local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    monkeypatch.setattr(CONFIG.main, "handoff", HandoffSettings(enabled=True, path=str(tmp_path / "handoff")))
+    monkeypatch.setattr(CONFIG.main.pyflexplot, "mode", "single")
+    monkeypatch.setattr(
+        "flex_container_orchestrator.services.output_handoff.s3_client", lambda: FakeS3Client(fail=True)
+    )
+    output_dir = tmp_path / "handoff" / "BEZ_202506270000"
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        if service == "flexpart":
+            (output_dir / "grid_conc_20250627000000.nc").write_text("flexpart")
+        else:
+            raise StageError("pyflexplot failed")
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(pyflexplot_service, "run_stage", fake_run_stage)
+
+    with pytest.raises(StageError, match="pyflexplot failed"):
+        flexpart_service.run_window("20250627", "00", CONFIG_BEZ)
+    # The output whose upload failed is kept
+    assert output_dir.exists()
+
+
+def test_products_starting_at_the_same_time_keep_their_own_output(local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    monkeypatch.setattr(CONFIG.main, "handoff", HandoffSettings(enabled=True, path=str(tmp_path / "handoff")))
+    monkeypatch.setattr(CONFIG.main.pyflexplot, "mode", "single")
+    s3 = FakeS3Client()
+    monkeypatch.setattr("flex_container_orchestrator.services.output_handoff.s3_client", lambda: s3)
+    flexpart_commands = []
+
+    def fake_run_stage(service, command, log_name, cancel=None, history_key=None):
+        if service == "flexpart":
+            flexpart_commands.append(command)
+            volume = next(arg for arg in command if arg.endswith(":/scratch/flexpart_output"))
+            with open(os.path.join(volume.split(":")[0], "grid_conc_20250627000000.nc"), "w") as f:
+                f.write("flexpart")
+
+    monkeypatch.setattr(flexpart_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(pyflexplot_service, "run_stage", fake_run_stage)
+
+    for product in ("default", "short"):
+        flexpart_service.run_window("20250627", "00", {**CONFIG_BEZ, "PRODUCT": product})
+
+    assert ["PRODUCT=default" in command for command in flexpart_commands] == [True, False]
+    assert ["PRODUCT=short" in command for command in flexpart_commands] == [False, True]
+    assert s3.uploads == [
+        ("flexpart-output", "20250627_00/BEZ/grid_conc_20250627000000.nc"),
+        ("flexpart-output", "20250627_00/BEZ/short/grid_conc_20250627000000.nc"),
+    ]
+    assert pyflexplot_service.flexpart_output_key({**CONFIG_BEZ, "PRODUCT": "short"}) == (
+        "20250627_00/BEZ/short/grid_conc_20250627000000.nc"
+    )
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+from botocore.exceptions import ClientError
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import PreflightSettings
+from flex_container_orchestrator.services import flexpart_service, flexprep_service, pyflexplot_service
+from flex_container_orchestrator.services.checkpoints import DONE, FLEXPREP, CheckpointStore
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.preflight import ALREADY_PROCESSED, step_processed
+
+
+class FakeS3Client:
+    def __init__(self, keys):
+        self.keys = keys
+        self.heads = []
+
+    def head_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        self.heads.append((Bucket, Key))
+        if Key not in self.keys:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {}
+
+
+@pytest.fixture
+def flexprep_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    monkeypatch.setattr(CONFIG.main.met_cache, "key_template", "{reference_time:%Y%m%d%H%M}/{step:02}")
+    conn = sqlite3.connect(tmp_path / CONFIG.main.db.name)
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.executemany(
+        "INSERT INTO uploaded VALUES (?, ?, ?)", [("2025-06-27 00:00:00", 5, True), ("2025-06-27 00:00:00", 6, False)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_step_processed(flexprep_db):
+    assert step_processed("20250627000005", PreflightSettings())
+    assert not step_processed("20250627000006", PreflightSettings())
+    assert not step_processed("20250627060001", PreflightSettings())
+    assert not step_processed("20250627000005", PreflightSettings(enabled=False))
+
+    s3 = FakeS3Client({"202506270000/05"})
+    assert step_processed("20250627000005", PreflightSettings(check_output=True), s3)
+    assert s3.heads == [("flexprep-output", "202506270000/05")]
+    assert not step_processed("20250627000005", PreflightSettings(check_output=True), FakeS3Client(set()))
+
+
+def test_step_processed_without_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path / "missing"))
+    assert not step_processed("20250627000005", PreflightSettings())
+
+
+def test_main_skips_flexprep_for_processed_steps(flexprep_db, local_store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(flexpart_service, "ensure_ecr_login", lambda: None)
+    monkeypatch.setattr(
+        flexpart_service, "run_aggregator",
+        lambda date, time, step, observe_query=None, exclude_progressive=None: [],
+    )
+    calls = []
+    monkeypatch.setattr(flexprep_service, "run_stage", lambda service, *args, **kwargs: calls.append(service))
+    monkeypatch.setattr(pyflexplot_service, "run_stage", lambda service, *args, **kwargs: calls.append(service))
+    flexpart_service.main("20250627", "s3://flexpart-input/P1S", "00", "5")
+    flexpart_service.main("20250627", "s3://flexpart-input/P1S", "00", "6")
+
+    assert calls == ["flexprep"]
+    checkpoints = CheckpointStore(connect_local_store())
+    assert checkpoints.is_done(FLEXPREP, "2025062700_5_s3://flexpart-input/P1S")
+    # The skips are counted across orchestrator processes from the local store
+    assert checkpoints.count(FLEXPREP, DONE) == 2
+    assert checkpoints.count(FLEXPREP, DONE, ALREADY_PROCESSED) == 1
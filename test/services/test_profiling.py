@@ -0,0 +1,65 @@
+import json
+import pstats
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.services import profiling
+
+
+def test_profile_stage_is_noop_when_disabled():
+    with profiling.profiling(False, "run"):
+        assert profiling.profile_stage("flexprep") is profiling.profile_stage("aggregator")
+
+
+def test_profiling_writes_per_run_results(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.profiling, "path", str(tmp_path))
+
+    with profiling.profiling(True, "20250627_00_01"):
+        with profiling.profile_stage("aggregator"):
+            sum(range(1000))
+
+    (run_dir,) = tmp_path.iterdir()
+    assert run_dir.name.startswith("20250627_00_01_")
+    assert (run_dir / "main.prof").stat().st_size > 0
+    assert (run_dir / "tracemalloc_top.txt").exists()
+    stages = json.loads((run_dir / "stages.json").read_text())
+    assert [stage["stage"] for stage in stages] == ["aggregator", "main"]
+    assert set(stages[0]) == {"stage", "wall", "cpu"}
+    # Process-wide CPU times are only recorded for the whole run
+    assert set(stages[1]) == {"stage", "wall", "cpu", "process_cpu", "process_children_cpu"}
+    assert profiling.profile_stage("aggregator") is profiling.profile_stage("flexpart")
+
+
+def window_work():
+    return sum(i * i for i in range(10000))
+
+
+def test_profiling_covers_worker_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.profiling, "path", str(tmp_path))
+
+    def run_window():
+        with profiling.profile_thread(), profiling.profile_stage("flexpart:BEZ_202506270000"):
+            window_work()
+
+    with profiling.profiling(True, "20250627_00_01"):
+        profiler = profiling._ACTIVE
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(lambda _: run_window(), range(2)))
+
+    # From Python 3.12 on, the profile of the main thread already covers the worker threads
+    assert len(profiler._thread_profiles) == (0 if sys.version_info >= (3, 12) else 2)
+
+    (run_dir,) = tmp_path.iterdir()
+    functions = {function for _, _, function in pstats.Stats(str(run_dir / "main.prof")).stats}
+    assert "window_work" in functions
+    stages = json.loads((run_dir / "stages.json").read_text())
+    assert [stage["stage"] for stage in stages] == ["flexpart:BEZ_202506270000"] * 2 + ["main"]
+
+
+def test_profiling_requested_from_environment(monkeypatch):
+    monkeypatch.delenv(profiling.PROFILE_ENV, raising=False)
+    assert not profiling.profiling_requested()
+    assert profiling.profiling_requested(True)
+    monkeypatch.setenv(profiling.PROFILE_ENV, "1")
+    assert profiling.profiling_requested()
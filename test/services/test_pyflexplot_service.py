@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.services import pyflexplot_service
+from flex_container_orchestrator.services.stage_runner import StageError
+
+CONFIG_BEZ = {
+    "IBDATE": "20250627", "IBTIME": "06", "IEDATE": "20250627", "IETIME": "11",
+    "FORECAST_DATETIME": "202506270600", "RELEASE_SITE_NAME": "BEZ"
+}
+PRESETS = ["opr/ifs-hres-eu/all_pdf", "opr/ifs-hres-eu/all_png"]
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.downloads = []
+
+    def download_file(self, bucket, key, path):
+        self.downloads.append((bucket, key))
+        with open(path, "w") as f:
+            f.write("netcdf")
+
+
+@pytest.fixture
+def commands(monkeypatch, tmp_path):
+    calls = []
+
+    def fake_run_stage(service, command, log_name, history_key=None):
+        calls.append((command, log_name))
+        if "fail" in " ".join(command):
+            raise StageError("failed")
+
+    monkeypatch.setattr(pyflexplot_service, "run_stage", fake_run_stage)
+    monkeypatch.setattr(CONFIG.main.pyflexplot, "scratch_path", str(tmp_path / "scratch"))
+    monkeypatch.setitem(CONFIG.main.pyflexplot.presets, "BEZ", PRESETS)
+    return calls
+
+
+def test_single_mode_renders_all_presets_in_one_container(commands, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.pyflexplot, "mode", "single")
+
+    pyflexplot_service.run_pyflexplot(CONFIG_BEZ, "pyflexplot")
+
+    ((command, _),) = commands
+    assert command[:5] == ["docker", "compose", "run", "--rm", "pyflexplot"]
+    assert command.count("--preset") == 2
+    assert "s3://flexpart-output/20250627_06/BEZ/grid_conc_20250627060000.nc" in command
+
+
+def test_parallel_mode_shares_one_local_copy(commands, monkeypatch, tmp_path):
+    monkeypatch.setattr(CONFIG.main.pyflexplot, "mode", "parallel")
+    s3 = FakeS3Client()
+    monkeypatch.setattr(pyflexplot_service, "s3_client", lambda: s3)
+
+    pyflexplot_service.run_pyflexplot(CONFIG_BEZ, "pyflexplot")
+
+    assert s3.downloads == [("flexpart-output", "20250627_06/BEZ/grid_conc_20250627060000.nc")]
+    assert len(commands) == 2
+    for command, _ in commands:
+        assert command.count("--preset") == 1
+        assert "/scratch/input/grid_conc_20250627060000.nc" in command
+        assert any(arg.endswith("/scratch/BEZ_202506270600:/scratch/input:ro") for arg in command)
+    assert sorted(log_name for _, log_name in commands) == [
+        "pyflexplot_opr-ifs-hres-eu-all_pdf", "pyflexplot_opr-ifs-hres-eu-all_png"
+    ]
+    assert not os.path.exists(tmp_path / "scratch" / "BEZ_202506270600")
+
+
+def test_parallel_mode_reports_failed_presets(commands, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.pyflexplot, "mode", "parallel")
+    monkeypatch.setitem(CONFIG.main.pyflexplot.presets, "BEZ", ["ok/preset", "fail/preset"])
+    monkeypatch.setattr(pyflexplot_service, "s3_client", FakeS3Client)
+
+    with pytest.raises(StageError, match="fail/preset"):
+        pyflexplot_service.run_pyflexplot(CONFIG_BEZ, "pyflexplot")
+    assert len(commands) == 2
@@ -0,0 +1,56 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from flex_container_orchestrator.domain.notifications import Notification
+from flex_container_orchestrator.services.replay import (
+    ReplayResult, format_replay, parse_speed, replay, replay_schedule)
+
+RECEIVED = datetime.datetime(2025, 6, 27, 5, 40)
+NOTIFICATIONS = [
+    Notification(
+        date="20250627", time="00", step=f"{step:02}", location=f"s3://flexpart-input/P1S{step}",
+        received_at=RECEIVED + datetime.timedelta(seconds=10 * step),
+    )
+    for step in range(3)
+]
+
+
+def test_parse_speed():
+    assert parse_speed("1") == 1.0
+    assert parse_speed("10x") == 10.0
+    assert parse_speed("max") is None
+    with pytest.raises(ValueError):
+        parse_speed("0")
+
+
+def test_replay_schedule():
+    untimed = Notification(date="20250627", time="00", step="03", location="s3://flexpart-input/P1S3")
+    assert [offset for offset, _ in replay_schedule(NOTIFICATIONS + [untimed], 10)] == [0.0, 1.0, 2.0]
+    assert [offset for offset, _ in replay_schedule(NOTIFICATIONS + [untimed], None)] == [0.0] * 4
+
+
+def test_replay_runs_orchestrator_against_fake_containers(tmp_path):
+    result = replay(NOTIFICATIONS, None, str(tmp_path), container_seconds=0.2)
+
+    assert (result.events, result.failed) == (3, 0), (tmp_path / "logs" / "replay_000000.log").read_text()
+    assert len(result.latencies) == 3
+    assert result.peak_processes == 3
+    assert result.peak_containers >= 1
+    with sqlite3.connect(tmp_path / "flexprep-db" / "sqlite3-db") as conn:
+        assert sorted(conn.execute("SELECT step FROM uploaded")) == [(0,), (1,), (2,)]
+    assert "3 events" in format_replay(result)
+
+
+def test_format_replay():
+    result = ReplayResult(
+        events=4, failed=1, duration=2.0, latencies=[1.0, 2.0, 3.0, 4.0], peak_processes=4, peak_containers=2
+    )
+    assert format_replay(result).splitlines() == [
+        "Replayed 4 events in 0:00:02 (2.00 events/s), 1 failed",
+        "Latency [s]        p50      p95      p99",
+        "                  2.50     3.85     3.97",
+        "Peak orchestrator processes: 4",
+        "Peak containers: 2",
+    ]
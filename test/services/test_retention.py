@@ -0,0 +1,75 @@
+import datetime
+import os
+import sqlite3
+
+import pytest
+
+from flex_container_orchestrator.config.service_settings import RetentionSettings
+from flex_container_orchestrator.services import retention
+from flex_container_orchestrator.services.retention import (
+    ARCHIVE_TABLE, format_maintenance, maintain, readiness_query_seconds)
+
+NOW = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+
+
+def _flexprep_db(path, days=10):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.executemany(
+        "INSERT INTO uploaded VALUES (?, ?, 1)",
+        [
+            ((NOW - datetime.timedelta(hours=6 * cycle)).isoformat(" "), step)
+            for cycle in range(4 * days) for step in range(10)
+        ],
+    )
+    conn.commit()
+    return conn
+
+
+def test_maintain_archives_rows_beyond_retention_in_batches(tmp_path):
+    db_path = str(tmp_path / "sqlite3-db")
+    conn = _flexprep_db(db_path)
+
+    report = maintain(db_path, RetentionSettings(retention_hours=47, batch_size=7, batch_pause=0))
+
+    # 8 cycles of the last 47 hours are kept
+    assert (report.rows_before, report.archived, report.rows_after) == (400, 320, 80)
+    assert conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_TABLE}").fetchone() == (320,)
+    (oldest,) = conn.execute("SELECT MIN(forecast_ref_time) FROM uploaded").fetchone()
+    assert oldest == (NOW - datetime.timedelta(hours=42)).isoformat(" ")
+    assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall() == [
+        ("uploaded_forecast_ref_time_step",)
+    ]
+    assert not report.vacuumed
+    assert "Archived rows: 320" in format_maintenance(report)
+
+
+def test_maintain_archives_to_attached_database_and_vacuums(tmp_path):
+    db_path = str(tmp_path / "sqlite3-db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.close()
+    _flexprep_db(db_path, days=40).close()
+    archive_path = str(tmp_path / "archive-db")
+    size_before = os.path.getsize(db_path)
+
+    report = maintain(db_path, RetentionSettings(retention_hours=24, archive_path=archive_path, batch_pause=0))
+
+    assert report.vacuumed
+    assert os.path.getsize(db_path) < size_before
+    with sqlite3.connect(archive_path) as archive:
+        assert archive.execute(f"SELECT COUNT(*) FROM {ARCHIVE_TABLE}").fetchone() == (report.archived,)
+
+
+def test_maintain_raises_if_the_database_stays_locked(tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, "BUSY_TIMEOUT", 0.1)
+    db_path = str(tmp_path / "sqlite3-db")
+    writer = _flexprep_db(db_path)
+    assert readiness_query_seconds(writer) > 0
+
+    writer.execute("BEGIN EXCLUSIVE")
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            maintain(db_path, RetentionSettings(batch_pause=0))
+    finally:
+        writer.rollback()
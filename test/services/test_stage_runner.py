@@ -0,0 +1,99 @@
+import datetime
+
+import pytest
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import StageSettings
+from flex_container_orchestrator.services import container_output
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.stage_runner import (
+    RunHistory, StageCancelled, StageError, backoff_delay, compose_command, run_history_key, run_stage,
+    straggler_threshold)
+
+
+def _outcomes():
+    with connect_local_store() as conn:
+        return [outcome for (outcome,) in conn.execute("SELECT outcome FROM stage_runs ORDER BY rowid")]
+
+
+def test_straggler_threshold_requires_history():
+    settings = StageSettings(straggler_factor=3, straggler_min_history=3)
+    assert straggler_threshold([10, 20], settings) is None
+    assert straggler_threshold([10, 20, 30], settings) == 60
+    assert straggler_threshold([10, 20, 30], StageSettings()) is None
+
+
+def test_backoff_delay_is_bounded():
+    settings = StageSettings(backoff_base=10, backoff_max=35)
+    assert [backoff_delay(attempt, settings) for attempt in (1, 2, 3, 4)] == [10, 20, 35, 35]
+
+
+def test_run_stage_retries_transient_failure(local_store, monkeypatch):
+    monkeypatch.setitem(CONFIG.main.stages, "fake", StageSettings(max_attempts=3, backoff_base=0))
+    marker = local_store / "marker"
+    command = ["sh", "-c", f"test -e {marker} || {{ touch {marker}; exit 1; }}"]
+
+    run_stage("fake", command, "fake_run")
+
+    assert _outcomes() == ["failed", "success"]
+
+
+def test_run_stage_times_out(local_store, monkeypatch):
+    monkeypatch.setitem(CONFIG.main.stages, "fake", StageSettings(timeout=0.2, max_attempts=2, backoff_base=0))
+
+    with pytest.raises(StageError):
+        run_stage("fake", ["sleep", "10"], "fake_run")
+
+    assert _outcomes() == ["timeout", "timeout"]
+
+
+def test_run_stage_kills_straggler(local_store, monkeypatch):
+    monkeypatch.setitem(
+        CONFIG.main.stages, "fake", StageSettings(straggler_factor=2, straggler_min_history=3)
+    )
+    with connect_local_store() as conn:
+        history = RunHistory(conn)
+        for _ in range(3):
+            history.record("fake", "old", 1, "success", datetime.datetime(2025, 1, 1), 0.1)
+
+    with pytest.raises(StageError):
+        run_stage("fake", ["sleep", "10"], "fake_run")
+
+    assert _outcomes()[-1] == "straggler"
+
+
+def test_compose_command_passes_environment():
+    command = compose_command("flexpart", volumes=("/data:/scratch/data:ro",), environment={"IBDATE": "20250627"})
+    assert command == [
+        "docker", "compose", "run", "--rm", "--volume", "/data:/scratch/data:ro",
+        "--env", "IBDATE=20250627", "flexpart"
+    ]
+
+
+def test_run_stage_cancelled_is_not_retried(local_store, monkeypatch):
+    monkeypatch.setitem(CONFIG.main.stages, "fake", StageSettings(max_attempts=3, backoff_base=0))
+    monkeypatch.setattr(container_output, "CANCEL_POLL_INTERVAL", 0.05)
+    with pytest.raises(StageCancelled):
+        run_stage("fake", ["sleep", "10"], "fake_run", cancel=lambda: True)
+    assert _outcomes() == ["cancelled"]
+
+
+def test_run_stage_compares_runs_of_the_same_product(local_store, monkeypatch):
+    monkeypatch.setitem(
+        CONFIG.main.stages, "fake", StageSettings(straggler_factor=2, straggler_min_history=3)
+    )
+    long_product = run_history_key("fake", {"PRODUCT": "long"})
+    assert run_history_key("fake", {"PRODUCT": "default"}) == run_history_key("fake") == "fake"
+    with connect_local_store() as conn:
+        history = RunHistory(conn)
+        for _ in range(3):
+            history.record("fake", "old", 1, "success", datetime.datetime(2025, 1, 1), 0.1)
+            history.record(long_product, "old", 1, "success", datetime.datetime(2025, 1, 1), 5)
+
+    # The short runs of the default product do not make the long product a straggler
+    run_stage("fake", ["sleep", "0.5"], "fake_run", history_key=long_product)
+
+    with connect_local_store() as conn:
+        assert RunHistory(conn).durations("fake") == [0.1] * 3
+        assert len(RunHistory(conn).durations(long_product)) == 4
+    assert _outcomes()[-1] == "success"
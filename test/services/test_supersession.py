@@ -0,0 +1,62 @@
+import datetime
+import sqlite3
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.config.service_settings import SupersessionSettings, TimeSettings
+from flex_container_orchestrator.services.supersession import SupersessionCheck, supersession_settings
+
+CONFIG_06 = {
+    "IBDATE": "20231022", "IBTIME": "06", "IEDATE": "20231022", "IETIME": "11",
+    "FORECAST_DATETIME": "202310220600", "RELEASE_SITE_NAME": "BEZ"
+}
+
+
+def _flexprep_db(tmp_path, monkeypatch, rows):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    conn = sqlite3.connect(tmp_path / CONFIG.main.db.name)
+    conn.execute("DROP TABLE IF EXISTS uploaded")
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.executemany(
+        "INSERT INTO uploaded VALUES (?, ?, ?)",
+        [(frt.isoformat(" "), step, processed) for frt, step, processed in rows],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_supersession_settings_per_product(monkeypatch):
+    monkeypatch.setattr(CONFIG.main, "supersession", {"default": SupersessionSettings(enabled=True)})
+    assert supersession_settings(CONFIG_06) is not None
+    assert supersession_settings({**CONFIG_06, "PRODUCT": "other"}) is None
+
+
+def test_window_with_fallback_inputs_is_superseded(tmp_path, monkeypatch):
+    # The 06 run was expected to stop at step 2, so lead times 09-11 fall back to the 00 run
+    time_settings = TimeSettings(tincr=1, tdelta=6, tfreq_f=6, tfreq=6, cycle_horizons={0: 90, 6: 2})
+    settings = SupersessionSettings(enabled=True, check_interval=3600)
+    check = SupersessionCheck(CONFIG_06, settings, time_settings)
+    assert "20231022000009" in check.input_forecasts
+
+    _flexprep_db(tmp_path, monkeypatch, [(datetime.datetime(2023, 10, 22, 0, 0), step, True) for step in range(12)])
+    assert not check()
+
+    _flexprep_db(tmp_path, monkeypatch, [(datetime.datetime(2023, 10, 22, 6, 0), 3, True)])
+    # Polled again within the check interval, the result is not refreshed
+    assert not check()
+    assert check.check() == "input 20231022000009 superseded by 20231022060003"
+    assert check()
+
+
+def test_window_lagging_the_latest_cycle_is_superseded(tmp_path, monkeypatch):
+    time_settings = TimeSettings(tincr=1, tdelta=6, tfreq_f=6, tfreq=6)
+    settings = SupersessionSettings(enabled=True, max_lag_hours=12)
+    _flexprep_db(tmp_path, monkeypatch, [(datetime.datetime(2023, 10, 23, 0, 0), 1, True)])
+
+    assert SupersessionCheck(CONFIG_06, settings, time_settings).check() == "inputs lag IFS run 2023102300 by 18h"
+
+
+def test_missing_database_never_supersedes(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path / "missing"))
+    check = SupersessionCheck(CONFIG_06, SupersessionSettings(enabled=True, max_lag_hours=0))
+    assert check.check() is None
+    assert not (tmp_path / "missing").exists()
@@ -0,0 +1,141 @@
+import contextlib
+import datetime
+import sqlite3
+import threading
+
+from flex_container_orchestrator import CONFIG
+from flex_container_orchestrator.services import watcher
+from flex_container_orchestrator.services.checkpoints import DONE, PYFLEXPLOT, CheckpointStore, window_key
+from flex_container_orchestrator.services.local_store import connect_local_store
+from flex_container_orchestrator.services.watcher import ProcessedStepWatcher, watch
+
+# Reference time of the IFS run of today's 00 UTC cycle, within the lookback of the watcher
+TODAY = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _flexprep_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE uploaded (forecast_ref_time TIMESTAMP, step INTEGER, processed BOOLEAN)")
+    conn.commit()
+    return conn
+
+
+def _process(conn, *steps, reference_time=TODAY):
+    with conn:
+        conn.executemany(
+            "INSERT INTO uploaded VALUES (?, ?, 1)", [(reference_time.isoformat(" "), step) for step in steps]
+        )
+
+
+def test_watcher_reports_newly_processed_steps(tmp_path):
+    db_path = str(tmp_path / "sqlite3-db")
+    step_watcher = ProcessedStepWatcher(db_path, lookback_hours=48)
+    assert step_watcher.poll() == []
+
+    writer = _flexprep_db(db_path)
+    _process(writer, 0, 1)
+    _process(writer, 3, reference_time=TODAY - datetime.timedelta(days=5))
+    assert step_watcher.poll() == [(TODAY, 0), (TODAY, 1)]
+    assert step_watcher.poll() == []
+
+    with writer:
+        writer.execute("INSERT INTO uploaded VALUES (?, 2, 0)", (TODAY.isoformat(" "),))
+    assert step_watcher.poll() == []
+    with writer:
+        writer.execute("UPDATE uploaded SET processed = 1 WHERE step = 2")
+    assert step_watcher.poll() == [(TODAY, 2)]
+
+    step_watcher.forget([(TODAY, 2)])
+    assert step_watcher.poll() == [(TODAY, 2)]
+    step_watcher.close()
+
+
+def test_watch_launches_windows_made_ready_by_database_changes(local_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    monkeypatch.setattr(CONFIG.main.watch, "poll_interval", 0.01)
+    writer = _flexprep_db(tmp_path / CONFIG.main.db.name)
+    # The window starting at 00 takes step 6 of the previous run and steps 1 to 5 of the 00 run
+    _process(writer, 6, reference_time=TODAY - datetime.timedelta(hours=6))
+    _process(writer, 1, 2, 3, 4)
+
+    polls = threading.Condition()
+    poll_count = [0]
+    poll = ProcessedStepWatcher.poll
+
+    def counted_poll(self):
+        steps = poll(self)
+        with polls:
+            poll_count[0] += 1
+            polls.notify_all()
+        return steps
+
+    def wait_for_poll():
+        # The poll in progress may have started before the last commit, the one after it has not
+        with polls:
+            count = poll_count[0]
+            assert polls.wait_for(lambda: poll_count[0] >= count + 2, 5)
+
+    planned = []
+    plan = watcher.plan_ready_windows
+
+    def traced_plan(conn, steps, observe_query=None, exclude_progressive=None):
+        configurations = plan(conn, steps, observe_query, exclude_progressive)
+        planned.extend(config["FORECAST_DATETIME"] for config in configurations)
+        return configurations
+
+    launched = []
+    ready = threading.Event()
+
+    def fake_run_window(date, time, config):
+        launched.append((date, time, config["FORECAST_DATETIME"]))
+        with contextlib.closing(connect_local_store()) as conn:
+            CheckpointStore(conn).mark(f"{date}{time}", PYFLEXPLOT, window_key(config), DONE)
+        ready.set()
+
+    monkeypatch.setattr(ProcessedStepWatcher, "poll", counted_poll)
+    monkeypatch.setattr(watcher, "plan_ready_windows", traced_plan)
+    monkeypatch.setattr(watcher, "run_window", fake_run_window)
+    stop = threading.Event()
+    thread = threading.Thread(target=watch, args=(stop,))
+    thread.start()
+    try:
+        _process(writer, 5)
+        assert ready.wait(5)
+        # Flexprep processes step 5 again, which plans the completed window again
+        with writer:
+            writer.execute("UPDATE uploaded SET processed = 0 WHERE step = 5")
+        wait_for_poll()
+        with writer:
+            writer.execute("UPDATE uploaded SET processed = 1 WHERE step = 5")
+        wait_for_poll()
+    finally:
+        stop.set()
+        thread.join(5)
+
+    assert planned == [TODAY.strftime("%Y%m%d%H%M")] * 2
+    assert launched == [(TODAY.strftime("%Y%m%d"), "00", TODAY.strftime("%Y%m%d%H%M"))]
+
+
+def test_watch_continues_if_the_maintenance_failed(local_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG.main.db, "path", str(tmp_path))
+    monkeypatch.setattr(CONFIG.main.watch, "poll_interval", 0.01)
+    monkeypatch.setattr(CONFIG.main.retention, "enabled", True)
+    writer = _flexprep_db(tmp_path / CONFIG.main.db.name)
+    _process(writer, 6, reference_time=TODAY - datetime.timedelta(hours=6))
+    _process(writer, 1, 2, 3, 4, 5)
+
+    def locked_maintain(db_path, settings):
+        raise sqlite3.OperationalError("database is locked")
+
+    ready = threading.Event()
+    monkeypatch.setattr(watcher, "maintain", locked_maintain)
+    monkeypatch.setattr(watcher, "run_window", lambda date, time, config: ready.set())
+    stop = threading.Event()
+    thread = threading.Thread(target=watch, args=(stop,))
+    thread.start()
+    try:
+        assert ready.wait(5)
+    finally:
+        stop.set()
+        thread.join(5)
+    assert not thread.is_alive()